@@ -0,0 +1,84 @@
+"""
+Generates synthetic playlist trees shaped like junguler's
+m3u-radio-music-playlists checkout, so builds can be measured without it.
+"""
+import os
+import random
+
+COUNTRY_FILES = ('fr', 'de-berlin', 'it', 'es-madrid', 'us-new_york', 'gb', 'nl', 'br')
+GENRE_FILES = ('rock', 'jazz', 'pop', 'blues', 'classical', 'top_40', 'house', 'news_talk')
+# Playlists build_db.py skips, as in the checkout: helper files and the checked/ tree.
+SKIPPED_FILES = ('---everything-full', os.path.join('checked', 'rock'))
+
+# Lines that real playlists occasionally get wrong; build_db.py must ignore or survive them.
+MALFORMED_LINES = (
+    '#EXTINF:-1 tvg-logo="https://logos.example/broken.png" no name and no comma\n',  # no comma: skipped
+    '#EXTINF:-1 tvg-id="dangling",Entry without a URL\n',                             # next #EXTINF replaces it
+    'http://orphan.example:8000/no-extinf\n',                                          # URL without #EXTINF
+    '#EXTINF:-1 tvg-name="Unbalanced, quote,Station with an unbalanced quote\n',
+    '\n',
+    '#EXTVLCOPT:network-caching=1000\n',
+    '   \n',
+)
+
+# Other spellings of a station's URL and name, as different playlists list them.
+URL_VARIANTS = (
+    lambda url, rng: url.replace("http://", "https://", 1),
+    lambda url, rng: url + "/",
+    lambda url, rng: f"{url}?nocache={rng.randrange(10 ** 9)}",
+    lambda url, rng: url.replace("http://", "http://www.", 1),
+    lambda url, rng: url + "/;",
+    # The same station on another port of its server: a mirror rather than a spelling.
+    lambda url, rng: url.replace(":8000/", ":8010/", 1),
+)
+NAME_VARIANTS = (
+    lambda name: name.upper(),
+    lambda name: f" {name} ",
+    lambda name: name.replace(" ", " - "),
+    lambda name: name + "!",
+)
+
+def generate_corpus(root, stations=10000, per_file=500, seed=1, unique_fraction=1 / 3, malformed=0.0, skipped_files=False, variants=0.0):
+    """
+    Writes playlists with about `stations` entries in total under root.
+    URLs repeat across files the way the same station appears in several
+    genre playlists: about unique_fraction of the entries are distinct
+    stations. A `malformed` fraction of the entries is followed by one of
+    MALFORMED_LINES; skipped_files adds the playlists build_db.py ignores.
+    A `variants` fraction of the entries spells the URL and the name of
+    its station differently (URL_VARIANTS, NAME_VARIANTS).
+    Returns the list of written paths.
+    """
+    rng = random.Random(seed)
+    names = COUNTRY_FILES + GENRE_FILES
+    files = max(1, stations // per_file)
+    unique_urls = max(1, int(stations * unique_fraction))
+    paths = []
+    for index in range(files):
+        # Repeating names go into numbered folders; classification only looks at the file name.
+        path = os.path.join(root, f"set{index // len(names)}", f"{names[index % len(names)]}.m3u")
+        write_playlist(path, rng, per_file, unique_urls, malformed, variants)
+        paths.append(path)
+    if skipped_files:
+        for name in SKIPPED_FILES:
+            path = os.path.join(root, f"{name}.m3u")
+            write_playlist(path, rng, per_file, unique_urls, malformed, variants)
+            paths.append(path)
+    return paths
+
+def write_playlist(path, rng, entries, unique_urls, malformed, variants=0.0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("#EXTM3U\n")
+        for _ in range(entries):
+            k = rng.randrange(unique_urls)
+            logo = f' tvg-logo="https://logos.example/{k}.png"' if k % 4 else ''
+            name = f"Station {k}"
+            url = f"http://stream{k % 997}.example:8000/s{k}"
+            if variants and rng.random() < variants:
+                url = rng.choice(URL_VARIANTS)(url, rng)
+                name = rng.choice(NAME_VARIANTS)(name)
+            f.write(f'#EXTINF:-1 tvg-id="st{k}"{logo} group-title="Radio",{name}\n')
+            f.write(f"{url}\n")
+            if malformed and rng.random() < malformed:
+                f.write(rng.choice(MALFORMED_LINES))
@@ -0,0 +1,68 @@
+"""
+Compares the streaming logo extractor (logo_extract.py) with the former
+find_logo_on_website, which built a full BeautifulSoup/lxml tree of the
+whole page, on saved HTML pages.
+
+    python -m benchmarks.logo_extract "Cook Islands"
+"""
+import argparse
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+from logo_extract import CHUNK_SIZE, extract_logo_url
+
+def legacy_find_logo(content, website_url):
+    """The parsing part of the former find_logo_on_website, on an already downloaded page."""
+    soup = BeautifulSoup(content, 'lxml')
+    og_image = soup.find("meta", property="og:image")
+    if og_image and og_image.get("content"):
+        return urljoin(website_url, og_image["content"])
+    icon_link = soup.find("link", rel=["icon", "apple-touch-icon", "shortcut icon"])
+    if icon_link and icon_link.get("href"):
+        return urljoin(website_url, icon_link["href"])
+    for img in soup.find_all("img"):
+        img_src = img.get("src", "").lower()
+        img_alt = img.get("alt", "").lower()
+        if "logo" in img_src or "logo" in img_alt:
+            return urljoin(website_url, img.get("src"))
+    return None
+
+def streamed(content, consumed):
+    """Yields the page in network-sized chunks, counting the bytes handed out."""
+    for start in range(0, len(content), CHUNK_SIZE):
+        chunk = content[start:start + CHUNK_SIZE]
+        consumed[0] += len(chunk)
+        yield chunk
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pages", nargs="+", help="saved HTML pages")
+    parser.add_argument("--base-url", default="https://example.com/", help="URL the pages are resolved against")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per page and extractor")
+    args = parser.parse_args()
+
+    print(f"{'page':<24} {'bytes':>9} {'bs4 ms':>9} {'stream ms':>10} {'read':>9} {'speedup':>8}  same")
+    for page in args.pages:
+        with open(page, 'rb') as f:
+            content = f.read()
+        legacy_seconds, legacy_logo = timed(lambda: legacy_find_logo(content, args.base_url), args.repeat)
+        consumed = [0]
+        stream_seconds, logo = timed(lambda: extract_logo_url(streamed(content, consumed), args.base_url), args.repeat)
+        read = consumed[0] // args.repeat
+        print(
+            f"{page[:24]:<24} {len(content):>9} {legacy_seconds * 1000:>9.2f} {stream_seconds * 1000:>10.2f} "
+            f"{read:>9} {legacy_seconds / stream_seconds:>7.1f}x  {'yes' if logo == legacy_logo else 'no'}"
+        )
+        if logo != legacy_logo:
+            print(f"    bs4: {legacy_logo}\n    stream: {logo}")
+
+if __name__ == '__main__':
+    main()
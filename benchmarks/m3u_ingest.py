@@ -0,0 +1,107 @@
+"""
+Compares the one-pass ingest (build_db.py storing EXTINF attributes while
+parsing) with the former two-pass pipeline: a build that reads only names
+and URLs followed by update_logos.py re-reading every playlist for
+tvg-logo and updating stations one row at a time.
+
+    python -m benchmarks.m3u_ingest --stations 100000
+"""
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+import build_db
+from benchmarks.corpus import generate_corpus
+
+def legacy_parse_m3u(file_path):
+    """parse_m3u as it was before the streaming parser: readlines, name and URL only."""
+    stations = []
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        lines = f.readlines()
+        i = 0
+        while i < len(lines):
+            if lines[i].startswith("#EXTINF"):
+                try:
+                    name = lines[i].split(',', 1)[1].strip()
+                    url = lines[i+1].strip()
+                    stations.append({"name": name, "url": url, "attributes": {}})
+                    i += 2
+                except IndexError:
+                    i += 1
+            else:
+                i += 1
+    return stations
+
+def legacy_update_logo_urls(db_path, m3u_directory):
+    """The former update_logos.py pass: regex per line, one UPDATE per logo."""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    logo_regex = re.compile(r'tvg-logo="([^"]+)"')
+    for m3u_file in glob.glob(os.path.join(m3u_directory, '**', '*.m3u'), recursive=True):
+        with open(m3u_file, 'r', encoding='utf-8', errors='ignore') as f:
+            lines = f.readlines()
+            i = 0
+            while i < len(lines):
+                if lines[i].startswith("#EXTINF"):
+                    if i + 1 < len(lines):
+                        match = logo_regex.search(lines[i])
+                        if match:
+                            c.execute("UPDATE stations SET logo_url = ? WHERE url = ?", (match.group(1), lines[i+1].strip()))
+                    i += 2
+                else:
+                    i += 1
+    conn.commit()
+    conn.close()
+
+def build(db_path, playlist_root, jobs=1):
+    conn = build_db.create_database(db_path)
+    build_db.populate_database(conn, playlist_root, jobs)
+    conn.close()
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def count_logos(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(logo_url) FROM stations").fetchone()[0]
+    conn.close()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stations", type=int, default=50000, help="playlist entries in the synthetic corpus")
+    parser.add_argument("--jobs", type=int, default=1, help="build_db parse workers for both pipelines")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        playlist_root = os.path.join(tmp, "playlists")
+        generate_corpus(playlist_root, args.stations)
+        two_pass_db = os.path.join(tmp, "two_pass.db")
+        one_pass_db = os.path.join(tmp, "one_pass.db")
+
+        results = []
+        with mock.patch("builtins.print"):
+            with mock.patch.object(build_db, "parse_m3u", legacy_parse_m3u):
+                build_seconds = timed(build, two_pass_db, playlist_root, args.jobs)
+            logo_seconds = timed(legacy_update_logo_urls, two_pass_db, playlist_root)
+            one_pass_seconds = timed(build, one_pass_db, playlist_root, args.jobs)
+        results.append(("two-pass: build", build_seconds))
+        results.append(("two-pass: update_logos", logo_seconds))
+        results.append(("two-pass: total", build_seconds + logo_seconds))
+        results.append(("one-pass: build with attributes", one_pass_seconds))
+
+        print(f"{args.stations} playlist entries, {args.jobs} parse job(s)")
+        for label, seconds in results:
+            print(f"{label:<32} {seconds:8.3f}s")
+        print(f"speedup: {(build_seconds + logo_seconds) / one_pass_seconds:.2f}x")
+        print(f"logos stored: two-pass {count_logos(two_pass_db)}, one-pass {count_logos(one_pass_db)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Measures the startup of radio_player.py in three parts: importing the
+module, the database work before and after the window appears, and the time
+from process start until the window with the first page of stations has been
+drawn. Also reports what the modules the player no longer imports at startup
+would cost.
+
+    python -m benchmarks.player_startup --stations 100000
+    python -m benchmarks.player_startup --catalog .
+
+The first-paint run needs a display; without one it is reported as skipped.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import build_db
+from benchmarks.corpus import generate_corpus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules radio_player.py used to import at the top.
+DEFERRED_MODULES = ("vlc", "requests", "PIL.ImageTk", "healthcheck", "logo_extract")
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+FIRST_PAINT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import radio_player
+imported = time.perf_counter()
+times = {}
+def on_first_paint(root):
+    times["first_paint"] = time.perf_counter() - start
+    root.after(0, root.destroy)
+radio_player.main(on_first_paint=on_first_paint)
+print(json.dumps({"import": imported - start, **times}))
+"""
+
+def run_python(script, cwd):
+    """Runs a script in a fresh interpreter; returns its output, or None if it failed."""
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    result = subprocess.run([sys.executable, "-c", script], cwd=cwd, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip().splitlines()[-1]
+
+def cold_import(module, cwd, runs):
+    """Median seconds to import a module in a new process, or None if it is not installed."""
+    times = []
+    for _ in range(runs):
+        output = run_python(IMPORT_SCRIPT.format(module=module), cwd)
+        if output is None:
+            return None
+        times.append(float(output))
+    return statistics.median(times)
+
+def first_paint(cwd, runs):
+    """Median import and first-paint seconds of the player, or None without a display."""
+    results = []
+    for _ in range(runs):
+        output = run_python(FIRST_PAINT_SCRIPT, cwd)
+        if output is None:
+            return None
+        results.append(json.loads(output))
+    return {key: statistics.median(result[key] for result in results) for key in results[0]}
+
+def timed(function, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def database_timings(cwd, runs):
+    """Median seconds of the database steps, in the catalog directory."""
+    from facets import FacetIndex
+    from queries import connect, get_countries, get_genres, get_station_page
+
+    previous = os.getcwd()
+    os.chdir(cwd)
+    try:
+        conn = connect()
+        try:
+            return [
+                ("connect", timed(lambda: connect().close(), runs)),
+                ("first page of stations", timed(lambda: get_station_page(conn), runs)),
+                ("countries and genres (background)", timed(lambda: (get_countries(conn), get_genres(conn)), runs)),
+                ("facet index (background)", timed(lambda: FacetIndex.load(conn), runs)),
+            ]
+        finally:
+            conn.close()
+    finally:
+        os.chdir(previous)
+
+def build_catalog(root, stations):
+    playlist_root = os.path.join(root, "playlists")
+    generate_corpus(playlist_root, stations)
+    with mock.patch("builtins.print"):
+        conn = build_db.create_database(os.path.join(root, build_db.DB_PATH))
+        build_db.populate_database(conn, playlist_root)
+        conn.close()
+
+def report(catalog, runs):
+    print("cold imports (fresh interpreter, median):")
+    player_import = cold_import("radio_player", catalog, runs)
+    print(f"  {'radio_player':<36} {player_import * 1000:8.1f} ms")
+    for module in DEFERRED_MODULES:
+        seconds = cold_import(module, catalog, runs)
+        value = "not installed" if seconds is None else f"{seconds * 1000:8.1f} ms"
+        print(f"  {module + ' (deferred)':<36} {value}")
+
+    print("database (median):")
+    for label, seconds in database_timings(catalog, runs):
+        print(f"  {label:<36} {seconds * 1000:8.1f} ms")
+
+    print("window:")
+    paint = first_paint(catalog, runs)
+    if paint is None:
+        print("  first paint                          skipped (no display)")
+    else:
+        print(f"  {'import radio_player':<36} {paint['import'] * 1000:8.1f} ms")
+        print(f"  {'process start to first paint':<36} {paint['first_paint'] * 1000:8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--catalog", help="directory holding radio.db (default: build a synthetic one)")
+    parser.add_argument("--stations", type=int, default=50000, help="playlist entries of the synthetic catalog")
+    parser.add_argument("--runs", type=int, default=5, help="runs per measurement")
+    args = parser.parse_args()
+
+    if args.catalog:
+        report(os.path.abspath(args.catalog), args.runs)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        build_catalog(tmp, args.stations)
+        print(f"synthetic catalog of {args.stations} playlist entries")
+        report(tmp, args.runs)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Builds one synthetic corpus twice, once grouping spellings and mirrors of a
+station into one row (the default) and once keeping every distinct stream
+URL as its own station (build_db.py --keep-duplicates), and compares the
+catalog size and the player's query times.
+
+    python -m benchmarks.station_grouping --stations 100000 --variants 0.3
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+import build_db
+from benchmarks.corpus import generate_corpus
+from benchmarks.suite import query_timings
+
+def build(db_path, playlist_root, group_duplicates):
+    start = time.perf_counter()
+    with mock.patch("builtins.print"):
+        conn = build_db.create_database(db_path)
+        build_db.populate_database(conn, playlist_root, group_duplicates=group_duplicates)
+        conn.close()
+    return time.perf_counter() - start
+
+def catalog_size(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {
+            "stations": conn.execute("SELECT COUNT(*) FROM stations").fetchone()[0],
+            "station_genres": conn.execute("SELECT COUNT(*) FROM station_genres").fetchone()[0],
+            "mirrors": conn.execute("SELECT COUNT(*) FROM station_mirrors").fetchone()[0],
+            "file MiB": os.path.getsize(db_path) / 2 ** 20,
+        }
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stations", type=int, default=50000, help="playlist entries in the synthetic corpus")
+    parser.add_argument("--variants", type=float, default=0.3, help="share of entries spelling their station differently")
+    parser.add_argument("--runs", type=int, default=20, help="runs per query")
+    args = parser.parse_args()
+
+    from queries import connect
+    with tempfile.TemporaryDirectory() as tmp:
+        playlist_root = os.path.join(tmp, "playlists")
+        generate_corpus(playlist_root, args.stations, variants=args.variants)
+        results = {}
+        for label, group_duplicates in (("one row per URL", False), ("grouped", True)):
+            db_path = os.path.join(tmp, f"{label}.db")
+            build_seconds = build(db_path, playlist_root, group_duplicates)
+            conn = connect(db_path)
+            try:
+                queries = query_timings(conn, args.runs)
+            finally:
+                conn.close()
+            results[label] = (build_seconds, catalog_size(db_path), queries)
+
+    (old_build, old_size, old_queries), (new_build, new_size, new_queries) = results.values()
+    print(f"{args.stations} playlist entries, {args.variants:.0%} spelled differently")
+    print(f"{'':<40} {'per URL':>12} {'grouped':>12}")
+    print(f"{'build s':<40} {old_build:>12.2f} {new_build:>12.2f}")
+    for name in old_size:
+        print(f"{name:<40} {old_size[name]:>12.1f} {new_size[name]:>12.1f}")
+    print(f"catalog: {1 - new_size['stations'] / old_size['stations']:.1%} fewer stations")
+    print(f"\n{'query (median ms)':<40} {'per URL':>12} {'grouped':>12} {'speedup':>8}")
+    for name, old_ms in old_queries.items():
+        new_ms = new_queries[name]
+        print(f"{name:<40} {old_ms:>12.3f} {new_ms:>12.3f} {old_ms / new_ms if new_ms else float('nan'):>7.2f}x")
+
+if __name__ == '__main__':
+    main()
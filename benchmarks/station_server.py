@@ -0,0 +1,139 @@
+"""
+Load test for station_server.py: several client threads send a mix of
+facet, page, detail and search requests over keep-alive connections and
+report requests/sec and latency percentiles, once with plain requests and
+once revalidating with If-None-Match.
+
+    python -m benchmarks.station_server --stations 100000
+    python -m benchmarks.station_server --url http://127.0.0.1:8080
+
+Without --url a server is started in this process on a synthetic catalog.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from unittest import mock
+from urllib.parse import quote, urlsplit
+
+import build_db
+from benchmarks.corpus import generate_corpus
+
+SEARCH_WORDS = ("radio", "fm", "jazz", "rock", "news", "classic", "ra", "be", "hit", "love")
+
+def get_json(connection, target):
+    connection.request("GET", target)
+    response = connection.getresponse()
+    return json.loads(response.read())
+
+def request_mix(connection, rng, count):
+    """Request targets in roughly the proportions a browsing client sends them."""
+    countries = [item["name"] for item in get_json(connection, "/countries")["items"] if item["stations"]]
+    genres = [item["name"] for item in get_json(connection, "/genres")["items"] if item["stations"]]
+    first_page = get_json(connection, "/stations?limit=100")
+    station_ids = [station["id"] for station in first_page["stations"]]
+    targets = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.1:
+            targets.append(rng.choice(("/countries", "/genres")))
+        elif roll < 0.2:
+            targets.append(f"/genres?country={quote(rng.choice(countries))}")
+        elif roll < 0.5:
+            targets.append(f"/stations?country={quote(rng.choice(countries))}")
+        elif roll < 0.65:
+            targets.append(f"/stations?genre={quote(rng.choice(genres))}")
+        elif roll < 0.75 and first_page["next"]:
+            targets.append(f"/stations?after={first_page['next']}")
+        elif roll < 0.85:
+            targets.append(f"/stations/{rng.choice(station_ids)}")
+        else:
+            targets.append(f"/search?q={quote(rng.choice(SEARCH_WORDS))}")
+    return targets
+
+def client(host, port, targets, conditional, latencies, statuses):
+    connection = http.client.HTTPConnection(host, port)
+    etags = {}
+    for target in targets:
+        headers = {"If-None-Match": etags[target]} if conditional and target in etags else {}
+        start = time.perf_counter()
+        connection.request("GET", target, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if response.getheader("ETag"):
+            etags[target] = response.getheader("ETag")
+    connection.close()
+
+def run(host, port, targets_per_client, conditional):
+    latencies = []
+    statuses = {}
+    threads = [
+        threading.Thread(target=client, args=(host, port, targets, conditional, latencies, statuses))
+        for targets in targets_per_client
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    label = "conditional (If-None-Match)" if conditional else "plain"
+    print(
+        f"{label:<28} {len(latencies) / elapsed:9.0f} req/s  p50 {percentile(0.5):6.2f} ms  "
+        f"p99 {percentile(0.99):6.2f} ms  max {latencies[-1] * 1000:7.2f} ms  "
+        f"mean {statistics.mean(latencies) * 1000:6.2f} ms  {dict(sorted(statuses.items()))}"
+    )
+
+def load_test(host, port, clients, requests_per_client, seed):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(host, port)
+    targets_per_client = [request_mix(connection, rng, requests_per_client) for _ in range(clients)]
+    connection.close()
+    print(f"{clients} clients x {requests_per_client} requests against {host}:{port}")
+    run(host, port, targets_per_client, conditional=False)
+    # Each client revalidates its own targets, so repeats in its mix become 304s.
+    run(host, port, targets_per_client, conditional=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="running server to test (default: start one on a synthetic catalog)")
+    parser.add_argument("--stations", type=int, default=50000, help="playlist entries of the synthetic catalog")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client connections")
+    parser.add_argument("--requests", type=int, default=500, help="requests per client and run")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the request mix")
+    args = parser.parse_args()
+
+    if args.url:
+        parts = urlsplit(args.url)
+        load_test(parts.hostname, parts.port or 80, args.clients, args.requests, args.seed)
+        return
+
+    from station_server import make_server
+    with tempfile.TemporaryDirectory() as tmp:
+        playlist_root = os.path.join(tmp, "playlists")
+        db_path = os.path.join(tmp, "radio.db")
+        generate_corpus(playlist_root, args.stations)
+        with mock.patch("builtins.print"):
+            conn = build_db.create_database(db_path)
+            build_db.populate_database(conn, playlist_root)
+            conn.close()
+        server = make_server(db_path, port=0, quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            load_test("127.0.0.1", server.server_address[1], args.clients, args.requests, args.seed)
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.directory.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Benchmark suite: builds synthetic catalogs at several scales and times the
+build, the logo backfill, every query the player runs and filling the
+station list, then writes the results as JSON so two commits can be
+compared.
+
+    python -m benchmarks.suite --scales 1000,10000,100000 --output before.json
+    python -m benchmarks.suite --scales 500000 --runs 3 --output big.json
+    python -m benchmarks.suite --compare before.json after.json
+
+Timings are medians over --runs in milliseconds. The Treeview timings need
+a display; without one they are recorded as null.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from unittest import mock
+
+import build_db
+from benchmarks.corpus import COUNTRY_FILES, GENRE_FILES, generate_corpus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SCALES = "1000,10000,100000"
+# Share of playlist entries followed by a malformed line.
+MALFORMED = 0.01
+# Rows inserted by the Treeview benchmark, the size of the old load-everything list.
+TREE_ROWS = 5000
+# Slowdowns beyond this ratio are flagged by --compare.
+REGRESSION_RATIO = 1.10
+
+def timed(function, runs):
+    """Median milliseconds of function() over runs calls."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def build_timings(tmp, stations, runs):
+    """Generates the corpus and times the build and the logo backfill; returns (db_path, playlist_root, corpus, timings)."""
+    from update_logos import update_logo_urls
+
+    playlist_root = os.path.join(tmp, "playlists")
+    # Small catalogs get smaller playlists, so every country and genre file exists.
+    per_file = max(10, min(500, stations // len(COUNTRY_FILES + GENRE_FILES)))
+    paths = generate_corpus(playlist_root, stations, per_file, malformed=MALFORMED, skipped_files=True)
+    db_path = os.path.join(tmp, "radio.db")
+    timings = {}
+    with mock.patch("builtins.print"):
+        created = []
+        populated = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            conn = build_db.create_database(db_path)
+            created.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            build_db.populate_database(conn, playlist_root)
+            populated.append(time.perf_counter() - start)
+            conn.close()
+        timings["build.create_database"] = statistics.median(created) * 1000
+        timings["build.populate_database"] = statistics.median(populated) * 1000
+        timings["update_logo_urls"] = timed(lambda: update_logo_urls(db_path, playlist_root), runs)
+    corpus = {"files": len(paths), "entries": stations, "bytes": sum(os.path.getsize(path) for path in paths)}
+    return db_path, playlist_root, corpus, timings
+
+def query_timings(conn, runs):
+    """Times each query function radio_player.py calls, with arguments like the UI passes."""
+    from facets import FacetIndex
+    from queries import (
+        get_countries, get_genres, get_genres_for_country, get_countries_for_genre, get_stations,
+        get_station_page, search_stations, set_station_filter, get_now_playing,
+    )
+
+    countries = get_countries(conn)
+    genres = get_genres(conn)
+    # The busiest country and genre make the slowest filters.
+    facet_index = FacetIndex.load(conn)
+    country_counts = facet_index.country_counts([])
+    genre_counts = facet_index.genre_counts([])
+    country = max(country_counts, key=country_counts.get)
+    genre = max(genre_counts, key=genre_counts.get)
+    all_rows = get_stations(conn)
+    middle = all_rows[len(all_rows) // 2]
+    middle_key = (middle[1], middle[0])
+    selection = facet_index.matching_ids(countries[:2], genres[:2])
+
+    queries = {
+        "get_countries": lambda: get_countries(conn),
+        "get_genres": lambda: get_genres(conn),
+        "get_genres_for_country": lambda: get_genres_for_country(conn, country),
+        "get_countries_for_genre": lambda: get_countries_for_genre(conn, genre),
+        "get_stations.all": lambda: get_stations(conn),
+        "get_stations.country": lambda: get_stations(conn, country),
+        "get_stations.genre": lambda: get_stations(conn, genre=genre),
+        "get_stations.country_and_genre": lambda: get_stations(conn, country, genre),
+        "get_station_page.first": lambda: get_station_page(conn),
+        "get_station_page.after": lambda: get_station_page(conn, after=middle_key),
+        "get_station_page.before": lambda: get_station_page(conn, before=middle_key),
+        "get_station_page.country_and_genre": lambda: get_station_page(conn, country, genre),
+        "set_station_filter": lambda: set_station_filter(conn, selection),
+        "get_station_page.selection": lambda: get_station_page(conn, use_selection=True),
+        "search_stations": lambda: search_stations(conn, "station 1"),
+        "search_stations.country": lambda: search_stations(conn, "station", country),
+        "get_now_playing": lambda: get_now_playing(conn, middle[0]),
+        "FacetIndex.load": lambda: FacetIndex.load(conn),
+    }
+    set_station_filter(conn, selection)
+    return {f"query.{name}": timed(query, runs) for name, query in queries.items()}
+
+def treeview_timings(conn, runs):
+    """Times the player's first page and a full list insert into a Treeview; None without a display."""
+    import tkinter as tk
+    from tkinter import ttk
+    from queries import get_stations
+    from radio_player import StationList
+
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    try:
+        root.withdraw()
+        tree = ttk.Treeview(root, columns=("Nome", "URL", "Status", "LogoURL"), show="headings")
+        scrollbar = ttk.Scrollbar(root, orient=tk.VERTICAL, command=tree.yview)
+        station_list = StationList(tree, scrollbar, conn)
+        rows = get_stations(conn)[:TREE_ROWS]
+
+        def first_page():
+            station_list.show_filtered()
+            root.update_idletasks()
+
+        def insert_rows():
+            station_list.show_rows(rows)
+            root.update_idletasks()
+
+        return {
+            "treeview.first_page": timed(first_page, runs),
+            f"treeview.insert_{TREE_ROWS}_rows": timed(insert_rows, runs),
+        }
+    finally:
+        root.destroy()
+
+def run_scale(stations, runs):
+    from queries import connect
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path, playlist_root, corpus, timings = build_timings(tmp, stations, runs)
+        conn = connect(db_path)
+        try:
+            catalog = {"stations": conn.execute("SELECT COUNT(*) FROM stations").fetchone()[0]}
+            timings.update(query_timings(conn, runs))
+            tree = treeview_timings(conn, runs)
+        finally:
+            conn.close()
+    if tree is None:
+        timings["treeview.first_page"] = None
+        timings[f"treeview.insert_{TREE_ROWS}_rows"] = None
+    else:
+        timings.update(tree)
+    return {"corpus": corpus, "catalog": catalog, "timings_ms": timings}
+
+def print_scale(stations, result):
+    print(f"\n{stations} playlist entries: {result['corpus']['files']} files, "
+          f"{result['catalog']['stations']} stations in the catalog")
+    for name, ms in result["timings_ms"].items():
+        value = "skipped (no display)" if ms is None else f"{ms:10.2f} ms"
+        print(f"  {name:<40} {value}")
+
+def compare(old_path, new_path):
+    """Prints each timing of two result files side by side, flagging slowdowns."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"old: {old.get('commit') or old_path}\nnew: {new.get('commit') or new_path}")
+    regressions = 0
+    for scale, result in new["scales"].items():
+        if scale not in old["scales"]:
+            continue
+        print(f"\n{scale} playlist entries")
+        old_timings = old["scales"][scale]["timings_ms"]
+        for name, ms in result["timings_ms"].items():
+            before = old_timings.get(name)
+            if ms is None or not before:
+                continue
+            ratio = ms / before
+            flag = "  slower" if ratio > REGRESSION_RATIO else ""
+            regressions += bool(flag)
+            print(f"  {name:<40} {before:10.2f} {ms:10.2f} ms  x{ratio:5.2f}{flag}")
+    print(f"\n{regressions} timings more than {REGRESSION_RATIO - 1:.0%} slower")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help=f"playlist entries per catalog, comma-separated (default: {DEFAULT_SCALES})")
+    parser.add_argument("--runs", type=int, default=5, help="runs per measurement (default: 5)")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    results = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "scales": {},
+    }
+    for stations in (int(scale) for scale in args.scales.split(",")):
+        result = run_scale(stations, args.runs)
+        results["scales"][str(stations)] = result
+        print_scale(stations, result)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == '__main__':
+    main()
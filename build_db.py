@@ -1,6 +1,21 @@
 import sqlite3
 import os
 import glob
+import time
+import hashlib
+import json
+import re
+import argparse
+import unicodedata
+import uuid
+from array import array
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import metrics
 
 country_codes = {
     "ad": "Andorra", "ae": "United Arab Emirates", "af": "Afghanistan", "ag": "Antigua and Barbuda",
@@ -61,6 +76,9 @@ country_codes = {
     "zw": "Zimbabwe"
 }
 
+DB_PATH = 'radio.db'
+PLAYLIST_ROOT = 'm3u-radio-music-playlists'
+
 # New explicit genre list
 VALID_GENRES = {
     '60s', '70s', '80s', '90s', 'acid_jazz', 'african', 'alternative',
@@ -80,11 +98,223 @@ VALID_GENRES = {
     'france', 'spain', 'italy', 'usa', 'portugal', 'uk' # Added country names that appear as top-level m3u files
 }
 
-def create_database():
-    if os.path.exists('radio.db'):
-        os.remove('radio.db')
+COUNTRY_NAMES_TO_CODES = {v.lower(): k for k, v in country_codes.items()}
+
+# Columns added to stations after the original schema. They are appended to
+# databases built by older versions when an incremental build opens them.
+ADDED_STATION_COLUMNS = (
+    ("attributes", "TEXT"),
+    # Written by healthcheck.py.
+    ("http_code", "INTEGER"),
+    ("ttfb_ms", "REAL"),
+    ("last_checked", "REAL"),
+    ("bitrate", "INTEGER"),
+    ("content_type", "TEXT"),
+    ("icy_name", "TEXT"),
+    ("icy_genre", "TEXT"),
+    ("icy_metaint", "INTEGER"),
+    # Hash of the normalized name and stream host; see station_keys().
+    ("group_key", "INTEGER"),
+)
+
+# Secondary indexes used by the player's queries (see queries.py). They are
+# created after the bulk merge so the load does not maintain them row by row.
+QUERY_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_stations_name ON stations (name)",
+    "CREATE INDEX IF NOT EXISTS idx_stations_country_name ON stations (country_id, name)",
+    "CREATE INDEX IF NOT EXISTS idx_station_genres_genre ON station_genres (genre_id, station_id)",
+    # Genre pages walk this in (name, id) order instead of sorting the whole genre.
+    "CREATE INDEX IF NOT EXISTS idx_station_genres_genre_name ON station_genres (genre_id, name, station_id)",
+)
+
+# Full-text index for the player's search box. The rowid is the station id;
+# host is the stream URL's host name and attributes the EXTINF attribute
+# values other than the logo URL.
+CREATE_STATIONS_FTS = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS stations_fts USING fts5(
+        name, host, attributes,
+        tokenize = "unicode61 remove_diacritics 2",
+        prefix = '2 3'
+    )
+'''
+
+FTS_ROWS_SQL = '''
+    SELECT s.id, s.name, url_host(s.url),
+        (SELECT group_concat(a.value, ' ') FROM json_each(s.attributes) a WHERE a.key <> 'tvg-logo')
+    FROM stations s
+'''
+
+def url_host(url):
+    try:
+        return urlsplit(url).hostname
+    except ValueError:
+        return None
+
+# --- Station identity ---
+# A station is one row however many playlists list it and however its URL
+# is spelled. Every stream URL is reduced to a canonical form, and entries
+# are grouped by the hashes of that form and of (normalized name, host), so
+# grouping is one index lookup per entry rather than a comparison of pairs.
+
+# Query parameters that only defeat caches; other parameters are kept in order.
+CACHE_BUSTING_PARAMS = frozenset(("_", "cb", "cache", "cachebuster", "nocache", "rand", "random", "rnd", "t", "ts", "timestamp"))
+DEFAULT_PORTS = {"http": 80, "https": 443}
+NAME_TOKEN = re.compile(r"\w+")
+# Plain scheme://host[:port][/path][?query][#fragment] URLs, most stream URLs,
+# are split by this instead of urlsplit(); anything else goes through urlsplit().
+PLAIN_URL = re.compile(r"([A-Za-z][A-Za-z0-9+.-]*)://([A-Za-z0-9.-]+)(?::([0-9]{1,5}))?(/[^?#\t\r\n]*)?(?:\?([^#\t\r\n]*))?(?:#[^\t\r\n]*)?\Z")
+
+@lru_cache(maxsize=65536)
+def canonical_url(url):
+    """
+    Returns (host, canonical) for a stream URL. The canonical form leaves out
+    the scheme, a leading "www.", the default port, trailing slashes (and
+    the SHOUTcast "/;" suffix), cache-busting query parameters and the
+    fragment, so http/https and similar spellings of one stream compare equal.
+    """
+    url = url.strip()
+    match = PLAIN_URL.match(url)
+    if match and (match[3] is None or int(match[3]) <= 65535):
+        scheme, host, port, path, query = match.groups()
+        host = host.lower()
+        port = None if port is None else int(port)
+        path = path or ""
+    else:
+        try:
+            parts = urlsplit(url)
+            host = parts.hostname or ""
+            port = parts.port
+        except ValueError:
+            return "", url
+        scheme, path, query = parts.scheme, parts.path, parts.query
+    if host.startswith("www."):
+        host = host[4:]
+    netloc = host if port is None or port == DEFAULT_PORTS.get(scheme.lower()) else f"{host}:{port}"
+    if path.endswith("/;"):
+        path = path[:-2]
+    path = path.rstrip("/")
+    if query:
+        query = "&".join(
+            param for param in query.split("&")
+            if param and param.split("=", 1)[0].lower() not in CACHE_BUSTING_PARAMS
+        )
+        if query:
+            path = f"{path}?{query}"
+    return host, netloc + path
+
+@lru_cache(maxsize=65536)
+def normalized_name(name):
+    """Lower-case words of a station name without accents or punctuation: "Radió  ROCK-FM!" -> "radio rock fm"."""
+    if name.isascii():
+        return " ".join(NAME_TOKEN.findall(name.lower()))
+    decomposed = unicodedata.normalize("NFKD", name)
+    return " ".join(NAME_TOKEN.findall("".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()))
+
+def key_hash(text):
+    """Stable signed 64-bit hash, stored as an SQLite INTEGER."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "big", signed=True)
+
+@lru_cache(maxsize=65536)
+def station_keys(name, url, group_duplicates=True):
+    """
+    Returns (url_key, group_key) for a playlist entry: the hash of its
+    canonical URL, and the hash of its normalized name and host, which is
+    what makes two entries one station. Entries without a usable name or
+    host are grouped by URL alone. With group_duplicates=False every
+    distinct URL is its own station, as before URLs were canonicalized.
+    """
+    if not group_duplicates:
+        return key_hash(url), key_hash("url\0" + url)
+    host, canonical = canonical_url(url)
+    name_key = normalized_name(name)
+    group = f"{name_key}\0{host}" if name_key and host else "url\0" + canonical
+    return key_hash(canonical), key_hash(group)
+
+def built_with_grouping(conn):
+    """
+    Whether the catalog's url_keys were computed with group_duplicates, as
+    recorded by its last build; catalogs that did not record it were
+    grouped, the default.
+    """
+    try:
+        row = conn.execute("SELECT grouped FROM build_info WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        row = None # built before build_info or its grouped column existed
+    return row is None or row[0] is None or bool(row[0])
+# --- End station identity ---
+
+def connect_database(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path)
+    conn.create_function("url_host", 1, url_host, deterministic=True)
+    return conn
+
+# Station ids per country and per genre, read by facets.py in the player.
+FACET_QUERIES = (
+    ("all", "SELECT 0, id FROM stations ORDER BY id"),
+    ("country", "SELECT country_id, id FROM stations WHERE country_id IS NOT NULL ORDER BY country_id, id"),
+    ("genre", "SELECT genre_id, station_id FROM station_genres ORDER BY genre_id, station_id"),
+)
+
+def build_facets(conn):
+    """
+    Rewrites the facets table: for every country and genre (and "all"),
+    the sorted ids of its stations packed as an array of unsigned 32-bit
+    integers. Returns the number of facets written.
+    """
+    c = conn.cursor()
+    c.execute("DELETE FROM facets")
+    written = 0
+    for kind, sql in FACET_QUERIES:
+        rows = c.execute(sql).fetchall()
+        facets = []
+        for facet_id, group in groupby(rows, key=lambda row: row[0]):
+            station_ids = array('I', (station_id for _, station_id in group))
+            facets.append((kind, facet_id, len(station_ids), station_ids.tobytes()))
+        c.executemany(
+            "INSERT INTO facets (kind, facet_id, station_count, station_ids) VALUES (?, ?, ?, ?)",
+            facets
+        )
+        written += len(facets)
+    return written
+
+def create_indexes(conn):
+    for statement in QUERY_INDEXES:
+        conn.execute(statement)
+
+def add_missing_columns(c, table, columns):
+    c.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in c.fetchall()}
+    for name, definition in columns:
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+def add_station_genre_names(c):
+    """
+    Adds the station name to station_genres of databases built before genre
+    pages were sorted by it; merge_staged_stations keeps it set from then on.
+    """
+    c.execute("PRAGMA table_info(station_genres)")
+    if "name" in {row[1] for row in c.fetchall()}:
+        return
+    c.execute("ALTER TABLE station_genres ADD COLUMN name TEXT")
+    c.execute("UPDATE station_genres SET name = (SELECT s.name FROM stations s WHERE s.id = station_genres.station_id)")
+
+def backfill_station_keys(c):
+    """Sets group_key and the mirror row of stations stored before stations were grouped."""
+    rows = c.execute("SELECT id, name, url FROM stations ORDER BY id").fetchall()
+    keys = [(station_id, url, *station_keys(name or "", url)) for station_id, name, url in rows]
+    c.executemany("UPDATE stations SET group_key = ? WHERE id = ?", [(group_key, station_id) for station_id, url, url_key, group_key in keys])
+    # Old catalogs may hold several spellings of one URL; the oldest station keeps it.
+    c.executemany(
+        "INSERT OR IGNORE INTO station_mirrors (url_key, station_id, url) VALUES (?, ?, ?)",
+        [(url_key, station_id, url) for station_id, url, url_key, group_key in keys]
+    )
+
+def create_database(db_path=DB_PATH, reset=True):
+    if reset and os.path.exists(db_path):
+        os.remove(db_path)
         print("Removed old database.")
-    conn = sqlite3.connect('radio.db')
+    conn = connect_database(db_path)
     c = conn.cursor()
 
     c.execute('''
@@ -113,126 +343,662 @@ def create_database():
             FOREIGN KEY (country_id) REFERENCES countries (id)
         )
     ''')
+    add_missing_columns(c, "stations", ADDED_STATION_COLUMNS)
 
     c.execute('''
         CREATE TABLE IF NOT EXISTS station_genres (
             station_id INTEGER,
             genre_id INTEGER,
+            name TEXT,
             FOREIGN KEY (station_id) REFERENCES stations (id),
             FOREIGN KEY (genre_id) REFERENCES genres (id),
             PRIMARY KEY (station_id, genre_id)
         )
     ''')
+    # name is a copy of stations.name, so genre pages are read in index order.
+    add_station_genre_names(c)
+
+    # Manifest of the playlist files the catalog was built from, used by
+    # incremental builds to re-parse only new or changed files.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS playlist_files (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE,
+            size INTEGER,
+            mtime REAL,
+            content_hash TEXT,
+            country_id INTEGER,
+            genre_id INTEGER,
+            FOREIGN KEY (country_id) REFERENCES countries (id),
+            FOREIGN KEY (genre_id) REFERENCES genres (id)
+        )
+    ''')
+
+    # Which playlist files each station was found in, and at which position.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS station_sources (
+            file_id INTEGER,
+            station_id INTEGER,
+            position INTEGER,
+            FOREIGN KEY (file_id) REFERENCES playlist_files (id),
+            FOREIGN KEY (station_id) REFERENCES stations (id),
+            PRIMARY KEY (file_id, station_id)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_station_sources_station ON station_sources (station_id)")
+
+    # Every stream URL a station is listed with, by the hash of its
+    # canonical form; stations.url is the first of them, the others are
+    # mirrors. Looked up for each staged entry, so the index exists from the start.
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'station_mirrors'")
+    mirrors_exist = c.fetchone()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS station_mirrors (
+            url_key INTEGER PRIMARY KEY,
+            station_id INTEGER,
+            url TEXT,
+            FOREIGN KEY (station_id) REFERENCES stations (id)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_station_mirrors_station ON station_mirrors (station_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stations_group_key ON stations (group_key)")
+    if not mirrors_exist:
+        # Databases from older versions get the keys of their stations once.
+        backfill_station_keys(c)
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS facets (
+            kind TEXT,
+            facet_id INTEGER,
+            station_count INTEGER,
+            station_ids BLOB,
+            PRIMARY KEY (kind, facet_id)
+        )
+    ''')
+
+    # One row naming the last build, so readers such as station_server.py
+    # can tell whether anything they cached is still current. grouped tells
+    # update_logos.py how the build computed station_mirrors.url_key.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS build_info (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version TEXT,
+            built_at REAL,
+            station_count INTEGER,
+            grouped INTEGER
+        )
+    ''')
+    add_missing_columns(c, "build_info", (("grouped", "INTEGER"),))
+
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'stations_fts'")
+    fts_exists = c.fetchone()
+    c.execute(CREATE_STATIONS_FTS)
+    if not fts_exists:
+        # Databases from older versions get their search index filled once.
+        c.execute("INSERT INTO stations_fts (rowid, name, host, attributes) " + FTS_ROWS_SQL)
 
     conn.commit()
     print("Database tables created.")
     return conn
 
+# Everything up to the first comma outside double quotes is the header of an
+# #EXTINF line (duration and attributes), the rest is the station name.
+# Lines with unbalanced quotes fall back to the first comma.
+EXTINF_LINE = re.compile(r'#EXTINF:((?:[^,"]|"[^"]*")*),(.*)')
+
+def parse_attributes(header):
+    """
+    Returns the key="value" attributes of an #EXTINF header as a dict.
+    Splitting on quotes is about twice as fast as a findall regex here, and
+    this runs once per playlist entry.
+    """
+    parts = header.split('"')
+    attributes = {}
+    for i in range(0, len(parts) - 1, 2):
+        words = parts[i].split()
+        if words and words[-1].endswith('='):
+            attributes[words[-1][:-1]] = parts[i + 1]
+    return attributes
+
+def parse_extinf(line):
+    """Returns (name, attributes) for an #EXTINF line, or None if it is malformed."""
+    header, separator, name = line.partition(',')
+    if not separator:
+        return None
+    if header.count('"') % 2:
+        # The first comma is inside a quoted attribute value.
+        match = EXTINF_LINE.match(line)
+        if match:
+            header, name = match.groups()
+    if '"' not in header:
+        return name.strip(), {}
+    return name.strip(), parse_attributes(header)
+
+def iter_m3u(file_path):
+    """
+    Streams the entries of an M3U playlist one line at a time. Yields a
+    dict with the station name, its URL and every key="value" attribute of
+    its #EXTINF line (tvg-logo, tvg-id, group-title, ...).
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        pending = None
+        for line in f:
+            if line.startswith("#EXTINF"):
+                pending = parse_extinf(line)
+                continue
+            if pending is None:
+                continue
+            url = line.strip()
+            # Blank lines and directives such as #EXTVLCOPT may sit between
+            # #EXTINF and its URL.
+            if not url or url.startswith('#'):
+                continue
+            name, attributes = pending
+            pending = None
+            yield {"name": name, "url": url, "attributes": attributes}
+
 def parse_m3u(file_path):
-    stations = []
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
-            i = 0
-            while i < len(lines):
-                if lines[i].startswith("#EXTINF"):
-                    try:
-                        name = lines[i].split(',', 1)[1].strip()
-                        url = lines[i+1].strip()
-                        stations.append({"name": name, "url": url})
-                        i += 2
-                    except IndexError:
-                        i += 1
-                else:
-                    i += 1
+        return list(iter_m3u(file_path))
     except Exception as e:
         print(f"Error parsing {file_path}: {e}")
-    return stations
+        return []
+
+# Pragmas applied for the duration of a full build. The database is
+# rebuilt from the playlists, so durability can be traded for speed while it
+# is written.
+BUILD_PRAGMAS = (
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+)
+
+# An incremental build updates a database worth keeping, so it keeps the
+# rollback journal and only relaxes what is safe.
+INCREMENTAL_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+)
+
+RESTORE_PRAGMAS = (
+    "PRAGMA journal_mode = DELETE",
+    "PRAGMA synchronous = FULL",
+)
+
+class PhaseTimer:
+    """Collects wall-clock timings and row counts for each build phase."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        entry = {"name": name, "rows": 0, "seconds": 0.0}
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["seconds"] = time.perf_counter() - start
+            self.phases.append(entry)
+            metrics.observe(f"build_db.{name}", entry["seconds"] * 1000, rows=entry["rows"])
+
+    def report(self):
+        print("\n--- Build timing ---")
+        for entry in self.phases:
+            seconds = entry["seconds"]
+            rate = entry["rows"] / seconds if seconds > 0 else 0.0
+            print(f"{entry['name']:<10} {entry['rows']:>9} rows  {seconds:8.3f}s  {rate:>12.0f} rows/s")
+        total = sum(entry["seconds"] for entry in self.phases)
+        print(f"{'total':<10} {'':>9}       {total:8.3f}s")
+
+def classify_playlist(filepath, country_names_to_codes=COUNTRY_NAMES_TO_CODES):
+    """Returns (country_name, genre_name) for a playlist path, or None to skip it."""
+    filename = os.path.basename(filepath)
+
+    if '---' in filename or 'checked' in filepath.replace(os.path.sep, '/') :
+        return None
+
+    name_part = os.path.splitext(filename)[0].lower()
+
+    current_country_name = None
+    current_genre_name = None
+
+    # 1. Try to identify country from filename (e.g., 'france.m3u', 'de-berlin.m3u')
+    # Check if filename is a full country name (e.g., 'france.m3u')
+    if name_part in country_names_to_codes:
+        current_country_name = country_codes[country_names_to_codes[name_part]]
+    # Check if filename is a country code (e.g., 'fr.m3u')
+    elif name_part in country_codes:
+        current_country_name = country_codes[name_part]
+    # Check for hyphenated country code (e.g., 'de-berlin.m3u')
+    elif '-' in name_part:
+        code_part = name_part.split('-')[0]
+        if code_part in country_codes:
+            current_country_name = country_codes[code_part]
+
+    # 2. Try to identify genre from filename (e.g., 'rock.m3u')
+    if name_part in VALID_GENRES:
+        current_genre_name = name_part.replace('_', ' ').title()
+
+    # If neither country nor genre could be identified, skip this file for now
+    if not current_country_name and not current_genre_name:
+        return None
+
+    return current_country_name, current_genre_name
+
+def resolve_id(c, table, name, cache):
+    """Returns the id for a country or genre name, inserting it on first use."""
+    if name not in cache:
+        c.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+        c.execute(f"SELECT id FROM {table} WHERE name = ?", (name,))
+        cache[name] = c.fetchone()[0]
+    return cache[name]
 
-def populate_database(conn):
+def hash_file(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+ATTRIBUTES_ENCODER = json.JSONEncoder(ensure_ascii=False, check_circular=False)
+
+def staging_rows(stations, group_duplicates=True):
+    """Turns parsed entries into (name, url, logo_url, attributes_json, url_key, group_key) rows."""
+    encode = ATTRIBUTES_ENCODER.encode
+    return [
+        (
+            station["name"], station["url"],
+            station["attributes"].get("tvg-logo") or None,
+            encode(station["attributes"]) if station["attributes"] else None,
+            *station_keys(station["name"], station["url"], group_duplicates),
+        )
+        for station in stations
+    ]
+
+def load_playlist(task, group_duplicates=True):
+    """
+    Classifies, hashes and parses one playlist file. Runs in a worker
+    process when the build uses several jobs, where metrics record nothing,
+    so the time it took is returned for the parent to record. task is
+    (filepath, known_hash) where known_hash comes from the manifest.
+    Returns None if the file is skipped, otherwise (filepath, content_hash,
+    country_name, genre_name, rows, load_ms) with rows set to None when the
+    content is unchanged.
+    """
+    filepath, known_hash = task
+    classification = classify_playlist(filepath)
+    if not classification:
+        return None
+    start = time.perf_counter()
+    content_hash = hash_file(filepath)
+    rows = None
+    if content_hash != known_hash:
+        rows = staging_rows(parse_m3u(filepath), group_duplicates)
+    return (filepath, content_hash, *classification, rows, (time.perf_counter() - start) * 1000)
+
+def load_playlists(tasks, jobs=1, group_duplicates=True):
+    """
+    Yields load_playlist results in the order of tasks. With more than one
+    job the files are parsed in a process pool; results are still returned
+    in input order so the merge stays deterministic.
+    """
+    load = partial(load_playlist, group_duplicates=group_duplicates)
+    if jobs <= 1:
+        yield from map(load, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(load, tasks, chunksize=8)
+
+def manifest_path(filepath, playlist_root):
+    return os.path.relpath(filepath, playlist_root).replace(os.path.sep, '/')
+
+def scan_playlists(conn, playlist_root):
+    """
+    Compares the playlist files on disk with the manifest. Returns
+    (tasks, deleted_file_ids, unchanged_count) where tasks are the
+    load_playlist arguments for new files and files whose size or mtime
+    changed.
+    """
     c = conn.cursor()
-    
-    country_names_to_codes = {v.lower(): k for k, v in country_codes.items()}
+    c.execute("SELECT path, id, size, mtime, content_hash FROM playlist_files")
+    manifest = {row[0]: row[1:] for row in c.fetchall()}
 
-    print("Scanning all .m3u files recursively...")
-    all_m3u_files = glob.glob('m3u-radio-music-playlists/**/*.m3u', recursive=True)
-    
-    print(f"Found {len(all_m3u_files)} playlist files to process.")
+    # Sorted so that "first country wins" does not depend on directory order.
+    all_m3u_files = sorted(glob.glob(os.path.join(playlist_root, '**', '*.m3u'), recursive=True))
+    print(f"Found {len(all_m3u_files)} playlist files.")
 
+    tasks = []
+    unchanged = 0
     for filepath in all_m3u_files:
-        filename = os.path.basename(filepath)
-        
-        if '---' in filename or 'checked' in filepath.replace(os.path.sep, '/') :
-            continue
+        entry = manifest.pop(manifest_path(filepath, playlist_root), None)
+        if entry:
+            _, size, mtime, content_hash = entry
+            stat = os.stat(filepath)
+            if stat.st_size == size and stat.st_mtime == mtime:
+                unchanged += 1
+                continue
+            tasks.append((filepath, content_hash))
+        else:
+            tasks.append((filepath, None))
+
+    deleted_file_ids = [entry[0] for entry in manifest.values()]
+    return tasks, deleted_file_ids, unchanged
+
+def retract_files(c, file_ids):
+    """Removes the station sources of the given playlist files, remembering the stations they touched."""
+    c.executemany("INSERT OR IGNORE INTO retracted_files (file_id) VALUES (?)", [(file_id,) for file_id in file_ids])
+    c.execute('''
+        INSERT OR IGNORE INTO affected_stations (station_id)
+        SELECT ss.station_id FROM station_sources ss
+        JOIN retracted_files rf ON rf.file_id = ss.file_id
+    ''')
+    c.execute("DELETE FROM station_sources WHERE file_id IN (SELECT file_id FROM retracted_files)")
+    c.execute("DELETE FROM retracted_files")
+
+def stage_stations(conn, tasks, deleted_file_ids, playlist_root, jobs=1, group_duplicates=True):
+    """
+    Parses new and changed playlists and writes their entries into a
+    temporary staging table from this process only. Sources of deleted and
+    changed files are retracted and the manifest is updated. Country and
+    genre ids are resolved once per name and kept in memory. Returns a dict
+    of counters.
+    """
+    c = conn.cursor()
+    for table in ("staged_stations", "affected_stations", "retracted_files"):
+        c.execute(f"DROP TABLE IF EXISTS temp.{table}")
+    c.execute('''
+        CREATE TEMP TABLE staged_stations (
+            seq INTEGER PRIMARY KEY,
+            file_id INTEGER,
+            position INTEGER,
+            name TEXT,
+            url TEXT,
+            logo_url TEXT,
+            attributes TEXT,
+            url_key INTEGER,
+            group_key INTEGER,
+            station_id INTEGER
+        )
+    ''')
+    c.execute("CREATE TEMP TABLE affected_stations (station_id INTEGER PRIMARY KEY)")
+    c.execute("CREATE TEMP TABLE retracted_files (file_id INTEGER PRIMARY KEY)")
 
-        name_part = os.path.splitext(filename)[0].lower()
-        
-        current_country_name = None
-        current_genre_name = None
-
-        # 1. Try to identify country from filename (e.g., 'france.m3u', 'de-berlin.m3u')
-        # Check if filename is a full country name (e.g., 'france.m3u')
-        if name_part in country_names_to_codes:
-            current_country_name = country_codes[country_names_to_codes[name_part]]
-        # Check if filename is a country code (e.g., 'fr.m3u')
-        elif name_part in country_codes:
-            current_country_name = country_codes[name_part]
-        # Check for hyphenated country code (e.g., 'de-berlin.m3u')
-        elif '-' in name_part:
-            code_part = name_part.split('-')[0]
-            if code_part in country_codes:
-                current_country_name = country_codes[code_part]
-        
-        # 2. Try to identify genre from filename (e.g., 'rock.m3u')
-        if name_part in VALID_GENRES:
-            current_genre_name = name_part.replace('_', ' ').title()
-
-        # If neither country nor genre could be identified, skip this file for now
-        if not current_country_name and not current_genre_name:
-            # print(f"Skipping file with no clear country or genre: {filepath}") # For debugging
+    counts = {"new": 0, "changed": 0, "touched": 0, "deleted": len(deleted_file_ids), "staged": 0}
+    retract_files(c, deleted_file_ids)
+    c.executemany("DELETE FROM playlist_files WHERE id = ?", [(file_id,) for file_id in deleted_file_ids])
+
+    country_ids = {}
+    genre_ids = {}
+    for result in load_playlists(tasks, jobs, group_duplicates):
+        if not result:
+            metrics.count("build_db.playlists_skipped")
             continue
+        filepath, content_hash, country_name, genre_name, rows, load_ms = result
+        if rows is None:
+            metrics.observe("build_db.load_playlist", load_ms, file=os.path.basename(filepath))
+        else:
+            metrics.observe("build_db.load_playlist", load_ms, file=os.path.basename(filepath), rows=len(rows))
+        path = manifest_path(filepath, playlist_root)
+        stat = os.stat(filepath)
 
-        stations = parse_m3u(filepath)
-        if not stations:
+        if rows is None:
+            # Only the mtime moved, e.g. after a fresh checkout.
+            c.execute("UPDATE playlist_files SET size = ?, mtime = ? WHERE path = ?",
+                      (stat.st_size, stat.st_mtime, path))
+            counts["touched"] += 1
             continue
 
-        genre_id = None
-        if current_genre_name:
-            c.execute("INSERT OR IGNORE INTO genres (name) VALUES (?)", (current_genre_name,))
-            c.execute("SELECT id FROM genres WHERE name = ?", (current_genre_name,))
-            genre_id_result = c.fetchone()
-            if genre_id_result:
-                genre_id = genre_id_result[0]
-
-        country_id = None
-        if current_country_name:
-            c.execute("INSERT OR IGNORE INTO countries (name) VALUES (?)", (current_country_name,))
-            c.execute("SELECT id FROM countries WHERE name = ?", (current_country_name,))
-            country_id_result = c.fetchone()
-            if country_id_result:
-                country_id = country_id_result[0]
-
-        for station in stations:
-            c.execute("INSERT OR IGNORE INTO stations (name, url) VALUES (?, ?)", (station["name"], station["url"]))
-            
-            c.execute("SELECT id FROM stations WHERE url = ?", (station["url"],))
-            station_id_result = c.fetchone()
-            if not station_id_result:
-                continue
-            station_id = station_id_result[0]
+        # Everything but the parsing: manifest, ids and the staging insert.
+        with metrics.timer("build_db.stage_playlist", rows=len(rows)):
+            country_id = None
+            genre_id = None
+            if rows:
+                country_id = resolve_id(c, "countries", country_name, country_ids) if country_name else None
+                genre_id = resolve_id(c, "genres", genre_name, genre_ids) if genre_name else None
+
+            c.execute("SELECT id FROM playlist_files WHERE path = ?", (path,))
+            row = c.fetchone()
+            if row:
+                file_id = row[0]
+                retract_files(c, [file_id])
+                c.execute(
+                    "UPDATE playlist_files SET size = ?, mtime = ?, content_hash = ?, country_id = ?, genre_id = ? WHERE id = ?",
+                    (stat.st_size, stat.st_mtime, content_hash, country_id, genre_id, file_id)
+                )
+                counts["changed"] += 1
+            else:
+                c.execute(
+                    "INSERT INTO playlist_files (path, size, mtime, content_hash, country_id, genre_id) VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime, content_hash, country_id, genre_id)
+                )
+                file_id = c.lastrowid
+                counts["new"] += 1
 
-            if country_id:
-                c.execute("UPDATE stations SET country_id = ? WHERE id = ? AND country_id IS NULL", (country_id, station_id))
+            c.executemany(
+                "INSERT INTO staged_stations (file_id, position, name, url, logo_url, attributes, url_key, group_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(file_id, position, *entry) for position, entry in enumerate(rows)]
+            )
+            counts["staged"] += len(rows)
+    return counts
+
+def merge_staged_stations(conn):
+    """
+    Merges the staging table into stations, station_mirrors and
+    station_sources, then recomputes country and genres of every station
+    whose sources changed. Each entry joins the station that already has its
+    canonical URL, else the first station of its group (see station_keys());
+    a URL listed under several names stays with the group of its first
+    listing. A new station takes its name and URL from its first entry, its
+    other URLs become mirrors. A station takes its logo and EXTINF attributes
+    from the first entry that has them, without replacing a logo it already
+    has; its country comes from the first playlist (by path, then position)
+    that carries one, and it is removed once no playlist lists it any more.
+    Mirrors of entries that are no longer listed stay until the next full
+    build. The search index is refreshed for the same stations. Returns the
+    number of stations in the catalog.
+    """
+    c = conn.cursor()
+    c.execute("CREATE INDEX temp.staged_stations_url_key ON staged_stations (url_key, seq)")
+    # Only URLs listed under more than one group need their first listing's group.
+    c.execute('''
+        UPDATE staged_stations SET group_key = (
+            SELECT first.group_key FROM staged_stations first
+            WHERE first.url_key = staged_stations.url_key
+            ORDER BY first.seq LIMIT 1
+        )
+        WHERE url_key IN (
+            SELECT url_key FROM staged_stations
+            GROUP BY url_key HAVING MIN(group_key) <> MAX(group_key)
+        )
+    ''')
+    c.execute("CREATE INDEX temp.staged_stations_group_key ON staged_stations (group_key, seq)")
 
-            if genre_id:
-                c.execute("INSERT OR IGNORE INTO station_genres (station_id, genre_id) VALUES (?, ?)", (station_id, genre_id))
-        
+    # Entries of stations already in the catalog...
+    c.execute('''
+        UPDATE staged_stations SET station_id = COALESCE(
+            (SELECT m.station_id FROM station_mirrors m WHERE m.url_key = staged_stations.url_key),
+            (SELECT s.id FROM stations s WHERE s.group_key = staged_stations.group_key ORDER BY s.id LIMIT 1)
+        )
+    ''')
+    c.execute('''
+        UPDATE staged_stations SET station_id = (
+            SELECT other.station_id FROM staged_stations other
+            WHERE other.group_key = staged_stations.group_key AND other.station_id IS NOT NULL
+            ORDER BY other.seq LIMIT 1
+        )
+        WHERE station_id IS NULL
+        AND group_key IN (SELECT group_key FROM staged_stations WHERE station_id IS NOT NULL)
+    ''')
+    # ...and one new station per remaining group, from its first entry.
+    c.execute('''
+        INSERT INTO stations (name, url, logo_url, attributes, group_key)
+        SELECT name, url, logo_url, attributes, group_key FROM staged_stations
+        WHERE seq IN (SELECT MIN(seq) FROM staged_stations WHERE station_id IS NULL GROUP BY group_key)
+        ORDER BY seq
+    ''')
+    c.execute('''
+        UPDATE staged_stations SET station_id = (
+            SELECT s.id FROM stations s WHERE s.group_key = staged_stations.group_key ORDER BY s.id LIMIT 1
+        )
+        WHERE station_id IS NULL
+    ''')
+    c.execute("CREATE INDEX temp.staged_stations_station ON staged_stations (station_id, seq)")
+
+    c.execute('''
+        UPDATE stations SET logo_url = (
+            SELECT st.logo_url FROM staged_stations st
+            WHERE st.station_id = stations.id AND st.logo_url IS NOT NULL
+            ORDER BY st.seq LIMIT 1
+        )
+        WHERE logo_url IS NULL
+        AND id IN (SELECT station_id FROM staged_stations WHERE logo_url IS NOT NULL)
+    ''')
+    c.execute('''
+        UPDATE stations SET attributes = (
+            SELECT st.attributes FROM staged_stations st
+            WHERE st.station_id = stations.id AND st.attributes IS NOT NULL
+            ORDER BY st.seq LIMIT 1
+        )
+        WHERE attributes IS NULL
+        AND id IN (SELECT station_id FROM staged_stations WHERE attributes IS NOT NULL)
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO station_mirrors (url_key, station_id, url)
+        SELECT url_key, station_id, url FROM staged_stations ORDER BY seq
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO station_sources (file_id, station_id, position)
+        SELECT file_id, station_id, position FROM staged_stations ORDER BY seq
+    ''')
+    c.execute("INSERT OR IGNORE INTO affected_stations (station_id) SELECT station_id FROM staged_stations")
+
+    c.execute('''
+        DELETE FROM station_genres
+        WHERE station_id IN (SELECT station_id FROM affected_stations)
+    ''')
+    c.execute('''
+        DELETE FROM stations
+        WHERE id IN (SELECT station_id FROM affected_stations)
+        AND NOT EXISTS (SELECT 1 FROM station_sources ss WHERE ss.station_id = stations.id)
+    ''')
+    c.execute('''
+        DELETE FROM station_mirrors
+        WHERE station_id IN (SELECT station_id FROM affected_stations)
+        AND station_id NOT IN (SELECT id FROM stations)
+    ''')
+    c.execute('''
+        UPDATE stations SET country_id = (
+            SELECT f.country_id
+            FROM station_sources ss
+            JOIN playlist_files f ON f.id = ss.file_id
+            WHERE ss.station_id = stations.id AND f.country_id IS NOT NULL
+            ORDER BY f.path, ss.position LIMIT 1
+        )
+        WHERE id IN (SELECT station_id FROM affected_stations)
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO station_genres (station_id, genre_id, name)
+        SELECT ss.station_id, f.genre_id, s.name
+        FROM affected_stations a
+        JOIN station_sources ss ON ss.station_id = a.station_id
+        JOIN playlist_files f ON f.id = ss.file_id
+        JOIN stations s ON s.id = ss.station_id
+        WHERE f.genre_id IS NOT NULL
+    ''')
+
+    c.execute("DELETE FROM stations_fts WHERE rowid IN (SELECT station_id FROM affected_stations)")
+    c.execute(
+        "INSERT INTO stations_fts (rowid, name, host, attributes) " + FTS_ROWS_SQL +
+        " WHERE s.id IN (SELECT station_id FROM affected_stations)"
+    )
+
+    # Drop countries and genres no playlist refers to any more.
+    c.execute("DELETE FROM countries WHERE id NOT IN (SELECT country_id FROM playlist_files WHERE country_id IS NOT NULL)")
+    c.execute("DELETE FROM genres WHERE id NOT IN (SELECT genre_id FROM playlist_files WHERE genre_id IS NOT NULL)")
+
+    c.execute("SELECT COUNT(*) FROM stations")
+    station_count = c.fetchone()[0]
+
+    for table in ("staged_stations", "affected_stations", "retracted_files"):
+        c.execute(f"DROP TABLE temp.{table}")
+    return station_count
+
+def populate_database(conn, playlist_root=PLAYLIST_ROOT, jobs=1, incremental=False, group_duplicates=True):
+    """
+    Builds or updates the catalog from the playlists under playlist_root.
+    group_duplicates=False keeps every distinct stream URL as its own
+    station; an incremental build should use the setting of the build it updates.
+    """
+    timer = PhaseTimer()
+
+    for pragma in INCREMENTAL_PRAGMAS if incremental else BUILD_PRAGMAS:
+        conn.execute(pragma)
+
+    with timer.phase("scan") as phase:
+        print("Scanning all .m3u files recursively...")
+        tasks, deleted_file_ids, unchanged = scan_playlists(conn, playlist_root)
+        print(f"{len(tasks)} new or modified, {unchanged} unchanged, {len(deleted_file_ids)} deleted.")
+        phase["rows"] = len(tasks) + unchanged
+
+    # Everything is written in a single transaction.
+    with timer.phase("parse") as phase:
+        if jobs > 1:
+            print(f"Parsing playlists with {jobs} worker processes...")
+        counts = stage_stations(conn, tasks, deleted_file_ids, playlist_root, jobs, group_duplicates)
+        phase["rows"] = counts["staged"]
+
+    with timer.phase("merge") as phase:
+        if not incremental:
+            # As many stations as the catalog had when each distinct URL was one.
+            counts["urls"] = conn.execute("SELECT COUNT(DISTINCT url) FROM staged_stations").fetchone()[0]
+        station_count = merge_staged_stations(conn)
         conn.commit()
+        phase["rows"] = counts["staged"]
+
+    with timer.phase("index") as phase:
+        create_indexes(conn)
+        # Planner statistics; cheap to refresh after a full build.
+        conn.execute("PRAGMA optimize" if incremental else "ANALYZE")
+        conn.commit()
+        phase["rows"] = station_count
+
+    with timer.phase("facets") as phase:
+        phase["rows"] = build_facets(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO build_info (id, version, built_at, station_count, grouped) VALUES (1, ?, ?, ?, ?)",
+            (uuid.uuid4().hex, time.time(), station_count, int(group_duplicates))
+        )
+        conn.commit()
+
+    if not incremental:
+        for pragma in RESTORE_PRAGMAS:
+            conn.execute(pragma)
+
+    print(f"\nDatabase population complete: {station_count} unique stations.")
+    print(f"Playlists: {counts['new']} new, {counts['changed']} changed, "
+          f"{counts['touched']} touched but identical, {counts['deleted']} deleted.")
+    if counts.get("urls"):
+        mirrors = conn.execute("SELECT COUNT(*) FROM station_mirrors").fetchone()[0] - station_count
+        print(f"Grouping: {counts['urls']} distinct stream URLs became {station_count} stations "
+              f"with {mirrors} mirror URLs, {1 - station_count / counts['urls']:.1%} fewer rows.")
+    timer.report()
 
-    print("\nDatabase population complete.")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build radio.db from the junguler M3U playlists.")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of worker processes used to parse playlists (default: 1)")
+    parser.add_argument("--incremental", "-i", action="store_true",
+                        help="update the existing radio.db, re-parsing only new or changed playlists")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="keep every distinct stream URL as its own station instead of grouping spellings and mirrors")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    db_conn = create_database()
-    populate_database(db_conn)
+    args = parse_args()
+    db_conn = create_database(reset=not args.incremental)
+    populate_database(db_conn, jobs=args.jobs, incremental=args.incremental, group_duplicates=not args.keep_duplicates)
     db_conn.close()
-    print("Database created and populated successfully.")
\ No newline at end of file
+    print("Database created and populated successfully.")
@@ -0,0 +1,105 @@
+"""
+In-memory facet index for the player's country and genre filters.
+
+build_db.py stores the sorted station ids of every country and genre in the
+facets table. They are loaded once into Python integers used as bitmaps
+(bit n set = station n belongs to the facet), so combining a selection and
+counting the stations behind every listbox entry are a handful of big-integer
+AND/OR operations and popcounts instead of SQL joins.
+"""
+from array import array
+from itertools import compress
+
+# int.bit_count() is only available from Python 3.10.
+popcount = getattr(int, "bit_count", None) or (lambda bitmap: bin(bitmap).count("1"))
+
+BIT_TABLE = bytes.maketrans(b"01", b"\x00\x01")
+
+FACETS_SQL = """
+    SELECT f.kind, COALESCE(c.name, g.name), f.station_ids
+    FROM facets f
+    LEFT JOIN countries c ON f.kind = 'country' AND c.id = f.facet_id
+    LEFT JOIN genres g ON f.kind = 'genre' AND g.id = f.facet_id
+"""
+
+def bitmap_from_ids(station_ids):
+    """Builds a bitmap from sorted station ids."""
+    if not station_ids:
+        return 0
+    bits = bytearray((station_ids[-1] >> 3) + 1)
+    for station_id in station_ids:
+        bits[station_id >> 3] |= 1 << (station_id & 7)
+    return int.from_bytes(bits, "little")
+
+def ids_from_bitmap(bitmap):
+    """Returns the sorted station ids whose bits are set."""
+    # bin() and translate() run in C; reversing puts bit n at index n.
+    bits = bin(bitmap)[:1:-1].encode().translate(BIT_TABLE)
+    return list(compress(range(len(bits)), bits))
+
+class FacetIndex:
+    """
+    Station bitmaps per country and per genre. A station has at most one
+    country, so selected countries are always combined with OR; selected
+    genres are combined with OR ("any") or AND ("all").
+    """
+
+    def __init__(self, countries, genres, all_stations):
+        self.countries = countries # name -> bitmap
+        self.genres = genres # name -> bitmap
+        self.all_stations = all_stations
+
+    @classmethod
+    def load(cls, conn):
+        countries = {}
+        genres = {}
+        all_stations = 0
+        for kind, name, blob in conn.execute(FACETS_SQL):
+            station_ids = array('I')
+            station_ids.frombytes(blob)
+            bitmap = bitmap_from_ids(station_ids)
+            if kind == "country" and name is not None:
+                countries[name] = bitmap
+            elif kind == "genre" and name is not None:
+                genres[name] = bitmap
+            elif kind == "all":
+                all_stations = bitmap
+        return cls(countries, genres, all_stations)
+
+    def country_mask(self, countries):
+        if not countries:
+            return self.all_stations
+        mask = 0
+        for name in countries:
+            mask |= self.countries.get(name, 0)
+        return mask
+
+    def genre_mask(self, genres, mode="any"):
+        if not genres:
+            return self.all_stations
+        if mode == "all":
+            mask = self.all_stations
+            for name in genres:
+                mask &= self.genres.get(name, 0)
+            return mask
+        mask = 0
+        for name in genres:
+            mask |= self.genres.get(name, 0)
+        return mask
+
+    def matching(self, countries, genres, mode="any"):
+        """Bitmap of the stations matching the selection."""
+        return self.country_mask(countries) & self.genre_mask(genres, mode)
+
+    def matching_ids(self, countries, genres, mode="any"):
+        return ids_from_bitmap(self.matching(countries, genres, mode))
+
+    def country_counts(self, genres, mode="any"):
+        """Stations per country within the current genre selection."""
+        mask = self.genre_mask(genres, mode)
+        return {name: popcount(bitmap & mask) for name, bitmap in self.countries.items()}
+
+    def genre_counts(self, countries):
+        """Stations per genre within the current country selection."""
+        mask = self.country_mask(countries)
+        return {name: popcount(bitmap & mask) for name, bitmap in self.genres.items()}
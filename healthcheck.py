@@ -0,0 +1,221 @@
+import sqlite3
+import requests
+import argparse
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import urlparse
+
+from build_db import DB_PATH, ADDED_STATION_COLUMNS, add_missing_columns
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
+
+# Results are written back in batches, each in its own transaction.
+BATCH_SIZE = 200
+
+# Response headers stored per station, in the order of STREAM_COLUMNS.
+STREAM_HEADERS = ("icy-br", "Content-Type", "icy-name", "icy-genre", "icy-metaint")
+STREAM_COLUMNS = ("bitrate", "content_type", "icy_name", "icy_genre", "icy_metaint")
+NO_STREAM_INFO = (None,) * len(STREAM_COLUMNS)
+
+# Stream details are kept from the last successful probe when a probe fails.
+UPDATE_STATUS_SQL = """
+    UPDATE stations SET status = ?, http_code = ?, ttfb_ms = ?, last_checked = ?,
+        bitrate = COALESCE(?, bitrate), content_type = COALESCE(?, content_type),
+        icy_name = COALESCE(?, icy_name), icy_genre = COALESCE(?, icy_genre),
+        icy_metaint = COALESCE(?, icy_metaint)
+    WHERE id = ?
+"""
+
+CODEC_NAMES = {
+    "audio/mpeg": "MP3",
+    "audio/mp3": "MP3",
+    "audio/aac": "AAC",
+    "audio/aacp": "AAC+",
+    "audio/x-aac": "AAC",
+    "audio/ogg": "Ogg",
+    "application/ogg": "Ogg",
+    "audio/opus": "Opus",
+    "audio/flac": "FLAC",
+    "audio/x-mpegurl": "M3U",
+    "application/vnd.apple.mpegurl": "HLS",
+    "audio/x-scpls": "PLS",
+}
+
+_local = threading.local()
+
+def thread_session():
+    """One requests.Session per worker thread, so connections are reused within a thread."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers['User-Agent'] = USER_AGENT
+        # Asks Icecast/SHOUTcast servers for their icy-* headers.
+        session.headers['Icy-MetaData'] = '1'
+        _local.session = session
+    return session
+
+def header_text(value):
+    """icy-* headers are often UTF-8 although HTTP headers are decoded as Latin-1."""
+    try:
+        return value.encode("latin-1").decode("utf-8").strip()
+    except UnicodeError:
+        return value.strip()
+
+def header_int(value):
+    """Leading integer of a header such as "128" or "128,128"."""
+    match = re.match(r"\s*(\d+)", value)
+    return int(match.group(1)) if match else None
+
+def parse_stream_headers(headers):
+    """Returns the STREAM_COLUMNS values found in the response headers."""
+    bitrate, content_type, name, genre, metaint = (headers.get(header) for header in STREAM_HEADERS)
+    return (
+        header_int(bitrate) if bitrate else None,
+        content_type.split(";")[0].strip().lower() if content_type else None,
+        header_text(name) if name else None,
+        header_text(genre) if genre else None,
+        header_int(metaint) if metaint else None,
+    )
+
+def stream_format(bitrate, content_type):
+    """Short label such as "128 kbps MP3", or "" when nothing is known."""
+    parts = []
+    if bitrate:
+        parts.append(f"{bitrate} kbps")
+    if content_type:
+        parts.append(CODEC_NAMES.get(content_type, content_type))
+    return " ".join(parts)
+
+def probe_url(url, timeout=5, session=None):
+    """
+    Requests a stream and closes it as soon as the response headers have
+    arrived, without reading any audio. Returns (status, http_code,
+    ttfb_ms, stream_info); http_code and ttfb_ms are None and stream_info
+    is NO_STREAM_INFO when no response was received.
+    """
+    session = session or thread_session()
+    start = time.perf_counter()
+    try:
+        # Leaving the block closes the unread response, which drops the
+        # connection instead of draining the stream into the pool.
+        with session.get(url, stream=True, timeout=timeout) as response:
+            ttfb_ms = (time.perf_counter() - start) * 1000
+            status = "Online" if response.status_code == 200 else "Offline"
+            return status, response.status_code, ttfb_ms, parse_stream_headers(response.headers)
+    except requests.exceptions.RequestException:
+        return "Offline", None, None, NO_STREAM_INFO
+
+class HostLimiter:
+    """Caps the number of concurrent probes against the same host."""
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    def semaphore(self, url):
+        host = urlparse(url).hostname or ''
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.semaphores[host]
+
+def interleave_by_host(stations):
+    """
+    Orders stations round-robin across hosts, so that the workers are not
+    all parked on the semaphore of one big streaming provider.
+    """
+    by_host = {}
+    for station in stations:
+        by_host.setdefault(urlparse(station[1]).hostname, []).append(station)
+    queues = list(by_host.values())
+    ordered = []
+    for index in range(max((len(queue) for queue in queues), default=0)):
+        ordered.extend(queue[index] for queue in queues if index < len(queue))
+    return ordered
+
+def check_station(station_id, url, limiter, timeout):
+    with limiter.semaphore(url):
+        status, http_code, ttfb_ms, stream_info = probe_url(url, timeout)
+    return station_id, status, http_code, ttfb_ms, time.time(), stream_info
+
+def check_stations(conn, stations, workers=32, per_host=2, timeout=5):
+    """
+    Probes (station_id, url) pairs concurrently and writes status, HTTP
+    code, time to first byte, check time and stream details to the
+    stations table in batches. Returns a dict of counters.
+    """
+    limiter = HostLimiter(per_host)
+    counts = {"Online": 0, "Offline": 0}
+    batch = []
+    total = len(stations)
+    start = time.perf_counter()
+
+    def flush():
+        conn.executemany(UPDATE_STATUS_SQL, [(status, code, ttfb, checked, *info, sid) for sid, status, code, ttfb, checked, info in batch])
+        conn.commit()
+        batch.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(check_station, station_id, url, limiter, timeout)
+            for station_id, url in interleave_by_host(stations)
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            counts[result[1]] += 1
+            batch.append(result)
+            if len(batch) >= BATCH_SIZE:
+                flush()
+                elapsed = time.perf_counter() - start
+                print(f"[{done}/{total}] {counts['Online']} online, {counts['Offline']} offline, {done / elapsed:.1f} stations/s")
+    if batch:
+        flush()
+    return counts
+
+def stations_to_check(conn, older_than=None, limit=None):
+    """Stations never checked or last checked more than older_than seconds ago."""
+    query = "SELECT id, url FROM stations WHERE url LIKE 'http%'"
+    params = []
+    if older_than is not None:
+        query += " AND (last_checked IS NULL OR last_checked < ?)"
+        params.append(time.time() - older_than)
+    query += " ORDER BY last_checked IS NOT NULL, last_checked, id"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check every station in radio.db and store the results.")
+    parser.add_argument("--db", default=DB_PATH, help="database to update (default: radio.db)")
+    parser.add_argument("--workers", type=int, default=32, help="concurrent probes (default: 32)")
+    parser.add_argument("--per-host", type=int, default=2, help="concurrent probes per host (default: 2)")
+    parser.add_argument("--timeout", type=float, default=5, help="connect/read timeout in seconds (default: 5)")
+    parser.add_argument("--older-than", type=float, help="only check stations not checked in this many seconds")
+    parser.add_argument("--limit", type=int, help="check at most this many stations")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start_time = datetime.now()
+    print(f"--- Health check started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')} ---")
+
+    conn = sqlite3.connect(args.db)
+    add_missing_columns(conn.cursor(), "stations", ADDED_STATION_COLUMNS)
+    stations = stations_to_check(conn, args.older_than, args.limit)
+    print(f"Checking {len(stations)} stations with {args.workers} workers ({args.per_host} per host)...")
+    counts = check_stations(conn, stations, args.workers, args.per_host, args.timeout)
+    conn.close()
+
+    duration = datetime.now() - start_time
+    print("\n--- HEALTH CHECK COMPLETE ---")
+    print(f"Total duration: {str(duration).split('.')[0]}")
+    print(f"Online:  {counts['Online']}")
+    print(f"Offline: {counts['Offline']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Two-level cache for station logos.
+
+Ready PhotoImage objects are kept in a small in-memory LRU, so selecting a
+station again shows its logo at once. Below it, 100px PNG thumbnails are
+stored on disk under the SHA-1 of their content, with an SQLite index that
+maps each logo URL to its thumbnail and the ETag/Last-Modified validators of
+the download. The disk store is trimmed to a size limit, least recently used
+thumbnails first, and entries older than REVALIDATE_AFTER are checked with a
+conditional request instead of being downloaded again.
+"""
+import hashlib
+import io
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+LOGO_CACHE_DIR = 'logo_cache'
+ICON_PACK_PATH = 'logo_icons.pack'
+# RIC1 packs were keyed by station id, which a full rebuild of radio.db renumbers.
+PACK_MAGIC = b"RIC2"
+THUMBNAIL_WIDTH = 100
+
+MEMORY_ITEMS = 256
+DISK_BYTES = 64 * 1024 * 1024
+# Seconds before a cached logo is revalidated against its server.
+REVALIDATE_AFTER = 7 * 24 * 3600
+
+CREATE_INDEX_SQL = """
+    CREATE TABLE IF NOT EXISTS sources (
+        url TEXT PRIMARY KEY,
+        digest TEXT NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        checked_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_sources_digest ON sources (digest);
+    CREATE TABLE IF NOT EXISTS thumbnails (
+        digest TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_thumbnails_last_used ON thumbnails (last_used);
+"""
+
+def make_thumbnail(image_data, width=THUMBNAIL_WIDTH, height=None):
+    """
+    Decodes an image and returns it as PNG bytes resized to the given
+    width, keeping the aspect ratio. With a height, the image is instead
+    fitted inside a width x height box.
+    """
+    # Pillow is imported on first use to keep it off the player's startup path.
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_data))
+    # Lets JPEG decode at a reduced scale; a no-op for other formats.
+    image.draft("RGB", (width, height or width))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    scale = width / image.width
+    if height is not None:
+        scale = min(scale, height / image.height)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    image = image.resize(size, Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
+class LogoCache:
+    """
+    photo() and put_photo() are only called from the Tk thread; thumbnail()
+    and add() do the disk and network work and may run in any thread.
+    """
+
+    def __init__(self, cache_dir=LOGO_CACHE_DIR, max_bytes=DISK_BYTES, memory_items=MEMORY_ITEMS, revalidate_after=REVALIDATE_AFTER):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.revalidate_after = revalidate_after
+        self.photos = OrderedDict() # logo url -> PhotoImage
+        # Logo urls found by the lazy scrape this session (None: nothing found),
+        # so selecting the station again does not repeat the lookup.
+        self.scraped = {} # station_id -> logo url or None
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.db'), check_same_thread=False)
+        self.conn.executescript(CREATE_INDEX_SQL)
+
+    # --- Memory level ---
+    def photo(self, url):
+        photo = self.photos.get(url)
+        if photo is not None:
+            self.photos.move_to_end(url)
+        return photo
+
+    def put_photo(self, url, photo):
+        self.photos[url] = photo
+        self.photos.move_to_end(url)
+        while len(self.photos) > self.memory_items:
+            self.photos.popitem(last=False)
+
+    # --- Disk level ---
+    def path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest + '.png')
+
+    def read(self, digest):
+        try:
+            with open(self.path(digest), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def thumbnail(self, url, timeout=5):
+        """
+        Returns the PNG thumbnail of the logo at url, from disk when
+        possible. Raises requests exceptions for network and HTTP errors and
+        Pillow exceptions for images it cannot decode.
+        """
+        import requests
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest, etag, last_modified, checked_at FROM sources WHERE url = ?", (url,)
+            ).fetchone()
+        data = self.read(row[0]) if row else None
+        headers = {}
+        if data is not None:
+            digest, etag, last_modified, checked_at = row
+            if time.time() - checked_at < self.revalidate_after:
+                self.touch(digest)
+                return data
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = requests.get(url, timeout=timeout, headers=headers)
+        if data is not None and response.status_code == 304:
+            with self.lock:
+                self.conn.execute("UPDATE sources SET checked_at = ? WHERE url = ?", (time.time(), url))
+                self.conn.commit()
+            self.touch(digest)
+            return data
+        response.raise_for_status()
+        return self.add(url, response.content, response.headers)
+
+    def add(self, url, image_data, headers=None):
+        """Thumbnails a downloaded logo, stores it and returns the PNG bytes."""
+        data = make_thumbnail(image_data)
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write under a temporary name so a reader never sees half a file.
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        headers = headers or {}
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (url, digest, etag, last_modified, checked_at) VALUES (?, ?, ?, ?, ?)",
+                (url, digest, headers.get('ETag'), headers.get('Last-Modified'), now),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO thumbnails (digest, size, last_used) VALUES (?, ?, ?)",
+                (digest, len(data), now),
+            )
+            self.evict()
+            self.conn.commit()
+        return data
+
+    def touch(self, digest):
+        with self.lock:
+            self.conn.execute("UPDATE thumbnails SET last_used = ? WHERE digest = ?", (time.time(), digest))
+            self.conn.commit()
+
+    def evict(self):
+        """Deletes least recently used thumbnails until the store fits in max_bytes. Holds self.lock."""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM thumbnails").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for digest, size in self.conn.execute("SELECT digest, size FROM thumbnails ORDER BY last_used"):
+            evicted.append((digest,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self.conn.executemany("DELETE FROM thumbnails WHERE digest = ?", evicted)
+        self.conn.executemany("DELETE FROM sources WHERE digest = ?", evicted)
+        for (digest,) in evicted:
+            try:
+                os.remove(self.path(digest))
+            except OSError:
+                pass
+
+    def close(self):
+        self.conn.close()
+
+def icon_key(logo_url):
+    """Key of a logo in the icon pack: the first 8 bytes of the BLAKE2b of its URL."""
+    return int.from_bytes(hashlib.blake2b(logo_url.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+
+class IconPack:
+    """
+    Read-only, memory-mapped view of the icon pack written by
+    prerender_logos.py. Icons are keyed by icon_key() of the logo URL, so a
+    pack stays right when radio.db is rebuilt. get() returns the PNG bytes
+    of the icon of a logo URL, or None.
+    """
+
+    def __init__(self, path=ICON_PACK_PATH):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:4] != PACK_MAGIC:
+            raise ValueError(f"{path} is not an icon pack")
+        view = memoryview(self.map)
+        count = view[4:8].cast('I')[0]
+        self.keys = view[8:8 + 8 * count].cast('Q')
+        self.offsets = view[8 + 8 * count:8 + 12 * count].cast('I')
+        self.lengths = view[8 + 12 * count:8 + 16 * count].cast('I')
+
+    @classmethod
+    def open(cls, path=ICON_PACK_PATH):
+        """Returns the pack at path, or None if there is none yet or it has an older layout."""
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except ValueError as e:
+            print(f"Ignoring {path}: {e}. Run prerender_logos.py again.")
+            return None
+
+    def index(self, logo_url):
+        if not logo_url:
+            return None
+        key = icon_key(logo_url)
+        index = bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            return None
+        return index
+
+    def slot(self, logo_url):
+        """Offset of a logo's icon; logos with the same image share a slot."""
+        index = self.index(logo_url)
+        return None if index is None else self.offsets[index]
+
+    def get(self, logo_url):
+        index = self.index(logo_url)
+        if index is None:
+            return None
+        offset = self.offsets[index]
+        return self.map[offset:offset + self.lengths[index]]
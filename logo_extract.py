@@ -0,0 +1,125 @@
+"""
+Finds a station logo on a website's home page without downloading or
+parsing the whole page.
+
+The page is streamed through an incremental HTMLParser. An og:image meta tag
+ends the search at once; an icon <link> ends it at the end of <head>, where
+no og:image can follow any more. Only when <head> has neither are <img> tags
+scanned for "logo", at most MAX_IMG_TAGS of them, and no more than
+MAX_PAGE_BYTES are ever read.
+"""
+import codecs
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+
+MAX_PAGE_BYTES = 512 * 1024
+MAX_IMG_TAGS = 200
+CHUNK_SIZE = 16 * 1024
+
+ICON_RELS = {"icon", "apple-touch-icon"}
+
+class LogoParser(HTMLParser):
+    """Feeds on HTML text until `done`; `logo` is then the best candidate, if any."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.og_image = None
+        self.icon = None
+        self.img = None
+        self.in_head = True
+        self.img_tags = 0
+        self.done = False
+
+    @property
+    def logo(self):
+        return self.og_image or self.icon or self.img
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "meta":
+            attrs = dict(attrs)
+            if (attrs.get("property") or attrs.get("name")) == "og:image" and attrs.get("content"):
+                self.og_image = attrs["content"]
+                self.done = True
+        elif tag == "link":
+            if self.icon is None:
+                attrs = dict(attrs)
+                if ICON_RELS & set((attrs.get("rel") or "").lower().split()) and attrs.get("href"):
+                    self.icon = attrs["href"]
+        elif tag == "body":
+            self.end_head()
+        elif tag == "img" and not self.in_head:
+            self.img_tags += 1
+            attrs = dict(attrs)
+            src = attrs.get("src") or ""
+            if "logo" in src.lower() or "logo" in (attrs.get("alt") or "").lower():
+                if src:
+                    self.img = src
+                    self.done = True
+            if self.img_tags >= MAX_IMG_TAGS:
+                self.done = True
+
+    handle_startendtag = handle_starttag
+
+    def handle_endtag(self, tag):
+        if tag == "head" and not self.done:
+            self.end_head()
+
+    def end_head(self):
+        self.in_head = False
+        if self.icon is not None:
+            self.done = True
+
+def extract_logo_url(chunks, base_url, encoding="utf-8", max_bytes=MAX_PAGE_BYTES):
+    """
+    Parses byte chunks of a page until a logo is found or max_bytes have been
+    read. Returns the absolute logo URL or None. Stops consuming chunks as
+    soon as the answer is known.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = LogoParser()
+    read = 0
+    for chunk in chunks:
+        chunk = chunk[:max_bytes - read]
+        read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done or read >= max_bytes:
+            break
+    logo = parser.logo
+    return urljoin(base_url, logo) if logo else None
+
+def logo_from_response(response, max_bytes=MAX_PAGE_BYTES, on_chunk=None):
+    """
+    Streams a requests response (opened with stream=True) through the
+    extractor. on_chunk is called before every chunk and may raise to abort,
+    for example when a deadline has passed.
+    """
+    def chunks():
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if on_chunk is not None:
+                on_chunk()
+            yield chunk
+    # Without a charset requests assumes ISO-8859-1 for text/html; HTML
+    # pages without one are far more often UTF-8.
+    encoding = response.encoding if 'charset' in response.headers.get('Content-Type', '') else 'utf-8'
+    return extract_logo_url(chunks(), response.url, encoding or 'utf-8', max_bytes)
+
+def find_logo_on_website(website_url, timeout=10, session=None, on_chunk=None):
+    """
+    Tries to find a logo URL on a given website by scraping its content.
+    Returns None when there is none or the site cannot be read.
+    """
+    get = session.get if session is not None else requests.get
+    try:
+        with get(website_url, stream=True, timeout=timeout, headers={'User-Agent': 'Mozilla/5.0'}) as response:
+            response.raise_for_status()
+            return logo_from_response(response, on_chunk=on_chunk)
+    except requests.exceptions.RequestException as e:
+        print(f"    -> Scraping Error: {e}")
+    return None
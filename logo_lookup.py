@@ -0,0 +1,131 @@
+"""
+Per-domain results of the logo search, shared by scrape_logos.py and the
+player.
+
+Most logo lookups depend only on the domain of the stream URL (the Clearbit
+API and the website's home page), and many stations share one streaming
+host. Each domain is therefore looked up at most once: hits are kept for
+HIT_TTL, misses are retried only after their retry_after time, and
+concurrent lookups of the same domain wait for the first one instead of
+repeating it.
+"""
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from build_db import DB_PATH
+
+HIT_TTL = 30 * 24 * 3600
+# A site without a logo is asked again after a week; a timeout or an error
+# may be transient and is retried sooner.
+MISS_TTL = 7 * 24 * 3600
+RETRY_TTL = 3600
+
+# Seconds a lookup waits for another thread resolving the same domain.
+WAIT_FOR_LOOKUP = 60
+
+CREATE_LOGO_DOMAINS = """
+    CREATE TABLE IF NOT EXISTS logo_domains (
+        domain TEXT PRIMARY KEY,
+        logo_url TEXT,
+        method TEXT NOT NULL,
+        checked_at REAL NOT NULL,
+        retry_after REAL
+    )
+"""
+
+def station_domain(station_url):
+    """Domain key of a stream URL, or None if it has none."""
+    if not station_url or not station_url.startswith('http'):
+        return None
+    return urlparse(station_url).netloc.lower() or None
+
+class LogoLookup:
+    """
+    resolve() returns the cached result for a station's domain or runs the
+    given finder once and records what it returned. Entries are kept in
+    memory and in the logo_domains table; writes use their own short
+    connection, so resolve() can be called from any thread.
+    """
+
+    def __init__(self, db_path=DB_PATH, hit_ttl=HIT_TTL, miss_ttl=MISS_TTL, retry_ttl=RETRY_TTL):
+        self.db_path = db_path
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.retry_ttl = retry_ttl
+        self.lock = threading.Lock()
+        self.entries = {} # domain -> (logo_url, method, checked_at, retry_after)
+        self.inflight = {} # domain -> Event set when its lookup finishes
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(CREATE_LOGO_DOMAINS)
+            self.entries = {row[0]: row[1:] for row in conn.execute("SELECT * FROM logo_domains")}
+        finally:
+            conn.close()
+
+    def is_fresh(self, entry, now):
+        logo_url, method, checked_at, retry_after = entry
+        if logo_url:
+            return now < checked_at + self.hit_ttl
+        return retry_after is not None and now < retry_after
+
+    def cached(self, domain):
+        """(logo_url, method) of a fresh entry, or None; logo_url is None for a miss."""
+        with self.lock:
+            entry = self.entries.get(domain)
+        if entry is None or not self.is_fresh(entry, time.time()):
+            return None
+        return entry[0], entry[1]
+
+    def record(self, domain, logo_url, method):
+        now = time.time()
+        if logo_url:
+            retry_after = None
+        elif method in ('timeout', 'error'):
+            retry_after = now + self.retry_ttl
+        else:
+            retry_after = now + self.miss_ttl
+        entry = (logo_url, method, now, retry_after)
+        with self.lock:
+            self.entries[domain] = entry
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("INSERT OR REPLACE INTO logo_domains VALUES (?, ?, ?, ?, ?)", (domain, *entry))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not save logo lookup for {domain}: {e}")
+
+    def resolve(self, station_url, finder):
+        """
+        Returns (logo_url, method, from_cache) for a station. finder(station_url)
+        must return (logo_url, method): 'api' or 'scrape' with a URL, or a
+        failure such as 'not_found', 'timeout' or 'error' with None.
+        """
+        domain = station_domain(station_url)
+        if domain is None:
+            return None, 'invalid_url', False
+        while True:
+            cached = self.cached(domain)
+            if cached is not None:
+                return cached[0], cached[1], True
+            with self.lock:
+                event = self.inflight.get(domain)
+                if event is None:
+                    event = self.inflight[domain] = threading.Event()
+                    break
+            # Another thread is resolving this domain; use its result.
+            if not event.wait(WAIT_FOR_LOOKUP):
+                return None, 'timeout', False
+
+        try:
+            logo_url, method = finder(station_url)
+            self.record(domain, logo_url, method)
+            return logo_url, method, False
+        finally:
+            with self.lock:
+                del self.inflight[domain]
+            event.set()
@@ -0,0 +1,238 @@
+"""
+Timers, counters and latency histograms shared by build_db.py,
+update_logos.py, scrape_logos.py and the player.
+
+Metrics are off unless RADIO_METRICS names a log file:
+
+    RADIO_METRICS=metrics.jsonl python3 build_db.py
+    python3 metrics.py metrics.jsonl          # summary of a log, also of several runs
+
+Then every timed operation is appended to that file as one JSON object per
+line ({"t": unix time, "name": ..., "ms": ..., plus the fields given to the
+timer}), and at exit a summary of all timers and counters is printed and
+logged as a last {"summary": ...} line. When metrics are off, timer()
+returns one shared do-nothing context manager and count() and observe()
+return at their first line, so instrumented code pays about one function
+call per operation.
+
+Worker processes (build_db.py --jobs) record nothing; they return their
+timings with their results and the parent process records them.
+"""
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+ENV_VAR = "RADIO_METRICS"
+
+# Events are written in batches of this size, and at exit.
+FLUSH_EVERY = 1000
+
+# Upper bounds, in milliseconds, of the histogram buckets; the last bucket takes everything slower.
+BUCKETS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+class Histogram:
+    """Count, total, maximum and bucketed distribution of one timer's durations."""
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        index = 0
+        while index < len(BUCKETS_MS) and ms > BUCKETS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of durations; the maximum for the last bucket."""
+        wanted = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= wanted and bucket_count:
+                return min(BUCKETS_MS[index], self.max) if index < len(BUCKETS_MS) else self.max
+        return self.max
+
+class NullTimer:
+    """What timer() returns while metrics are off."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **fields):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class Timer:
+    """Times a with block; a block left by an exception is recorded with an "error" field."""
+    __slots__ = ("name", "fields", "start")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def set(self, **fields):
+        """Adds fields known only inside the block, such as a row count."""
+        self.fields.update(fields)
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self.start) * 1000
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        observe(self.name, ms, **self.fields)
+        return False
+
+_lock = threading.Lock()
+_log_path = None
+_histograms = {}
+_counters = {}
+_events = []
+
+def enabled():
+    return _log_path is not None
+
+def enable(log_path):
+    """Starts collecting, writing events to log_path; the summary is printed at exit."""
+    global _log_path
+    if _log_path is None:
+        atexit.register(finish)
+    _log_path = log_path
+
+def timer(name, **fields):
+    """
+    Context manager timing a block as one event of the named timer:
+
+        with metrics.timer("scrape_logos.fetch", host=host) as t:
+            ...
+            t.set(status=response.status_code)
+    """
+    if _log_path is None:
+        return NULL_TIMER
+    return Timer(name, fields)
+
+def observe(name, ms, **fields):
+    """Records a duration measured elsewhere, for example VLC's time to audio."""
+    if _log_path is None:
+        return
+    event = {"t": round(time.time(), 3), "name": name, "ms": round(ms, 3)}
+    if fields:
+        event.update(fields)
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(ms)
+        _events.append(event)
+        if len(_events) >= FLUSH_EVERY:
+            flush_events()
+
+def count(name, n=1):
+    """Adds n to a counter; counters appear in the summary only."""
+    if _log_path is None:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def flush_events():
+    """Appends buffered events to the log. Called with _lock held."""
+    if not _events:
+        return
+    try:
+        with open(_log_path, "a", encoding="utf-8") as log:
+            log.writelines(json.dumps(event, ensure_ascii=False) + "\n" for event in _events)
+    except OSError as e:
+        print(f"Could not write metrics to {_log_path}: {e}", file=sys.stderr)
+    _events.clear()
+
+def summary_rows(histograms):
+    """(name, count, total ms, mean ms, p50, p95, max) per timer, slowest total first."""
+    rows = [
+        (name, h.count, h.total, h.total / h.count, h.percentile(0.5), h.percentile(0.95), h.max)
+        for name, h in histograms.items() if h.count
+    ]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows
+
+def print_summary(histograms, counters, file=sys.stdout):
+    if not histograms and not counters:
+        return
+    print("\n--- Metrics ---", file=file)
+    if histograms:
+        print(f"{'timer':<32} {'count':>8} {'total ms':>11} {'mean':>9} {'p50':>8} {'p95':>8} {'max':>9}", file=file)
+        for name, n, total, mean, p50, p95, slowest in summary_rows(histograms):
+            print(f"{name:<32} {n:>8} {total:>11.1f} {mean:>9.2f} {p50:>8.1f} {p95:>8.1f} {slowest:>9.1f}", file=file)
+    for name, value in sorted(counters.items()):
+        print(f"{name:<32} {value:>8}", file=file)
+
+def finish():
+    """Writes the remaining events and the summary. Registered with atexit by enable()."""
+    with _lock:
+        if _log_path is None:
+            return
+        flush_events()
+        summary = {
+            "timers": {
+                name: {"count": n, "total_ms": round(total, 3), "p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "max_ms": round(slowest, 3)}
+                for name, n, total, mean, p50, p95, slowest in summary_rows(_histograms)
+            },
+            "counters": dict(_counters),
+        }
+        try:
+            with open(_log_path, "a", encoding="utf-8") as log:
+                log.write(json.dumps({"t": round(time.time(), 3), "summary": summary}) + "\n")
+        except OSError:
+            pass
+        print_summary(_histograms, _counters)
+
+def reset_in_child():
+    """A forked worker starts with the parent's buffers; it must not write them again."""
+    global _log_path
+    _log_path = None
+    _events.clear()
+
+def summarize_log(log_path):
+    """Prints the summary of every event in a log file, across all the runs it holds."""
+    histograms = {}
+    counters = {}
+    with open(log_path, encoding="utf-8") as log:
+        for line in log:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if "summary" in event:
+                for name, value in event["summary"].get("counters", {}).items():
+                    counters[name] = counters.get(name, 0) + value
+            elif "name" in event:
+                histograms.setdefault(event["name"], Histogram()).add(event["ms"])
+    print_summary(histograms, counters)
+
+os.register_at_fork(after_in_child=reset_in_child)
+
+if os.environ.get(ENV_VAR) and multiprocessing.parent_process() is None and __name__ != '__main__':
+    enable(os.environ[ENV_VAR])
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("usage: python3 metrics.py LOG_FILE")
+        sys.exit(2)
+    summarize_log(sys.argv[1])
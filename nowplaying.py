@@ -0,0 +1,472 @@
+"""
+Follows the ICY "StreamTitle" metadata of many stations at once and records
+every title change in radio.db, without VLC and without decoding any audio.
+
+Each stream is requested with Icy-MetaData: 1. The server then inserts a
+metadata block after every icy-metaint bytes of audio: one length byte
+(times 16) followed by text such as "StreamTitle='Artist - Song';". A
+StationStream protocol counts the audio bytes off as they arrive, without
+copying or keeping them, and only buffers the few metadata bytes.
+
+All streams share one asyncio event loop. Title changes are collected in
+memory and written in batches by a single database thread, to now_playing
+(the current title of each station) and now_playing_history. A stream that
+ends or fails is reconnected with exponential backoff; one whose server
+sends no icy-metaint is dropped.
+
+    python nowplaying.py --country Italy
+    python nowplaying.py --genre jazz --limit 300
+"""
+import argparse
+import asyncio
+import random
+import re
+import sqlite3
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urljoin, urlsplit
+
+from build_db import DB_PATH
+from healthcheck import USER_AGENT, header_int
+
+# Title changes are written at least this often, in seconds, or as soon as
+# BATCH_SIZE of them are waiting.
+FLUSH_INTERVAL = 5
+BATCH_SIZE = 500
+# Connections being opened at the same time; the rest wait their turn.
+CONNECT_LIMIT = 64
+CONNECT_TIMEOUT = 10
+# A stream that sends nothing for this long is dropped and reconnected.
+STALL_TIMEOUT = 60
+# Reconnect delays: a stream that played for a while comes back after
+# RETRY_MIN seconds, repeated failures wait up to RETRY_MAX.
+RETRY_MIN = 5
+RETRY_MAX = 600
+MAX_REDIRECTS = 5
+MAX_HEADER_BYTES = 16 * 1024
+# Threads used by the loop to resolve host names.
+RESOLVER_THREADS = 4
+# Soft open-file limit asked for when the hard limit is unlimited (the macOS default).
+OPEN_FILE_LIMIT = 65536
+REPORT_INTERVAL = 60
+HISTORY_DAYS = 30
+
+CREATE_NOW_PLAYING = (
+    """
+    CREATE TABLE IF NOT EXISTS now_playing (
+        station_id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        started_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS now_playing_history (
+        station_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        started_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_now_playing_history_station ON now_playing_history (station_id, started_at)",
+)
+
+# Titles can contain quotes, so a title ends at the "';" that is followed by
+# the next field or the end of the block.
+STREAM_TITLE = re.compile(r"StreamTitle='(.*?)';(?=\w+=|\s*$)", re.DOTALL)
+
+def parse_stream_title(block):
+    """Returns the StreamTitle of a metadata block, or None if it has none."""
+    text = block.rstrip(b"\0")
+    try:
+        text = text.decode("utf-8")
+    except UnicodeDecodeError:
+        text = text.decode("latin-1")
+    match = STREAM_TITLE.search(text)
+    return match.group(1).strip() if match else None
+
+class StreamError(Exception):
+    pass
+
+class Redirect(Exception):
+    def __init__(self, location):
+        super().__init__(location)
+        self.location = location
+
+class NoMetadata(Exception):
+    pass
+
+class StationStream(asyncio.Protocol):
+    """
+    Parses one ICY response as it arrives. `headers` is resolved when the
+    response headers have been read (or fails with Redirect, NoMetadata or
+    StreamError), `closed` when the connection ends. Titles are passed to
+    on_title(station_id, title).
+    """
+
+    def __init__(self, station_id, request, on_title, loop):
+        self.station_id = station_id
+        self.request = request
+        self.on_title = on_title
+        self.headers = loop.create_future()
+        self.closed = loop.create_future()
+        self.transport = None
+        self.header_bytes = bytearray()
+        self.metaint = None
+        self.audio_left = 0 # audio bytes before the next length byte
+        self.meta_left = 0 # metadata bytes still to come
+        self.meta = bytearray()
+        self.received = 0
+        self.last_data = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(self.request)
+
+    def data_received(self, data):
+        self.received += len(data)
+        self.last_data = time.monotonic()
+        if self.metaint is None:
+            self.header_bytes += data
+            end = self.header_bytes.find(b"\r\n\r\n")
+            if end < 0:
+                if len(self.header_bytes) > MAX_HEADER_BYTES:
+                    self.fail(StreamError("response headers too long"))
+                return
+            data = bytes(self.header_bytes[end + 4:])
+            head = bytes(self.header_bytes[:end])
+            self.header_bytes = None
+            if not self.start(head):
+                return
+        self.consume(data)
+
+    def start(self, head):
+        """Checks the response headers; returns whether the body should be read."""
+        lines = head.decode("latin-1").split("\r\n")
+        status = lines[0].split()
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        # SHOUTcast 1 answers "ICY 200 OK" instead of an HTTP status line.
+        code = status[1] if len(status) > 1 else ""
+        if code in ("301", "302", "303", "307", "308") and headers.get("location"):
+            self.fail(Redirect(headers["location"]))
+            return False
+        if code != "200":
+            self.fail(StreamError(f"HTTP {code or '?'}"))
+            return False
+        metaint = header_int(headers.get("icy-metaint", ""))
+        if not metaint:
+            self.fail(NoMetadata())
+            return False
+        self.metaint = self.audio_left = metaint
+        self.headers.set_result(headers)
+        return True
+
+    def consume(self, data):
+        """Skips audio and collects metadata blocks; only metadata bytes are copied."""
+        position = 0
+        size = len(data)
+        while position < size:
+            if self.audio_left:
+                skip = min(self.audio_left, size - position)
+                self.audio_left -= skip
+                position += skip
+            elif self.meta_left:
+                take = min(self.meta_left, size - position)
+                self.meta += data[position:position + take]
+                self.meta_left -= take
+                position += take
+                if not self.meta_left:
+                    title = parse_stream_title(bytes(self.meta))
+                    self.meta.clear()
+                    self.audio_left = self.metaint
+                    if title is not None:
+                        self.on_title(self.station_id, title)
+            else:
+                self.meta_left = data[position] * 16
+                position += 1
+                if not self.meta_left:
+                    self.audio_left = self.metaint
+
+    def fail(self, error):
+        if not self.headers.done():
+            self.headers.set_exception(error)
+        self.transport.close()
+
+    def connection_lost(self, exc):
+        if not self.headers.done():
+            self.headers.set_exception(exc or StreamError("connection closed"))
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+def stream_request(parts):
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    # HTTP/1.0, so the body is never chunked.
+    return (
+        f"GET {path} HTTP/1.0\r\n"
+        f"Host: {parts.netloc}\r\n"
+        f"User-Agent: {USER_AGENT}\r\n"
+        "Icy-MetaData: 1\r\n"
+        "Accept: */*\r\n"
+        "\r\n"
+    ).encode("latin-1")
+
+def connect_target(url):
+    """(parts, secure, port, request) of an http(s) URL; raises StreamError for one that cannot be requested."""
+    try:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise StreamError(f"unsupported URL {url}")
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        return parts, secure, port, stream_request(parts)
+    except ValueError as e: # a bad port, or a path that is not latin-1
+        raise StreamError(f"bad URL {url}: {e}") from e
+
+def write_titles(conn, batch):
+    """Database thread: records a batch of (station_id, title, started_at) title changes."""
+    conn.executemany("INSERT INTO now_playing_history (station_id, title, started_at) VALUES (?, ?, ?)", batch)
+    conn.executemany("INSERT OR REPLACE INTO now_playing (station_id, title, started_at) VALUES (?, ?, ?)", batch)
+    conn.commit()
+
+def prune_history(conn, keep_days):
+    conn.execute("DELETE FROM now_playing_history WHERE started_at < ?", (time.time() - keep_days * 86400,))
+    conn.commit()
+
+class Collector:
+    """Follows a set of stations on the running event loop and batches their title changes."""
+
+    def __init__(self, db_path=DB_PATH, keep_days=HISTORY_DAYS):
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nowplaying-db")
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        for statement in CREATE_NOW_PLAYING:
+            self.conn.execute(statement)
+        self.conn.commit()
+        self.keep_days = keep_days
+        self.titles = {} # station_id -> last title seen
+        self.pending = [] # title changes not yet written
+        self.streams = {} # station_id -> StationStream of an open connection
+        self.connect_slots = None # created on the loop by run()
+        self.flushed = None
+        self.ssl_context = ssl.create_default_context()
+        self.counts = {"changes": 0, "written": 0, "no_metadata": 0, "failures": 0, "dropped": 0}
+
+    def on_title(self, station_id, title):
+        if not title or self.titles.get(station_id) == title:
+            return
+        self.titles[station_id] = title
+        self.pending.append((station_id, title, time.time()))
+        self.counts["changes"] += 1
+        if len(self.pending) >= BATCH_SIZE:
+            self.flushed.set()
+
+    async def listen(self, station_id, url):
+        """
+        Follows one connection to a station until it ends. Returns the
+        seconds it was connected; raises StreamError, NoMetadata or an
+        OSError when it could not be started.
+        """
+        loop = asyncio.get_running_loop()
+        for _ in range(MAX_REDIRECTS + 1):
+            parts, secure, port, request = connect_target(url)
+            async with self.connect_slots:
+                stream = StationStream(station_id, request, self.on_title, loop)
+                try:
+                    await asyncio.wait_for(
+                        loop.create_connection(
+                            lambda: stream, parts.hostname, port,
+                            ssl=self.ssl_context if secure else None,
+                        ),
+                        CONNECT_TIMEOUT,
+                    )
+                    await asyncio.wait_for(stream.headers, CONNECT_TIMEOUT)
+                except Redirect as redirect:
+                    url = urljoin(url, redirect.location)
+                    continue
+                except asyncio.TimeoutError:
+                    if stream.transport is not None:
+                        stream.transport.abort()
+                    raise StreamError("timed out")
+                except UnicodeError as e: # a host name IDNA cannot encode
+                    raise StreamError(f"bad host name {parts.hostname}: {e}") from e
+            started = time.monotonic()
+            self.streams[station_id] = stream
+            try:
+                await stream.closed
+            finally:
+                del self.streams[station_id]
+            return time.monotonic() - started
+        raise StreamError("too many redirects")
+
+    async def follow(self, station_id, url):
+        """
+        Keeps a station followed, reconnecting with backoff, until it turns
+        out to have no metadata. An unexpected error drops this station only.
+        """
+        delay = RETRY_MIN
+        # Spread the initial connections out a little.
+        await asyncio.sleep(random.uniform(0, 2))
+        while True:
+            try:
+                connected = await self.listen(station_id, url)
+                delay = RETRY_MIN if connected > RETRY_MAX else min(delay * 2, RETRY_MAX)
+            except NoMetadata:
+                self.counts["no_metadata"] += 1
+                return
+            except (StreamError, OSError, ssl.SSLError):
+                self.counts["failures"] += 1
+                delay = min(delay * 2, RETRY_MAX)
+            except Exception as e:
+                print(f"Station {station_id} ({url}) dropped: {type(e).__name__}: {e}")
+                self.counts["dropped"] += 1
+                return
+            await asyncio.sleep(delay * random.uniform(0.75, 1.25))
+
+    async def watchdog(self):
+        """Drops connections that have gone silent; one timer for all streams."""
+        while True:
+            await asyncio.sleep(STALL_TIMEOUT / 4)
+            deadline = time.monotonic() - STALL_TIMEOUT
+            for stream in list(self.streams.values()):
+                if stream.last_data < deadline:
+                    stream.transport.abort()
+
+    async def writer(self):
+        loop = asyncio.get_running_loop()
+        pruned_at = 0
+        while True:
+            try:
+                await asyncio.wait_for(self.flushed.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            if time.time() - pruned_at > 3600:
+                await loop.run_in_executor(self.db_executor, prune_history, self.conn, self.keep_days)
+                pruned_at = time.time()
+
+    async def flush(self):
+        self.flushed.clear()
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.db_executor, write_titles, self.conn, batch)
+            self.counts["written"] += len(batch)
+        except sqlite3.Error as e:
+            print(f"Could not save {len(batch)} titles: {e}")
+
+    async def report(self, total, start):
+        received = 0
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            now_received = sum(stream.received for stream in self.streams.values())
+            elapsed = time.monotonic() - start
+            print(
+                f"[{datetime.now().strftime('%H:%M:%S')}] {len(self.streams)}/{total} connected, "
+                f"{self.counts['changes']} title changes, {self.counts['written']} written, "
+                f"{self.counts['no_metadata']} without metadata, {self.counts['failures']} failed connects, "
+                f"{self.counts['dropped']} dropped, "
+                f"{max(now_received - received, 0) / REPORT_INTERVAL / 1024:.0f} KiB/s discarded, "
+                f"up {elapsed / 60:.0f} min"
+            )
+            received = now_received
+
+    async def run(self, stations):
+        start = time.monotonic()
+        self.connect_slots = asyncio.Semaphore(CONNECT_LIMIT)
+        self.flushed = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=RESOLVER_THREADS, thread_name_prefix="nowplaying-dns"))
+        helpers = [asyncio.ensure_future(task) for task in (self.watchdog(), self.writer(), self.report(len(stations), start))]
+        try:
+            # follow() handles its own errors; return_exceptions keeps any that
+            # slips through from cancelling the other stations.
+            results = await asyncio.gather(*(self.follow(station_id, url) for station_id, url in stations), return_exceptions=True)
+            for (station_id, url), result in zip(stations, results):
+                if isinstance(result, Exception):
+                    print(f"Station {station_id} ({url}) stopped: {type(result).__name__}: {result}")
+            print("No station left with ICY metadata.")
+        finally:
+            for task in helpers:
+                task.cancel()
+            await self.flush()
+
+    def close(self):
+        self.db_executor.shutdown()
+        self.conn.close()
+
+def stations_to_follow(conn, country=None, genre=None, limit=None, include_unchecked=False):
+    """
+    Stations to follow: by default those healthcheck.py found online with an
+    icy-metaint header; with include_unchecked also those never checked.
+    """
+    query = "SELECT s.id, s.url FROM stations s WHERE s.url LIKE 'http%'"
+    params = []
+    if include_unchecked:
+        query += " AND (s.last_checked IS NULL OR (s.status = 'Online' AND s.icy_metaint IS NOT NULL))"
+    else:
+        query += " AND s.status = 'Online' AND s.icy_metaint IS NOT NULL"
+    if country:
+        query += " AND s.country_id = (SELECT id FROM countries WHERE name = ?)"
+        params.append(country)
+    if genre:
+        query += " AND s.id IN (SELECT station_id FROM station_genres WHERE genre_id = (SELECT id FROM genres WHERE name = ?))"
+        params.append(genre)
+    query += " ORDER BY s.id"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+def raise_open_file_limit():
+    """Every followed stream holds a socket; the default soft limit is often 1024."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # An unlimited soft limit cannot be set; the kernel may also cap it lower.
+    target = OPEN_FILE_LIMIT if hard == resource.RLIM_INFINITY else hard
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError) as e:
+            print(f"Could not raise the open file limit from {soft}: {e}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record the ICY now-playing titles of many stations.")
+    parser.add_argument("--db", default=DB_PATH, help="database to update (default: radio.db)")
+    parser.add_argument("--country", help="only stations of this country")
+    parser.add_argument("--genre", help="only stations of this genre")
+    parser.add_argument("--limit", type=int, help="follow at most this many stations")
+    parser.add_argument("--include-unchecked", action="store_true",
+                        help="also follow stations healthcheck.py has not checked yet")
+    parser.add_argument("--keep-days", type=float, default=HISTORY_DAYS,
+                        help=f"days of title history to keep (default: {HISTORY_DAYS})")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+    stations = stations_to_follow(conn, args.country, args.genre, args.limit, args.include_unchecked)
+    conn.close()
+    if not stations:
+        print("No stations to follow. Run healthcheck.py first, or pass --include-unchecked.")
+        return
+    raise_open_file_limit()
+    print(f"Following {len(stations)} stations. Press Ctrl+C to stop.")
+    collector = Collector(args.db, args.keep_days)
+    try:
+        asyncio.run(collector.run(stations))
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        collector.close()
+    print(f"{collector.counts['changes']} title changes seen, {collector.counts['written']} written.")
+
+if __name__ == '__main__':
+    main()
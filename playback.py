@@ -0,0 +1,326 @@
+"""
+VLC playback for the player, with a warm standby for switching stations.
+
+Two media players share one libvlc instance. The active one is heard; the
+standby one plays muted, buffering the station most likely to be played
+next: the row selected while something is playing, or, after a switch, the
+station that was playing before. Playing the standby station only swaps
+which player is muted, so it is heard as soon as the click is handled.
+
+Every play records its time to first audio, from the Play click to VLC's
+MediaPlayerPlaying event (or to the switch, when the standby was already
+playing), in the play_times table:
+
+    python playback.py --report
+    python playback.py --vlc-args=--aout=dummy URL URL ...   # cold vs. standby, no sound device needed
+
+tests/test_playback.py runs the same player against a local stream under
+--aout=dummy.
+
+Extra libvlc arguments for the player come from RADIO_VLC_ARGS, for
+example RADIO_VLC_ARGS="--aout=dummy".
+"""
+import argparse
+import os
+import shlex
+import sqlite3
+import statistics
+import threading
+import time
+
+from build_db import DB_PATH
+
+VLC_ARGS = tuple(shlex.split(os.environ.get("RADIO_VLC_ARGS", "")))
+
+CREATE_PLAY_TIMES = """
+    CREATE TABLE IF NOT EXISTS play_times (
+        station_id INTEGER,
+        url TEXT,
+        mode TEXT NOT NULL,
+        ttfa_ms REAL NOT NULL,
+        played_at REAL NOT NULL
+    )
+"""
+
+class Slot:
+    """What one media player holds: a station, whether VLC reports it playing, and a pending measurement."""
+    __slots__ = ("station_id", "url", "playing", "clicked_at", "mode")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.station_id = None
+        self.url = None
+        self.playing = False
+        self.clicked_at = None
+        self.mode = None
+
+class Playback:
+    """
+    The active and standby media players. Created without touching VLC;
+    start() loads libvlc, from the warm-up thread or the first Play.
+    on_meta() is called on a VLC thread when the active stream's metadata
+    changes, on_audio(station_id, mode, ttfa_ms) when a play has started
+    and on_error(station_id, url, active) when VLC could not play a stream.
+    """
+
+    def __init__(self, db_path=DB_PATH, vlc_args=VLC_ARGS, on_meta=None, on_audio=None, on_error=None):
+        self.db_path = db_path
+        self.vlc_args = vlc_args
+        self.on_meta = on_meta
+        self.on_audio = on_audio
+        self.on_error = on_error
+        # Held across libvlc calls. VLC's event callbacks must never wait
+        # for it: MediaPlayer.stop() waits for the thread delivering them.
+        self.lock = threading.RLock()
+        # Guards the measurement fields of the slots; never held across a libvlc call.
+        self.measure_lock = threading.Lock()
+        self.vlc = None
+        self.instance = None
+        self.active = None
+        self.standby = None
+        self.slots = {}
+        if db_path is not None:
+            conn = sqlite3.connect(db_path)
+            try:
+                conn.execute(CREATE_PLAY_TIMES)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def start(self):
+        """Creates the libvlc instance and both media players once."""
+        with self.lock:
+            if self.instance is not None:
+                return
+            import vlc
+            self.vlc = vlc
+            self.instance = vlc.Instance(*self.vlc_args)
+            self.active = self.instance.media_player_new()
+            self.standby = self.instance.media_player_new()
+            for player in (self.active, self.standby):
+                self.slots[player] = Slot()
+                events = player.event_manager()
+                events.event_attach(vlc.EventType.MediaPlayerPlaying, lambda event, player=player: self.playing(player))
+                events.event_attach(vlc.EventType.MediaPlayerEncounteredError, lambda event, player=player: self.failed(player))
+
+    def load(self, player, station_id, url):
+        """Starts url on a player, muted; the caller unmutes it when it becomes active."""
+        player.stop()
+        # Set before play(): its Playing or error event can arrive at once.
+        with self.measure_lock:
+            slot = self.slots[player]
+            slot.clear()
+            slot.station_id = station_id
+            slot.url = url
+        media = self.instance.media_new(url)
+        media.event_manager().event_attach(self.vlc.EventType.MediaMetaChanged, lambda event, player=player: self.meta_changed(player))
+        player.set_media(media)
+        player.audio_set_mute(True)
+        player.play()
+
+    def is_playing(self):
+        with self.lock:
+            return self.active is not None and self.slots[self.active].url is not None
+
+    def prepare(self, station_id, url):
+        """Buffers a station on the standby player unless one of the players already has it."""
+        self.start()
+        with self.lock:
+            if station_id in (self.slots[self.active].station_id, self.slots[self.standby].station_id):
+                return
+            self.load(self.standby, station_id, url)
+
+    def play(self, station_id, url, clicked_at=None, keep_previous=True):
+        """
+        Makes a station heard: by unmuting the standby player if it holds
+        the station, otherwise by starting it there. The previous station
+        keeps playing muted as the new standby, or is stopped when
+        keep_previous is false (instant switching turned off).
+        """
+        clicked_at = clicked_at or time.perf_counter()
+        self.start()
+        with self.lock:
+            if self.slots[self.active].station_id == station_id:
+                return
+            target = self.standby
+            slot = self.slots[target]
+            mode = "standby" if slot.station_id == station_id else "cold"
+            # Swapped first, so an error event of the new stream finds it active.
+            self.active, self.standby = target, self.active
+            if mode == "cold":
+                self.load(target, station_id, url)
+            if keep_previous:
+                self.standby.audio_set_mute(True)
+            else:
+                self.release_standby()
+            target.audio_set_mute(False)
+            with self.measure_lock:
+                slot.clicked_at = clicked_at
+                slot.mode = mode
+                measurement = self.take_measurement(slot)
+        if measurement:
+            self.record(*measurement)
+
+    def stop(self):
+        """Stops both players; nothing is buffered in the background any more."""
+        with self.lock:
+            for player, slot in self.slots.items():
+                player.stop()
+                with self.measure_lock:
+                    slot.clear()
+
+    def release_standby(self):
+        """Stops the standby player, for example when switching mode is turned off."""
+        with self.lock:
+            if self.standby is not None:
+                self.standby.stop()
+                with self.measure_lock:
+                    self.slots[self.standby].clear()
+
+    def now_playing(self):
+        """The NowPlaying metadata of the active stream, or None."""
+        with self.lock:
+            media = self.active.get_media() if self.active is not None else None
+            return media.get_meta(self.vlc.Meta.NowPlaying) if media is not None else None
+
+    # VLC event callbacks run on VLC threads. They must not call into libvlc
+    # or wait for self.lock; they only update the slots.
+    def playing(self, player):
+        with self.measure_lock:
+            slot = self.slots[player]
+            slot.playing = True
+            measurement = self.take_measurement(slot)
+        if measurement:
+            self.record(*measurement)
+        if player is not self.active:
+            # The mute set before play() is not always applied before the
+            # audio output exists.
+            threading.Thread(target=self.mute_standby, args=(player,), daemon=True).start()
+
+    def mute_standby(self, player):
+        with self.lock:
+            if player is self.standby:
+                player.audio_set_mute(True)
+
+    def failed(self, player):
+        with self.measure_lock:
+            slot = self.slots[player]
+            station_id, url = slot.station_id, slot.url
+            if slot.clicked_at is not None:
+                print(f"Could not play {url}")
+            slot.clear()
+        if self.on_error is not None and url is not None:
+            self.on_error(station_id, url, player is self.active)
+
+    def meta_changed(self, player):
+        if player is self.active and self.on_meta is not None:
+            self.on_meta()
+
+    def take_measurement(self, slot):
+        """
+        (station_id, url, mode, ttfa_ms) once a clicked station is playing,
+        else None; each click is measured once. Called under measure_lock.
+        """
+        if not slot.playing or slot.clicked_at is None:
+            return None
+        measurement = (slot.station_id, slot.url, slot.mode, (time.perf_counter() - slot.clicked_at) * 1000)
+        slot.clicked_at = None
+        return measurement
+
+    def record(self, station_id, url, mode, ttfa_ms):
+        print(f"Time to audio: {ttfa_ms:.0f} ms ({mode})")
+        if self.on_audio is not None:
+            self.on_audio(station_id, mode, ttfa_ms)
+        if self.db_path is not None:
+            # Not on the VLC thread delivering the event.
+            threading.Thread(target=self.save, args=(station_id, url, mode, ttfa_ms), daemon=True).start()
+
+    def save(self, station_id, url, mode, ttfa_ms):
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute(
+                    "INSERT INTO play_times (station_id, url, mode, ttfa_ms, played_at) VALUES (?, ?, ?, ?, ?)",
+                    (station_id, url, mode, ttfa_ms, time.time())
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not save time to audio: {e}")
+
+def report(db_path):
+    """Prints the time to first audio per play mode."""
+    conn = sqlite3.connect(db_path)
+    conn.execute(CREATE_PLAY_TIMES)
+    rows = conn.execute("SELECT mode, ttfa_ms FROM play_times ORDER BY mode").fetchall()
+    conn.close()
+    by_mode = {}
+    for mode, ttfa_ms in rows:
+        by_mode.setdefault(mode, []).append(ttfa_ms)
+    if not by_mode:
+        print("No plays recorded yet.")
+    for mode, times in by_mode.items():
+        times.sort()
+        p90 = times[min(len(times) - 1, int(len(times) * 0.9))]
+        print(f"{mode:<8} {len(times):6} plays  median {statistics.median(times):7.0f} ms  p90 {p90:7.0f} ms")
+
+def measure(urls, vlc_args, settle, timeout):
+    """
+    Plays urls one after the other, first from scratch and then with each
+    next one prepared on the standby player, and prints both times to audio.
+    """
+    started = threading.Event()
+    results = {}
+    def on_audio(station_id, mode, ttfa_ms):
+        # The first stream of the standby round starts cold again; keep the first figure.
+        results.setdefault((station_id, mode), ttfa_ms)
+        started.set()
+
+    playback = Playback(None, vlc_args, on_audio=on_audio)
+    playback.start()
+
+    def play(index, url):
+        started.clear()
+        playback.play(index, url)
+        if not started.wait(timeout):
+            print(f"  no audio from {url} within {timeout} s")
+        time.sleep(settle)
+
+    for index, url in enumerate(urls):
+        playback.stop()
+        play(index, url)
+    playback.stop()
+    play(0, urls[0])
+    for index in range(1, len(urls)):
+        # The next stream buffers on the standby player while the current one plays.
+        playback.prepare(index, urls[index])
+        time.sleep(settle)
+        play(index, urls[index])
+    playback.stop()
+
+    print(f"{'url':<48} {'cold ms':>9} {'standby ms':>11}")
+    for index, url in enumerate(urls):
+        cold = results.get((index, "cold"))
+        standby = results.get((index, "standby"))
+        print(f"{url[:48]:<48} {cold if cold is not None else float('nan'):>9.0f} "
+              f"{standby if standby is not None else float('nan'):>11.0f}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Report or measure the player's time to first audio.")
+    parser.add_argument("urls", nargs="*", help="streams to play from scratch and through the standby player")
+    parser.add_argument("--db", default=DB_PATH, help="database with recorded plays (default: radio.db)")
+    parser.add_argument("--report", action="store_true", help="summarize the plays recorded by the player")
+    parser.add_argument("--vlc-args", default=" ".join(VLC_ARGS), help="libvlc arguments, e.g. --vlc-args=--aout=dummy")
+    parser.add_argument("--settle", type=float, default=3, help="seconds each stream plays before the next (default: 3)")
+    parser.add_argument("--timeout", type=float, default=15, help="seconds to wait for audio (default: 15)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.report or not args.urls:
+        report(args.db)
+    else:
+        measure(args.urls, shlex.split(args.vlc_args), args.settle, args.timeout)
@@ -0,0 +1,247 @@
+"""
+Pre-renders a small icon for every station logo and packs them into one file
+that the player memory-maps to show an icon on each row of the station list.
+
+Logos are downloaded by a thread pool and resized by a process pool. Every
+result is recorded in the logo_icons table of logo_icons.db as it arrives,
+so an interrupted run picks up where it stopped, and a logo is only resized
+again when its source has changed. That table is kept out of radio.db,
+which a full build_db.py run deletes.
+
+Icon pack layout (native-endian values):
+    magic b"RIC2", uint32 logo count n
+    n uint64 logo keys (sorted, see logo_cache.icon_key),
+    n uint32 icon offsets, n uint32 icon lengths
+    PNG data, each distinct icon stored once
+"""
+import sqlite3
+import os
+import argparse
+import hashlib
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+
+import requests
+
+from build_db import DB_PATH
+from healthcheck import HostLimiter, USER_AGENT, interleave_by_host
+from logo_cache import ICON_PACK_PATH, PACK_MAGIC, icon_key, make_thumbnail
+
+ICON_SIZE = 24
+ICON_STATE_PATH = 'logo_icons.db'
+
+# Results are committed in batches, each in its own transaction.
+BATCH_SIZE = 200
+# Downloaded images waiting for a resize worker; bounds memory use.
+DECODE_BACKLOG = 256
+
+# The state database is attached to the radio.db connection as "icons".
+CREATE_LOGO_ICONS = """
+    CREATE TABLE IF NOT EXISTS icons.logo_icons (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT,
+        icon BLOB,
+        error TEXT,
+        checked_at REAL NOT NULL
+    )
+"""
+
+SAVE_ICON_SQL = """
+    INSERT INTO icons.logo_icons (url, etag, last_modified, content_hash, icon, error, checked_at)
+    VALUES (?, ?, ?, ?, ?, NULL, ?)
+    ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified,
+        content_hash = excluded.content_hash, icon = excluded.icon, error = NULL,
+        checked_at = excluded.checked_at
+"""
+
+# A failed check keeps the last good icon.
+SAVE_ERROR_SQL = """
+    INSERT INTO icons.logo_icons (url, error, checked_at) VALUES (?, ?, ?)
+    ON CONFLICT (url) DO UPDATE SET error = excluded.error, checked_at = excluded.checked_at
+"""
+
+MARK_CHECKED_SQL = "UPDATE icons.logo_icons SET error = NULL, checked_at = ? WHERE url = ?"
+
+LOGOS_TO_CHECK_SQL = """
+    SELECT DISTINCT i.content_hash, s.logo_url, i.etag, i.last_modified
+    FROM stations s
+    LEFT JOIN icons.logo_icons i ON i.url = s.logo_url
+    WHERE s.logo_url LIKE 'http%' AND (i.checked_at IS NULL OR i.checked_at < ?)
+"""
+
+PACK_ROWS_SQL = """
+    SELECT i.url, i.icon FROM icons.logo_icons i
+    WHERE i.icon IS NOT NULL AND i.url IN (SELECT logo_url FROM stations)
+"""
+
+make_icon = partial(make_thumbnail, width=ICON_SIZE, height=ICON_SIZE)
+
+def attach_icon_state(conn, state_path=ICON_STATE_PATH):
+    """
+    Attaches the icon state database to a radio.db connection as "icons".
+    Icons recorded in radio.db by earlier versions are moved over once.
+    """
+    conn.execute("ATTACH DATABASE ? AS icons", (state_path,))
+    conn.execute(CREATE_LOGO_ICONS)
+    if conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'logo_icons'").fetchone():
+        conn.execute("INSERT OR IGNORE INTO icons.logo_icons SELECT url, etag, last_modified, content_hash, icon, error, checked_at FROM main.logo_icons")
+        conn.execute("DROP TABLE main.logo_icons")
+    conn.commit()
+
+def download_logo(url, etag, last_modified, limiter, timeout):
+    """
+    Conditional GET of a logo. Returns (status_code, content, etag,
+    last_modified); content is None unless the server sent a new image.
+    """
+    headers = {'User-Agent': USER_AGENT}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    with limiter.semaphore(url):
+        response = requests.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304:
+        return 304, None, etag, last_modified
+    response.raise_for_status()
+    return response.status_code, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+def prerender_icons(conn, max_age=86400, workers=16, per_host=4, jobs=None, timeout=10):
+    """
+    Downloads and resizes every logo not checked in the last max_age
+    seconds. conn needs the icon state attached (attach_icon_state).
+    Returns a dict of counters.
+    """
+    logos = conn.execute(LOGOS_TO_CHECK_SQL, (time.time() - max_age,)).fetchall()
+    total = len(logos)
+    print(f"Checking {total} logos with {workers} download workers...")
+
+    limiter = HostLimiter(per_host)
+    counts = {"rendered": 0, "unchanged": 0, "failed": 0}
+    pending_writes = 0
+    start = time.perf_counter()
+
+    def record(sql, params, counter):
+        nonlocal pending_writes
+        conn.execute(sql, params)
+        counts[counter] += 1
+        pending_writes += 1
+        if pending_writes >= BATCH_SIZE:
+            conn.commit()
+            pending_writes = 0
+            done = sum(counts.values())
+            elapsed = time.perf_counter() - start
+            print(f"[{done}/{total}] {counts['rendered']} rendered, {counts['unchanged']} unchanged, {counts['failed']} failed, {done / elapsed:.1f} logos/s")
+
+    decodes = {} # resize future -> (url, etag, last_modified, content_hash)
+
+    def collect(done_futures):
+        for future in done_futures:
+            url, etag, last_modified, content_hash = decodes.pop(future)
+            try:
+                icon = future.result()
+            except Exception as e:
+                record(SAVE_ERROR_SQL, (url, f"image: {e}", time.time()), "failed")
+            else:
+                record(SAVE_ICON_SQL, (url, etag, last_modified, content_hash, icon, time.time()), "rendered")
+
+    def downloaded(done_futures):
+        for future in done_futures:
+            url, old_hash = downloads_pending.pop(future)
+            try:
+                status_code, content, etag, last_modified = future.result()
+            except requests.exceptions.RequestException as e:
+                record(SAVE_ERROR_SQL, (url, f"download: {e}", time.time()), "failed")
+                continue
+            content_hash = content and hashlib.sha1(content).hexdigest()
+            if content is None or content_hash == old_hash:
+                # Not modified, or the same bytes from a server without validators.
+                record(MARK_CHECKED_SQL, (time.time(), url), "unchanged")
+                continue
+            decodes[resizers.submit(make_icon, content)] = (url, etag, last_modified, content_hash)
+        if len(decodes) >= DECODE_BACKLOG:
+            collect(wait(decodes, return_when=FIRST_COMPLETED).done)
+
+    # Downloads are submitted in a sliding window rather than all at once,
+    # so finished futures and their image bytes are released as they are handled.
+    downloads_pending = {} # download future -> (url, content_hash)
+    with ThreadPoolExecutor(max_workers=workers) as downloads, ProcessPoolExecutor(max_workers=jobs) as resizers:
+        for content_hash, url, etag, last_modified in interleave_by_host(logos):
+            future = downloads.submit(download_logo, url, etag, last_modified, limiter, timeout)
+            downloads_pending[future] = (url, content_hash)
+            if len(downloads_pending) >= 2 * workers:
+                downloaded(wait(downloads_pending, return_when=FIRST_COMPLETED).done)
+        downloaded(wait(downloads_pending).done)
+        collect(wait(decodes).done)
+    conn.commit()
+    return counts
+
+def write_icon_pack(conn, path=ICON_PACK_PATH):
+    """Writes the icon pack for all station logos with a rendered icon. Returns the number of logos."""
+    keys = array('Q')
+    offsets = array('I')
+    lengths = array('I')
+    blobs = []
+    blob_offsets = {} # icon bytes -> offset, so identical icons are stored once
+    position = 0
+    for key, icon in sorted((icon_key(url), bytes(icon)) for url, icon in conn.execute(PACK_ROWS_SQL)):
+        offset = blob_offsets.get(icon)
+        if offset is None:
+            offset = blob_offsets[icon] = position
+            blobs.append(icon)
+            position += len(icon)
+        keys.append(key)
+        offsets.append(offset)
+        lengths.append(len(icon))
+
+    count = len(keys)
+    data_start = 8 + 16 * count
+    for index in range(count):
+        offsets[index] += data_start
+    header = array('I', [count])
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(PACK_MAGIC)
+        f.write(header.tobytes())
+        f.write(keys.tobytes())
+        f.write(offsets.tobytes())
+        f.write(lengths.tobytes())
+        for blob in blobs:
+            f.write(blob)
+    # The player may have the old pack mapped; replace it atomically.
+    os.replace(temp_path, path)
+    return count
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-render station logo icons for the player's station list.")
+    parser.add_argument("--db", default=DB_PATH, help="database to read (default: radio.db)")
+    parser.add_argument("--state", default=ICON_STATE_PATH, help="database of rendered icons, kept across rebuilds of radio.db (default: logo_icons.db)")
+    parser.add_argument("--output", default=ICON_PACK_PATH, help="icon pack to write (default: logo_icons.pack)")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent downloads (default: 16)")
+    parser.add_argument("--per-host", type=int, default=4, help="concurrent downloads per host (default: 4)")
+    parser.add_argument("--jobs", "-j", type=int, help="resize processes (default: one per CPU)")
+    parser.add_argument("--max-age", type=float, default=86400, help="recheck logos checked more than this many seconds ago (default: 86400)")
+    parser.add_argument("--timeout", type=float, default=10, help="download timeout in seconds (default: 10)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.db):
+        print(f"Error: Database '{args.db}' not found. Please run build_db.py first.")
+        return
+    conn = sqlite3.connect(args.db)
+    attach_icon_state(conn, args.state)
+    start = time.perf_counter()
+    counts = prerender_icons(conn, args.max_age, args.workers, args.per_host, args.jobs, args.timeout)
+    packed = write_icon_pack(conn, args.output)
+    conn.close()
+    elapsed = time.perf_counter() - start
+    print(f"Finished in {elapsed:.1f}s: {counts['rendered']} rendered, {counts['unchanged']} unchanged, {counts['failed']} failed.")
+    print(f"Wrote icons for {packed} logos to {args.output}.")
+
+if __name__ == '__main__':
+    main()
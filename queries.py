@@ -0,0 +1,374 @@
+"""
+Read queries over radio.db used by the player.
+
+Every query is a module-level constant, so sqlite3's per-connection
+statement cache prepares each one once and reuses it on later calls. The
+secondary indexes they rely on are created by build_db.py; check_query_plans
+verifies with EXPLAIN QUERY PLAN that no filtered query falls back to a full
+scan of stations or station_genres, and that every station page is read in
+index order rather than sorted in a temporary B-tree (tests/test_query_plans.py).
+"""
+import json
+import re
+import sqlite3
+import sys
+
+from build_db import DB_PATH
+
+STATION_COLUMNS = "s.id, s.name, s.url, s.status, s.logo_url"
+
+COUNTRIES_SQL = "SELECT name FROM countries ORDER BY name"
+
+GENRES_SQL = "SELECT name FROM genres ORDER BY name"
+
+GENRES_FOR_COUNTRY_SQL = """
+    SELECT g.name
+    FROM genres g
+    WHERE g.id IN (
+        SELECT sg.genre_id
+        FROM stations s
+        JOIN station_genres sg ON sg.station_id = s.id
+        WHERE s.country_id = (SELECT id FROM countries WHERE name = ?)
+    )
+    ORDER BY g.name
+"""
+
+COUNTRIES_FOR_GENRE_SQL = """
+    SELECT c.name
+    FROM countries c
+    WHERE c.id IN (
+        SELECT s.country_id
+        FROM station_genres sg
+        CROSS JOIN stations s ON s.id = sg.station_id
+        WHERE sg.genre_id = (SELECT id FROM genres WHERE name = ?)
+    )
+    ORDER BY c.name
+"""
+
+ALL_STATIONS_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM stations s
+    ORDER BY s.name, s.id
+"""
+
+STATIONS_BY_COUNTRY_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM stations s
+    WHERE s.country_id = (SELECT id FROM countries WHERE name = ?)
+    ORDER BY s.name, s.id
+"""
+
+# CROSS JOIN keeps station_genres as the outer loop, read in order from its
+# (genre_id, name, station_id) index; sg.name is a copy of s.name.
+STATIONS_BY_GENRE_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM station_genres sg
+    CROSS JOIN stations s ON s.id = sg.station_id
+    WHERE sg.genre_id = (SELECT id FROM genres WHERE name = ?)
+    ORDER BY sg.name, sg.station_id
+"""
+
+STATIONS_BY_COUNTRY_AND_GENRE_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM stations s
+    WHERE s.country_id = (SELECT id FROM countries WHERE name = ?)
+    AND EXISTS (
+        SELECT 1 FROM station_genres sg
+        WHERE sg.station_id = s.id
+        AND sg.genre_id = (SELECT id FROM genres WHERE name = ?)
+    )
+    ORDER BY s.name, s.id
+"""
+
+# Keyset pagination over the same filters: a page starts after (or ends
+# before) the (name, id) key of a row already shown, so fetching any page
+# costs an index seek instead of an OFFSET walk.
+STATION_PAGE_SIZE = 100
+
+# Each filter is (FROM clause, WHERE condition, sort key columns). The sort
+# key is always the (name, id) of an index the page can be read from in
+# order. The "genre" filter uses the copy of the name in station_genres. The
+# "selection" filter pages through temp.filtered_stations, which
+# set_station_filter fills with an arbitrary set of station ids (for example
+# a multi-select facet combination) and which has its own (name, id) index.
+STATION_FILTER_SQL = {
+    "all": ("FROM stations s", "1", "s.name, s.id"),
+    "country": ("FROM stations s", "s.country_id = (SELECT id FROM countries WHERE name = ?)", "s.name, s.id"),
+    "genre": (
+        "FROM station_genres sg CROSS JOIN stations s ON s.id = sg.station_id",
+        "sg.genre_id = (SELECT id FROM genres WHERE name = ?)",
+        "sg.name, sg.station_id",
+    ),
+    "country_and_genre": (
+        "FROM stations s",
+        """s.country_id = (SELECT id FROM countries WHERE name = ?)
+        AND EXISTS (
+            SELECT 1 FROM station_genres sg
+            WHERE sg.station_id = s.id
+            AND sg.genre_id = (SELECT id FROM genres WHERE name = ?)
+        )""",
+        "s.name, s.id",
+    ),
+    "selection": (
+        "FROM temp.filtered_stations f CROSS JOIN stations s ON s.id = f.id",
+        "1",
+        "f.name, f.id",
+    ),
+}
+
+STATION_PAGE_SQL = {}
+for kind, (source, condition, key) in STATION_FILTER_SQL.items():
+    descending = key.replace(",", " DESC,") + " DESC"
+    STATION_PAGE_SQL[kind, "first"] = f"SELECT {STATION_COLUMNS} {source} WHERE {condition} ORDER BY {key} LIMIT ?"
+    STATION_PAGE_SQL[kind, "after"] = f"SELECT {STATION_COLUMNS} {source} WHERE {condition} AND ({key}) > (?, ?) ORDER BY {key} LIMIT ?"
+    STATION_PAGE_SQL[kind, "before"] = f"SELECT {STATION_COLUMNS} {source} WHERE {condition} AND ({key}) < (?, ?) ORDER BY {descending} LIMIT ?"
+
+CREATE_FILTERED_STATIONS = (
+    "CREATE TEMP TABLE IF NOT EXISTS filtered_stations (id INTEGER PRIMARY KEY, name TEXT)",
+    "CREATE INDEX IF NOT EXISTS temp.filtered_stations_name ON filtered_stations (name, id)",
+)
+
+# The ids are passed as one JSON array, so filling the table is a single
+# statement whatever the size of the selection.
+FILL_FILTERED_STATIONS_SQL = """
+    INSERT INTO temp.filtered_stations (id, name)
+    SELECT s.id, s.name FROM json_each(?) j
+    CROSS JOIN stations s ON s.id = j.value
+"""
+
+# Search results are capped at one page; the user refines the query instead
+# of scrolling through thousands of matches. The queries deliberately do not
+# order by rank: bm25 would have to score every match of a short prefix such
+# as "ra", while without ORDER BY FTS5 stops after the first page. The page is
+# sorted by name afterwards.
+SEARCH_PAGE_SIZE = 200
+
+SEARCH_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM stations_fts f
+    CROSS JOIN stations s ON s.id = f.rowid
+    WHERE stations_fts MATCH ?
+    LIMIT ?
+"""
+
+SEARCH_BY_COUNTRY_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM stations_fts f
+    CROSS JOIN stations s ON s.id = f.rowid
+    WHERE stations_fts MATCH ?
+    AND s.country_id = (SELECT id FROM countries WHERE name = ?)
+    LIMIT ?
+"""
+
+SEARCH_BY_GENRE_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM stations_fts f
+    CROSS JOIN stations s ON s.id = f.rowid
+    WHERE stations_fts MATCH ?
+    AND EXISTS (
+        SELECT 1 FROM station_genres sg
+        WHERE sg.station_id = s.id
+        AND sg.genre_id = (SELECT id FROM genres WHERE name = ?)
+    )
+    LIMIT ?
+"""
+
+SEARCH_BY_COUNTRY_AND_GENRE_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM stations_fts f
+    CROSS JOIN stations s ON s.id = f.rowid
+    WHERE stations_fts MATCH ?
+    AND s.country_id = (SELECT id FROM countries WHERE name = ?)
+    AND EXISTS (
+        SELECT 1 FROM station_genres sg
+        WHERE sg.station_id = s.id
+        AND sg.genre_id = (SELECT id FROM genres WHERE name = ?)
+    )
+    LIMIT ?
+"""
+
+SEARCH_IN_SELECTION_SQL = f"""
+    SELECT {STATION_COLUMNS}
+    FROM stations_fts f
+    CROSS JOIN stations s ON s.id = f.rowid
+    WHERE stations_fts MATCH ?
+    AND s.id IN (SELECT id FROM temp.filtered_stations)
+    LIMIT ?
+"""
+
+SEARCH_TOKEN = re.compile(r"\w+")
+
+# Written by nowplaying.py.
+NOW_PLAYING_SQL = "SELECT title, started_at FROM now_playing WHERE station_id = ?"
+
+# Queries checked by check_query_plans, with sample parameters.
+FILTERED_QUERIES = {
+    "genres_for_country": (GENRES_FOR_COUNTRY_SQL, ("",)),
+    "countries_for_genre": (COUNTRIES_FOR_GENRE_SQL, ("",)),
+    "stations_by_country": (STATIONS_BY_COUNTRY_SQL, ("",)),
+    "stations_by_genre": (STATIONS_BY_GENRE_SQL, ("",)),
+    "stations_by_country_and_genre": (STATIONS_BY_COUNTRY_AND_GENRE_SQL, ("", "")),
+    "search": (SEARCH_SQL, ('"radio"*', SEARCH_PAGE_SIZE)),
+    "search_by_country": (SEARCH_BY_COUNTRY_SQL, ('"radio"*', "", SEARCH_PAGE_SIZE)),
+    "search_by_genre": (SEARCH_BY_GENRE_SQL, ('"radio"*', "", SEARCH_PAGE_SIZE)),
+    "search_by_country_and_genre": (SEARCH_BY_COUNTRY_AND_GENRE_SQL, ('"radio"*', "", "", SEARCH_PAGE_SIZE)),
+}
+
+# Station pages checked by check_query_plans, with sample parameters. A page
+# must stop after LIMIT rows, so sorting the filtered rows is a regression
+# as well. The selection pages need temp.filtered_stations (set_station_filter).
+FILTER_SAMPLE_PARAMS = {"all": (), "country": ("",), "genre": ("",), "country_and_genre": ("", "")}
+PAGED_QUERIES = {
+    f"station_page_{kind}_{direction}": (sql, (*FILTER_SAMPLE_PARAMS[kind], *(() if direction == "first" else ("", 0)), STATION_PAGE_SIZE))
+    for (kind, direction), sql in STATION_PAGE_SQL.items() if kind in FILTER_SAMPLE_PARAMS
+}
+
+# Tables large enough that a full scan of them is a regression.
+LARGE_TABLES = {"stations", "s", "station_genres", "sg"}
+
+def connect(db_path=DB_PATH):
+    return sqlite3.connect(db_path, cached_statements=256)
+
+def get_countries(conn):
+    return [row[0] for row in conn.execute(COUNTRIES_SQL)]
+
+def get_genres(conn):
+    return [row[0] for row in conn.execute(GENRES_SQL)]
+
+def get_genres_for_country(conn, country):
+    return [row[0] for row in conn.execute(GENRES_FOR_COUNTRY_SQL, (country,))]
+
+def get_countries_for_genre(conn, genre):
+    return [row[0] for row in conn.execute(COUNTRIES_FOR_GENRE_SQL, (genre,))]
+
+def get_stations(conn, country=None, genre=None):
+    """Returns (id, name, url, status, logo_url) rows sorted by name, one row per station."""
+    if country and genre:
+        cursor = conn.execute(STATIONS_BY_COUNTRY_AND_GENRE_SQL, (country, genre))
+    elif country:
+        cursor = conn.execute(STATIONS_BY_COUNTRY_SQL, (country,))
+    elif genre:
+        cursor = conn.execute(STATIONS_BY_GENRE_SQL, (genre,))
+    else:
+        cursor = conn.execute(ALL_STATIONS_SQL)
+    return cursor.fetchall()
+
+def set_station_filter(conn, station_ids):
+    """Replaces the station set used by the selection filter (use_selection=True)."""
+    for statement in CREATE_FILTERED_STATIONS:
+        conn.execute(statement)
+    conn.execute("DELETE FROM temp.filtered_stations")
+    conn.execute(FILL_FILTERED_STATIONS_SQL, (json.dumps(station_ids),))
+
+def get_station_page(conn, country=None, genre=None, after=None, before=None, limit=STATION_PAGE_SIZE,
+                     use_selection=False):
+    """
+    Returns up to limit station rows in name order, starting after the
+    (name, id) key `after`, ending just before the key `before`, or from
+    the top when neither is given. With use_selection the stations come
+    from the last set_station_filter call instead of country and genre.
+    """
+    if use_selection:
+        kind, params = "selection", ()
+    elif country and genre:
+        kind, params = "country_and_genre", (country, genre)
+    elif country:
+        kind, params = "country", (country,)
+    elif genre:
+        kind, params = "genre", (genre,)
+    else:
+        kind, params = "all", ()
+
+    if after is not None:
+        rows = conn.execute(STATION_PAGE_SQL[kind, "after"], (*params, *after, limit)).fetchall()
+    elif before is not None:
+        rows = conn.execute(STATION_PAGE_SQL[kind, "before"], (*params, *before, limit)).fetchall()
+        rows.reverse()
+    else:
+        rows = conn.execute(STATION_PAGE_SQL[kind, "first"], (*params, limit)).fetchall()
+    return rows
+
+def fts_query(text):
+    """
+    Turns what the user typed into an FTS5 query: every word must match
+    as a prefix, so "rad ber" finds "Radio Berlin". Returns None when the
+    text has no searchable words.
+    """
+    tokens = SEARCH_TOKEN.findall(text)
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+def search_stations(conn, text, country=None, genre=None, limit=SEARCH_PAGE_SIZE, use_selection=False):
+    """
+    Returns up to limit (id, name, url, status, logo_url) rows whose name,
+    stream host or EXTINF attributes match text, sorted by name.
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+    if use_selection:
+        cursor = conn.execute(SEARCH_IN_SELECTION_SQL, (query, limit))
+    elif country and genre:
+        cursor = conn.execute(SEARCH_BY_COUNTRY_AND_GENRE_SQL, (query, country, genre, limit))
+    elif country:
+        cursor = conn.execute(SEARCH_BY_COUNTRY_SQL, (query, country, limit))
+    elif genre:
+        cursor = conn.execute(SEARCH_BY_GENRE_SQL, (query, genre, limit))
+    else:
+        cursor = conn.execute(SEARCH_SQL, (query, limit))
+    return sorted(cursor.fetchall(), key=lambda row: (row[1], row[0]))
+
+def get_now_playing(conn, station_id):
+    """
+    (title, started_at) of the last title nowplaying.py recorded for a
+    station, or None, also when the collector has never run on this database.
+    """
+    try:
+        return conn.execute(NOW_PLAYING_SQL, (station_id,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def plan_problems(steps, paged=False):
+    """
+    The steps of one query plan that are regressions: a scan of stations or
+    station_genres, or for a page a sort in a temporary B-tree. A page may
+    walk a whole index in order, since it stops after LIMIT rows.
+    """
+    problems = []
+    for step in steps:
+        words = step.split()
+        if words[0] == "SCAN" and words[1] in LARGE_TABLES and not (paged and "INDEX" in words):
+            problems.append(step)
+        elif paged and step.startswith("USE TEMP B-TREE"):
+            problems.append(step)
+    return problems
+
+def check_query_plans(conn):
+    """
+    Returns a list of (query_name, plan_step) for every filtered query whose
+    plan scans stations or station_genres instead of searching an index, and
+    every station page that sorts its rows instead of reading them in index
+    order. An empty list means every filter path is indexed.
+    """
+    problems = []
+    for name, (sql, params) in FILTERED_QUERIES.items():
+        problems += [(name, step) for step in plan_problems(explain(conn, sql, params))]
+    for name, (sql, params) in PAGED_QUERIES.items():
+        problems += [(name, step) for step in plan_problems(explain(conn, sql, params), paged=True)]
+    return problems
+
+if __name__ == '__main__':
+    db_conn = connect(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    for query_name, (query_sql, query_params) in {**FILTERED_QUERIES, **PAGED_QUERIES}.items():
+        print(f"{query_name}:")
+        for plan_step in explain(db_conn, query_sql, query_params):
+            print(f"    {plan_step}")
+    problem_steps = check_query_plans(db_conn)
+    db_conn.close()
+    for query_name, plan_step in problem_steps:
+        print(f"NOT INDEXED in {query_name}: {plan_step}")
+    sys.exit(1 if problem_steps else 0)
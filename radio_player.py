@@ -1,118 +1,288 @@
 import tkinter as tk
 from tkinter import ttk
-import vlc
-import sqlite3
-import requests
-import threading
+import importlib
 import io
-from PIL import Image, ImageTk
-from bs4 import BeautifulSoup
+import threading
 from urllib.parse import urlparse, urljoin
 import time
 
 # --- Database Functions ---
-def db_connect():
-    return sqlite3.connect('radio.db')
-
-def get_countries(conn):
-    c = conn.cursor()
-    c.execute("SELECT name FROM countries ORDER BY name")
-    return [row[0] for row in c.fetchall()]
-
-def get_genres(conn):
-    c = conn.cursor()
-    c.execute("SELECT name FROM genres ORDER BY name")
-    return [row[0] for row in c.fetchall()]
-
-def get_genres_for_country(conn, country):
-    c = conn.cursor()
-    c.execute("""
-        SELECT DISTINCT g.name
-        FROM genres g
-        JOIN station_genres sg ON g.id = sg.genre_id
-        JOIN stations s ON sg.station_id = s.id
-        JOIN countries c ON s.country_id = c.id
-        WHERE c.name = ?
-        ORDER BY g.name
-    """, (country,))
-    return [row[0] for row in c.fetchall()]
-
-def get_countries_for_genre(conn, genre):
-    c = conn.cursor()
-    c.execute("""
-        SELECT DISTINCT c.name
-        FROM countries c
-        JOIN stations s ON c.id = s.country_id
-        JOIN station_genres sg ON s.id = sg.station_id
-        JOIN genres g ON sg.genre_id = g.id
-        WHERE g.name = ?
-        ORDER BY c.name
-    """, (genre,))
-    return [row[0] for row in c.fetchall()]
-
-def get_stations(conn, country=None, genre=None):
-    c = conn.cursor()
-    query = """
-        SELECT s.id, s.name, s.url, s.status, s.logo_url
-        FROM stations s
-        LEFT JOIN countries c ON s.country_id = c.id
-        LEFT JOIN station_genres sg ON s.id = sg.station_id
-        LEFT JOIN genres g ON sg.genre_id = g.id
-    """
-    filters = []
-    params = []
-    if country:
-        filters.append("c.name = ?")
-        params.append(country)
-    if genre:
-        filters.append("g.name = ?")
-        params.append(genre)
-
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
-    
-    c.execute(query + " ORDER BY s.name", tuple(params))
-    return c.fetchall()
+from queries import (
+    connect as db_connect, get_countries, get_genres, get_station_page,
+    search_stations, set_station_filter, get_now_playing, STATION_PAGE_SIZE,
+)
+import metrics
+from facets import FacetIndex
+from status_cache import StatusCache
+from stream_resolver import StreamResolver
+from playback import Playback
+from logo_cache import LogoCache, IconPack
+from logo_lookup import LogoLookup
+from work_queue import WorkQueue, PRIORITY_STATUS, PRIORITY_LOGO, PRIORITY_SCRAPE, PRIORITY_PREFETCH
+from build_db import ADDED_STATION_COLUMNS, add_missing_columns, add_station_genre_names
+
+# Delay between the last keystroke and the search query.
+SEARCH_DEBOUNCE_MS = 200
+# Background work for a selection starts once it has rested this long.
+SELECT_SETTLE_MS = 150
+# Rows on each side of the selection whose status and logo are prefetched.
+PREFETCH_NEIGHBOURS = 2
+
+# VLC, requests, Pillow and the scraping stack are imported where they are
+# first used, not at startup. Once the window is up, WARM_UP_MODULES are
+# imported on a background thread, so the first logo or lazy scrape does not
+# pay for them either.
+WARM_UP_MODULES = ("requests", "PIL.ImageTk", "healthcheck", "logo_extract")
 
 # --- UI Functions ---
-def populate_countries(country_listbox, countries):
-    country_listbox.delete(0, tk.END)
-    for country in countries:
-        country_listbox.insert(tk.END, country)
-
-def populate_genres(genre_listbox, genres):
-    genre_listbox.delete(0, tk.END)
-    for genre in genres:
-        genre_listbox.insert(tk.END, genre)
-
-def apply_filters(country_listbox, genre_listbox, station_tree, conn):
-    country_indices = country_listbox.curselection()
-    genre_indices = genre_listbox.curselection()
-
-    country = None
-    if country_indices:
-        country = country_listbox.get(country_indices[0])
+def set_listbox_labels(listbox, labels):
+    """Replaces the entries of a listbox, keeping its selection and scroll position."""
+    selection = listbox.curselection()
+    top = listbox.yview()[0]
+    listbox.delete(0, tk.END)
+    listbox.insert(tk.END, *labels)
+    for index in selection:
+        listbox.selection_set(index)
+    listbox.yview_moveto(top)
+
+class FacetFilters:
+    """
+    The country and genre listboxes. Both allow several entries to be
+    selected and show how many stations each entry would match given the
+    selection in the other listbox; the counts come from the in-memory
+    facet index, so they update on every click.
+    """
 
-    genre = None
-    if genre_indices:
-        genre = genre_listbox.get(genre_indices[0])
+    def __init__(self, country_listbox, genre_listbox, genre_mode, facet_index, countries, genres):
+        self.country_listbox = country_listbox
+        self.genre_listbox = genre_listbox
+        self.genre_mode = genre_mode # "any" (OR) or "all" (AND)
+        self.index = facet_index
+        self.country_names = countries
+        self.genre_names = genres
+
+        country_listbox.bind("<<ListboxSelect>>", lambda event: self.refresh_genre_counts())
+        genre_listbox.bind("<<ListboxSelect>>", lambda event: self.refresh_country_counts())
+        self.refresh_country_counts()
+        self.refresh_genre_counts()
+
+    def set_catalog(self, facet_index, countries, genres):
+        """Fills the listboxes once the catalog has been loaded in the background."""
+        self.index = facet_index
+        self.country_names = countries
+        self.genre_names = genres
+        self.refresh_country_counts()
+        self.refresh_genre_counts()
+
+    def selection(self):
+        countries = [self.country_names[i] for i in self.country_listbox.curselection()]
+        genres = [self.genre_names[i] for i in self.genre_listbox.curselection()]
+        return countries, genres
+
+    def clear(self):
+        self.country_listbox.selection_clear(0, tk.END)
+        self.genre_listbox.selection_clear(0, tk.END)
+        self.refresh_country_counts()
+        self.refresh_genre_counts()
+
+    def refresh_country_counts(self):
+        _, genres = self.selection()
+        counts = self.index.country_counts(genres, self.genre_mode.get())
+        set_listbox_labels(self.country_listbox, [f"{name} ({counts.get(name, 0)})" for name in self.country_names])
+
+    def refresh_genre_counts(self):
+        countries, _ = self.selection()
+        counts = self.index.genre_counts(countries)
+        set_listbox_labels(self.genre_listbox, [f"{name} ({counts.get(name, 0)})" for name in self.genre_names])
+
+def apply_filters(facet_filters, station_list, conn, search_var):
+    countries, genres = facet_filters.selection()
+    search_text = search_var.get().strip()
+
+    if len(countries) > 1 or len(genres) > 1:
+        # Multi-select combinations are resolved from the facet index and
+        # handed to SQL as a set of station ids.
+        set_station_filter(conn, facet_filters.index.matching_ids(countries, genres, facet_filters.genre_mode.get()))
+        if search_text:
+            with metrics.timer("player.query.search"):
+                rows = search_stations(conn, search_text, use_selection=True)
+            station_list.show_rows(rows)
+        else:
+            station_list.show_filtered(use_selection=True)
+        return
 
-    update_station_list(station_tree, conn, country, genre)
+    country = countries[0] if countries else None
+    genre = genres[0] if genres else None
+    if search_text:
+        with metrics.timer("player.query.search"):
+            rows = search_stations(conn, search_text, country, genre)
+        station_list.show_rows(rows)
+    else:
+        update_station_list(station_list, country, genre)
+
+def clear_filters(facet_filters, station_list, search_var, search_state):
+    facet_filters.clear()
+    search_var.set("")
+    search_state["last_text"] = ""
+    update_station_list(station_list)
+
+def schedule_search(search_state, root, facet_filters, station_list, conn, search_var):
+    """Debounces typing in the search box: only the last keystroke in a burst runs a query."""
+    if search_state.get("after_id"):
+        root.after_cancel(search_state["after_id"])
+    search_state["after_id"] = root.after(
+        SEARCH_DEBOUNCE_MS,
+        lambda: run_search(search_state, facet_filters, station_list, conn, search_var)
+    )
+
+def run_search(search_state, facet_filters, station_list, conn, search_var):
+    search_state["after_id"] = None
+    # Keys such as arrows or Shift release without changing the text.
+    search_text = search_var.get().strip()
+    if search_text == search_state.get("last_text"):
+        return
+    search_state["last_text"] = search_text
+    apply_filters(facet_filters, station_list, conn, search_var)
 
-def clear_filters(country_listbox, genre_listbox, station_tree, conn):
-    country_listbox.selection_clear(0, tk.END)
-    genre_listbox.selection_clear(0, tk.END)
-    update_station_list(station_tree, conn)
+def update_station_list(station_list, country=None, genre=None):
+    station_list.show_filtered(country, genre)
 
-def update_station_list(station_tree, conn, country=None, genre=None):
-    station_tree.delete(*station_tree.get_children())
-    
-    stations = get_stations(conn, country, genre) # stations is (id, name, url, status, logo_url)
-    for station_id, name, url, status, logo_url in stations:
-        # Let Treeview generate its own iid, and store station_id in tags
-        station_tree.insert("", "end", tags=(str(station_id),), values=(name, url, status, logo_url))
-
-def on_station_select(event, station_tree, play_button, stop_button, info_label, song_label, logo_label, root):
+class StationList:
+    """
+    Keeps only a window of the sorted station list in the Treeview. The
+    first page is shown at once; further pages are fetched with keyset
+    pagination when the view nears either end of the window, and rows that
+    fall too far behind are dropped, so the number of Treeview items stays
+    bounded whatever the size of the result.
+    """
+    WINDOW_ROWS = 3 * STATION_PAGE_SIZE
+    # Fetch another page when the view is within this fraction of an edge.
+    EDGE_FRACTION = 0.15
+
+    def __init__(self, tree, scrollbar, conn, icon_pack=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.conn = conn
+        self.icon_pack = icon_pack
+        self.icons = {} # icon pack slot -> PhotoImage, shared by stations with the same logo
+        self.filters = {}
+        self.paged = False
+        self.at_start = True
+        self.at_end = True
+        self.loading = False
+        self.keys = {} # iid -> (name, station_id) for the rows in the window
+        tree.configure(yscrollcommand=self.on_scroll)
+
+    def show_filtered(self, country=None, genre=None, use_selection=False):
+        """Shows the first page of the stations matching the filters."""
+        self.filters = {"country": country, "genre": genre, "use_selection": use_selection}
+        with metrics.timer("player.query.page"):
+            rows = get_station_page(self.conn, **self.filters)
+        self.reset(rows, paged=True)
+        self.at_end = len(rows) < STATION_PAGE_SIZE
+
+    def show_rows(self, rows):
+        """Shows a fixed list of rows, such as a page of search results."""
+        self.reset(rows, paged=False)
+
+    def reset(self, rows, paged):
+        self.tree.delete(*self.tree.get_children())
+        self.keys.clear()
+        # No row uses an icon any more, so this is the moment to let them go.
+        self.icons.clear()
+        self.paged = paged
+        self.at_start = True
+        self.at_end = True
+        with metrics.timer("player.tree_insert", rows=len(rows)):
+            for row in rows:
+                self.insert_row("end", row)
+        self.tree.yview_moveto(0)
+
+    def insert_row(self, index, row):
+        # stations is (id, name, url, status, logo_url)
+        station_id, name, url, status, logo_url = row
+        iid = str(station_id)
+        # The station id is both the item id and, as before, the first tag
+        self.tree.insert("", index, iid=iid, tags=(iid,), values=(name, url, status, logo_url), **self.icon(logo_url))
+        self.keys[iid] = (name, station_id)
+
+    def icon(self, logo_url):
+        """Treeview image option for the pre-rendered icon of a station's logo, if there is one."""
+        if self.icon_pack is None:
+            return {}
+        slot = self.icon_pack.slot(logo_url)
+        if slot is None:
+            return {}
+        photo = self.icons.get(slot)
+        if photo is None:
+            from PIL import Image, ImageTk
+            photo = self.icons[slot] = ImageTk.PhotoImage(Image.open(io.BytesIO(self.icon_pack.get(logo_url))))
+        return {"image": photo}
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if not self.paged or self.loading:
+            return
+        if float(last) >= 1 - self.EDGE_FRACTION and not self.at_end:
+            self.loading = True
+            self.tree.after_idle(self.load_next)
+        elif float(first) <= self.EDGE_FRACTION and not self.at_start:
+            self.loading = True
+            self.tree.after_idle(self.load_previous)
+
+    def load_next(self):
+        children = self.tree.get_children()
+        if not children or not self.paged:
+            self.loading = False
+            return
+        top = self.tree.yview()[0] * len(children)
+        with metrics.timer("player.query.page"):
+            rows = get_station_page(self.conn, **self.filters, after=self.keys[children[-1]])
+        self.at_end = len(rows) < STATION_PAGE_SIZE
+        with metrics.timer("player.tree_insert", rows=len(rows)):
+            for row in rows:
+                self.insert_row("end", row)
+
+        overflow = len(children) + len(rows) - self.WINDOW_ROWS
+        if overflow > 0:
+            self.drop(children[:overflow])
+            self.at_start = False
+            top -= overflow
+        self.restore_view(top)
+
+    def load_previous(self):
+        children = self.tree.get_children()
+        if not children or not self.paged:
+            self.loading = False
+            return
+        top = self.tree.yview()[0] * len(children)
+        with metrics.timer("player.query.page"):
+            rows = get_station_page(self.conn, **self.filters, before=self.keys[children[0]])
+        self.at_start = len(rows) < STATION_PAGE_SIZE
+        with metrics.timer("player.tree_insert", rows=len(rows)):
+            for index, row in enumerate(rows):
+                self.insert_row(index, row)
+        top += len(rows)
+
+        overflow = len(children) + len(rows) - self.WINDOW_ROWS
+        if overflow > 0:
+            self.drop(children[-overflow:])
+            self.at_end = False
+        self.restore_view(top)
+
+    def drop(self, items):
+        self.tree.delete(*items)
+        for iid in items:
+            del self.keys[iid]
+
+    def restore_view(self, top):
+        """Keeps the same rows in view after rows were added or removed above them."""
+        total = len(self.tree.get_children())
+        if total:
+            self.tree.yview_moveto(max(top, 0) / total)
+        self.loading = False
+
+def on_station_select(event, station_tree, play_button, stop_button, info_label, song_label, format_label, logo_label, root, status_cache, stream_resolver, playback, switching_var, logo_cache, logo_lookup, work_queue, select_state, conn):
     selected_item = station_tree.focus()
     if not selected_item:
         return
@@ -127,22 +297,125 @@ def on_station_select(event, station_tree, play_button, stop_button, info_label,
     logo_url = values[3] if len(values) > 3 else None # logo_url is back at index 3 of values
 
     info_label.config(text=f"Station: {name}")
-    song_label.config(text="") # Reset song title
+    # The title recorded by nowplaying.py, if it follows this station.
+    now_playing = get_now_playing(conn, int(station_id))
+    if now_playing:
+        title, started_at = now_playing
+        song_label.config(text=f"Last heard ({time.strftime('%H:%M', time.localtime(started_at))}): {title}")
+    else:
+        song_label.config(text="") # Reset song title
     play_button.config(state=tk.NORMAL if url else tk.DISABLED) # Re-add this line
-    stop_button.config(state=tk.DISABLED) # Ensure stop button is disabled until play starts
-
-    load_logo(logo_url, logo_label, root, station_id, name, url) # Pass more info for lazy scrape
+    stop_button.config(state=tk.NORMAL if playback.is_playing() else tk.DISABLED)
+
+    # Whatever is cached is shown at once...
+    station_id = int(station_id)
+    select_state["station_id"] = station_id
+    select_state["logo_url"] = None
+    show_cached_logo(logo_url, station_id, logo_label, logo_cache)
+    entry = status_cache.lookup(conn, station_id)
+    if entry:
+        update_status_in_ui(selected_item, entry, station_tree, format_label)
+    else:
+        station_tree.set(selected_item, "Status", "Checking...")
+        format_label.config(text="")
+
+    # ...while network work waits until the selection settles, so holding
+    # an arrow key down does not queue work for every row passed.
+    if select_state["after_id"] is not None:
+        root.after_cancel(select_state["after_id"])
+    select_state["after_id"] = root.after(
+        SELECT_SETTLE_MS, start_station_work, selected_item, station_tree, format_label, logo_label,
+        root, status_cache, stream_resolver, playback, switching_var, logo_cache, logo_lookup, work_queue, select_state, conn,
+    )
+
+def start_station_work(selected_item, station_tree, format_label, logo_label, root, status_cache, stream_resolver, playback, switching_var, logo_cache, logo_lookup, work_queue, select_state, conn):
+    """
+    Queues the logo, status probe and neighbour prefetch of the selected
+    station and, while another station plays, buffers it on the standby player.
+    """
+    select_state["after_id"] = None
+    if station_tree.focus() != selected_item or not station_tree.exists(selected_item):
+        return
+    # Work still queued for earlier selections is dropped.
+    work_queue.next_generation()
 
-    station_tree.set(selected_item, "Status", "Checking...")
-    threading.Thread(target=check_station_status, args=(url, selected_item, root, station_tree), daemon=True).start()
+    item = station_tree.item(selected_item)
+    values = item['values']
+    station_id = int(item['tags'][0])
+    name, url = values[0], values[1]
+    logo_url = values[3] if len(values) > 3 else None
+    load_logo(logo_url, logo_label, root, logo_cache, logo_lookup, work_queue, select_state, station_id, name, url)
+
+    if url and switching_var.get() and playback.is_playing() and status_cache.status(station_id) != "Offline":
+        playback.prepare(station_id, stream_resolver.playback_url(station_id, url))
+
+    # A fresh cached status needs no probe; a stale one is shown while it is refreshed.
+    if needs_probe(station_id, url, status_cache, stream_resolver, conn):
+        work_queue.submit(
+            ("status", station_id), probe_status, station_id, url, selected_item, root, station_tree, format_label,
+            status_cache, stream_resolver,
+            priority=PRIORITY_STATUS,
+        )
+    prefetch_neighbours(selected_item, station_tree, format_label, logo_label, root, status_cache, stream_resolver, logo_cache, work_queue, select_state, conn)
+
+def prefetch_neighbours(selected_item, station_tree, format_label, logo_label, root, status_cache, stream_resolver, logo_cache, work_queue, select_state, conn):
+    """Warms the status and logo of the rows around the selection at low priority."""
+    neighbours = []
+    for step in (station_tree.next, station_tree.prev):
+        item = selected_item
+        for _ in range(PREFETCH_NEIGHBOURS):
+            item = step(item)
+            if not item:
+                break
+            neighbours.append(item)
+
+    for item_id in neighbours:
+        item = station_tree.item(item_id)
+        values = item['values']
+        station_id = int(item['tags'][0])
+        url = values[1]
+        logo_url = values[3] if len(values) > 3 else None
+        if needs_probe(station_id, url, status_cache, stream_resolver, conn):
+            work_queue.submit(
+                ("status", station_id), probe_status, station_id, url, item_id, root, station_tree, format_label,
+                status_cache, stream_resolver,
+                priority=PRIORITY_PREFETCH,
+            )
+        logo_url = str(logo_url) if logo_url else ''
+        if logo_url.startswith('http') and logo_cache.photo(logo_url) is None:
+            work_queue.submit(
+                ("logo", logo_url), fetch_logo, logo_url, root, logo_label, logo_cache, select_state,
+                priority=PRIORITY_PREFETCH,
+            )
+
+def needs_probe(station_id, url, status_cache, stream_resolver, conn):
+    """Whether a station's status is stale or its stream URL has not been resolved recently."""
+    if not status_cache.is_fresh(status_cache.lookup(conn, station_id)):
+        return True
+    return not stream_resolver.is_fresh(stream_resolver.lookup(conn, station_id, url))
+
+def probe_status(station_id, url, item_id, root, station_tree, format_label, status_cache, stream_resolver):
+    """
+    Worker task: probes a station and shows the result in its row. A station
+    whose stream has not been resolved recently is resolved by the same
+    requests; otherwise its resolved stream is probed directly.
+    """
+    resolution = stream_resolver.resolved(station_id, url)
+    with metrics.timer("player.probe", host=urlparse(url).hostname, resolve=resolution is None):
+        if resolution is None:
+            entry = status_cache.store(station_id, *stream_resolver.resolve(station_id, url))
+        else:
+            entry = status_cache.probe(station_id, resolution[1] or url)
+    root.after(0, update_status_in_ui, item_id, entry, station_tree, format_label)
 
 # --- Player Functions ---
-def play_radio(station_tree, player, info_label, song_label, stop_button, root):
+def play_radio(station_tree, playback, switching_var, info_label, song_label, stop_button, status_cache, stream_resolver):
+    clicked_at = time.perf_counter()
     selected_item = station_tree.focus()
     if not selected_item:
         return
 
-    status = station_tree.set(selected_item, "Status")
+    status = status_cache.status(int(station_tree.item(selected_item)['tags'][0]))
     if status != "Online":
         info_label.config(text="Station is offline.")
         return
@@ -152,54 +425,89 @@ def play_radio(station_tree, player, info_label, song_label, stop_button, root):
     url = item['values'][1]
 
     if url:
-        media = player.get_instance().media_new(url)
-        player.set_media(media)
-        player.play()
+        # Playlists and redirects resolved beforehand are skipped.
+        station_id = int(item['tags'][0])
+        resolution = stream_resolver.resolved(station_id, url)
+        if resolution and resolution[1] and resolution[2]:
+            print(f"Playing resolved stream {resolution[1]}: {resolution[2]} hops skipped, about {resolution[3]:.0f} ms saved")
+        # Heard at once if the standby player already buffers this station.
+        playback.play(station_id, stream_resolver.playback_url(station_id, url), clicked_at, keep_previous=switching_var.get())
         info_label.config(text=f"Now playing: {name}")
         song_label.config(text="...") # Placeholder for song
         stop_button.config(state=tk.NORMAL)
 
-        # Update window title and song_label with NowPlaying metadata
-        def meta_changed(event, player, song_label, root):
-            meta = player.get_media().get_meta(vlc.Meta.NowPlaying)
-            if meta:
-                root.title(f"Radio Player - {meta}")
-                song_label.config(text=f"Song: {meta}")
-        
-        events = player.event_manager()
-        # Clear previous events to avoid duplicates
-        events.event_detach(vlc.EventType.MediaMetaChanged)
-        events.event_attach(vlc.EventType.MediaMetaChanged, lambda event: meta_changed(event, player, song_label, root))
-
-def stop_radio(player, info_label, song_label, stop_button):
-    player.stop()
+def play_failed(station_id, failed_url, was_active, playback, switching_var, stream_resolver):
+    """
+    VLC could not play a stream. A resolved stream may have gone stale (an
+    expired token, a retired edge server): it is discarded, and a station
+    that was being heard is played once more from its catalog URL. A
+    failing catalog URL is not retried.
+    """
+    catalog_url = stream_resolver.discard(station_id, failed_url)
+    if catalog_url is None or not was_active:
+        return
+    print(f"Resolved stream {failed_url} failed, playing {catalog_url} instead")
+    playback.play(station_id, catalog_url, keep_previous=switching_var.get())
+
+def show_song_meta(playback, song_label, root):
+    """Update window title and song_label with NowPlaying metadata"""
+    meta = playback.now_playing()
+    if meta:
+        root.title(f"Radio Player - {meta}")
+        song_label.config(text=f"Song: {meta}")
+
+def stop_radio(playback, info_label, song_label, stop_button):
+    playback.stop()
     info_label.config(text="Playback stopped.")
     song_label.config(text="")
     stop_button.config(state=tk.DISABLED)
 
-def check_station_status(url, item_id, root, station_tree):
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, stream=True, timeout=2)
-        if response.status_code == 200:
-            status = "Online"
-        else:
-            status = "Offline"
-    except requests.exceptions.RequestException:
-        status = "Offline"
-    
-    root.after(0, update_status_in_ui, item_id, status, station_tree)
+def toggle_switching(playback, switching_var):
+    """Without instant switching nothing is buffered in the background."""
+    if not switching_var.get():
+        playback.release_standby()
 
-def update_status_in_ui(item_id, status, station_tree):
+def update_status_in_ui(item_id, entry, station_tree, format_label):
+    """Shows a status cache entry in the list and, for the selected station, its stream format."""
+    from healthcheck import stream_format
+    status, checked_at, bitrate, content_type = entry
     if station_tree.exists(item_id):
         station_tree.set(item_id, "Status", status)
+    if station_tree.focus() == item_id:
+        format_label.config(text=stream_format(bitrate, content_type))
+
+def placeholder_image(size=100):
+    """The grey square shown while a logo loads, drawn by Tk itself so startup does not need Pillow."""
+    image = tk.PhotoImage(width=size, height=size)
+    image.put("grey", to=(0, 0, size, size))
+    return image
+
+def show_cached_logo(url, station_id, logo_label, logo_cache):
+    """Shows a logo already held in memory, or the grey placeholder. Never touches disk or network."""
+    if (not url or url == 'None' or not str(url).startswith('http')) and station_id in logo_cache.scraped:
+        url = logo_cache.scraped[station_id]
+    photo = logo_cache.photo(url) if url else None
+    if photo is None:
+        photo = placeholder_image()
+    update_logo_in_ui(photo, logo_label)
+
+def load_logo(url, logo_label, root, logo_cache, logo_lookup, work_queue, select_state, station_id=None, station_name=None, station_url=None):
+    """Load a logo through the logo cache, queueing its download or a lazy scrape if needed."""
+    if (not url or url == 'None' or not url.startswith('http')) and station_id in logo_cache.scraped:
+        url = logo_cache.scraped[station_id]
+        if url is None:
+            update_logo_in_ui_text("No Logo Found", logo_label)
+            return
+
+    # Results of queued work are only shown if this is still the wanted logo.
+    select_state["logo_url"] = url
+    photo = logo_cache.photo(url) if url else None
+    if photo is not None:
+        update_logo_in_ui(photo, logo_label)
+        return
 
-def load_logo(url, logo_label, root, station_id=None, station_name=None, station_url=None):
-    """Load a logo from a URL in a background thread and display it."""
     # Set a placeholder or clear the current image
-    placeholder = ImageTk.PhotoImage(Image.new("RGB", (100, 100), "grey"))
+    placeholder = placeholder_image()
     logo_label.config(image=placeholder)
     logo_label.image = placeholder # Keep a reference
 
@@ -207,44 +515,51 @@ def load_logo(url, logo_label, root, station_id=None, station_name=None, station
         # No valid URL found, attempt lazy scrape if station info is available
         if station_id is not None and station_name is not None and station_url is not None:
             print(f"  -> [Lazy Scrape Trigger]: No logo found for {station_name}. Attempting to scrape...")
-            threading.Thread(target=find_and_update_logo_for_station, args=(station_id, station_name, station_url, root, logo_label), daemon=True).start()
+            work_queue.submit(
+                ("scrape", station_id), find_and_update_logo_for_station, station_id, station_name, station_url,
+                root, logo_label, logo_cache, logo_lookup, work_queue, select_state,
+                priority=PRIORITY_SCRAPE,
+            )
         else:
-            root.after(0, lambda: update_logo_in_ui_text("No Logo", logo_label))
+            update_logo_in_ui_text("No Logo", logo_label)
         return
 
-    def _load_image():
-        try:
-            response = requests.get(url, timeout=5)
-            if response.status_code == 200:
-                print(f"Successfully downloaded logo from {url}")
-                try:
-                    image_data = response.content
-                    image = Image.open(io.BytesIO(image_data))
-                    
-                    # Resize the image to a fixed width, maintaining aspect ratio
-                    width = 100
-                    aspect_ratio = image.height / image.width
-                    height = int(width * aspect_ratio)
-                    image = image.resize((width, height), Image.Resampling.LANCZOS)
-                    
-                    photo = ImageTk.PhotoImage(image)
-                    
-                    # Schedule UI update on the main thread
-                    root.after(0, lambda: update_logo_in_ui(photo, logo_label))
-                except Exception as img_e:
-                    print(f"Failed to process image from {url}: {img_e}")
-                    root.after(0, lambda: update_logo_in_ui_text("Image Error", logo_label))
-            else:
-                print(f"Failed to download logo from {url}: HTTP Status Code {response.status_code}")
-                root.after(0, lambda: update_logo_in_ui_text("Download Failed", logo_label))
-        except requests.exceptions.RequestException as req_e:
-            print(f"Network error loading logo from {url}: {req_e}")
-            root.after(0, lambda: update_logo_in_ui_text("Network Error", logo_label))
-        except Exception as e:
-            print(f"An unexpected error occurred loading logo from {url}: {e}")
-            root.after(0, lambda: update_logo_in_ui_text("Unknown Error", logo_label))
-
-    threading.Thread(target=_load_image, daemon=True).start()
+    work_queue.submit(("logo", url), fetch_logo, url, root, logo_label, logo_cache, select_state, priority=PRIORITY_LOGO)
+
+def fetch_logo(url, root, logo_label, logo_cache, select_state):
+    """Worker task: gets a logo thumbnail from the disk cache or the network."""
+    import requests
+    try:
+        # Served from the disk cache, or downloaded and resized once.
+        with metrics.timer("player.logo_fetch", host=urlparse(url).hostname):
+            thumbnail = logo_cache.thumbnail(url)
+    except requests.exceptions.HTTPError as http_e:
+        print(f"Failed to download logo from {url}: {http_e}")
+        root.after(0, show_logo_error, url, "Download Failed", logo_label, select_state)
+        return
+    except requests.exceptions.RequestException as req_e:
+        print(f"Network error loading logo from {url}: {req_e}")
+        root.after(0, show_logo_error, url, "Network Error", logo_label, select_state)
+        return
+    except Exception as img_e:
+        print(f"Failed to process image from {url}: {img_e}")
+        root.after(0, show_logo_error, url, "Image Error", logo_label, select_state)
+        return
+    # PhotoImage objects are created on the main thread.
+    root.after(0, show_thumbnail, url, thumbnail, logo_label, logo_cache, select_state)
+
+def show_thumbnail(url, thumbnail, logo_label, logo_cache, select_state):
+    """Turns cached PNG bytes into a PhotoImage, remembers it and shows it if it is still wanted."""
+    from PIL import Image, ImageTk
+    with metrics.timer("player.logo_decode"):
+        photo = ImageTk.PhotoImage(Image.open(io.BytesIO(thumbnail)))
+    logo_cache.put_photo(url, photo)
+    if select_state["logo_url"] == url:
+        update_logo_in_ui(photo, logo_label)
+
+def show_logo_error(url, text, logo_label, select_state):
+    if select_state["logo_url"] == url:
+        update_logo_in_ui_text(text, logo_label)
 
 def update_logo_in_ui(photo, logo_label):
     """Updates the logo label with the new photo."""
@@ -263,47 +578,15 @@ def update_logo_in_db(station_id, logo_url):
     conn.commit()
     conn.close()
 
-def find_logo_on_website(website_url):
+def find_domain_logo(station_url, logo_cache):
     """
-    Tries to find a logo URL on a given website by scraping its content.
+    Looks up a logo for the domain of a station: Clearbit API first, then
+    scraping. Returns (logo_url, method) as expected by LogoLookup.resolve.
     """
-    try:
-        # Add a small delay to be polite
-        time.sleep(0.5)
-        response = requests.get(website_url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'lxml')
-        
-        # Try to find logo in meta tags (e.g., Open Graph)
-        og_image = soup.find("meta", property="og:image")
-        if og_image and og_image.get("content"):
-            return og_image["content"]
-            
-        # Try to find logo in link tags (e.g., favicon, apple-touch-icon)
-        icon_link = soup.find("link", rel=["icon", "apple-touch-icon", "shortcut icon"])
-        if icon_link and icon_link.get("href"):
-            return urljoin(website_url, icon_link["href"])
-            
-        # Try to find logo in img tags with common alt/src attributes
-        for img in soup.find_all("img"):
-            img_src = img.get("src", "").lower()
-            img_alt = img.get("alt", "").lower()
-            if "logo" in img_src or "logo" in img_alt:
-                return urljoin(website_url, img.get("src"))
-                
-    except requests.exceptions.RequestException as e:
-        print(f"    -> Scraping Error: {e}")
-    except Exception as e:
-        print(f"    -> Parsing Error: {e}")
-    return None
+    # The scraping stack is only loaded once a station without a logo is selected.
+    import requests
+    from logo_extract import find_logo_on_website
 
-def find_and_update_logo_for_station(station_id, station_name, station_url, root, logo_label):
-    """
-    Attempts to find a logo for a single station and updates the DB and UI.
-    Runs in a background thread.
-    """
-    found_logo_url = None
-    
     # --- METHOD 1: Clearbit API ---
     try:
         domain = urlparse(station_url).netloc
@@ -311,51 +594,115 @@ def find_and_update_logo_for_station(station_id, station_name, station_url, root
             clearbit_url = f"https://logo.clearbit.com/{domain}"
             print(f"  -> [Lazy Scrape] Phase 1 (API): Checking {clearbit_url}")
             response = requests.get(clearbit_url, timeout=5, headers={'User-Agent': 'Mozilla/5.0'})
-            
+
             if response.status_code == 200 and 'image' in response.headers.get('Content-Type', ''):
-                found_logo_url = response.url
-                print(f"  -> [Lazy Scrape] SUCCESS (API): Found logo at {found_logo_url}")
-            else:
-                print("  -> [Lazy Scrape] FAILED (API): No logo found via Clearbit.")
+                print(f"  -> [Lazy Scrape] SUCCESS (API): Found logo at {response.url}")
+                # Keep the image already downloaded, so load_logo finds it on disk.
+                logo_cache.add(response.url, response.content, response.headers)
+                return response.url, 'api'
+            print("  -> [Lazy Scrape] FAILED (API): No logo found via Clearbit.")
         else:
             print("  -> [Lazy Scrape] FAILED (API): Could not extract domain from station URL.")
 
     except Exception as e:
         print(f"  -> [Lazy Scrape] ERROR (API): An error occurred: {e}")
 
-    if found_logo_url:
-        update_logo_in_db(station_id, found_logo_url)
-        root.after(0, lambda: load_logo(found_logo_url, logo_label, root)) # Reload logo in UI
-        return
-
     # --- METHOD 2: Web Scraping (Fallback) ---
     print("  -> [Lazy Scrape] Phase 2 (Scraping): Starting website scraping...")
     try:
         parsed_url = urlparse(station_url)
         base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-        
+
         new_logo_url = find_logo_on_website(base_url)
-        
+
         if new_logo_url:
             found_logo_url = urljoin(base_url, new_logo_url)
             print(f"  -> [Lazy Scrape] SUCCESS (Scraping): Found logo at {found_logo_url}")
-        else:
-            print("  -> [Lazy Scrape] FAILED (Scraping): No logo found on website.")
+            return found_logo_url, 'scrape'
+        print("  -> [Lazy Scrape] FAILED (Scraping): No logo found on website.")
+        return None, 'not_found'
 
     except Exception as e:
         print(f"  -> [Lazy Scrape] ERROR (Scraping): An unexpected error occurred: {e}")
-    
+        return None, 'error'
+
+def find_and_update_logo_for_station(station_id, station_name, station_url, root, logo_label, logo_cache, logo_lookup, work_queue, select_state):
+    """
+    Attempts to find a logo for a single station and updates the DB and UI.
+    Runs as a worker task. Domains already looked up, by the player or by
+    scrape_logos.py, are answered from the shared logo lookup.
+    """
+    found_logo_url, method, from_cache = logo_lookup.resolve(station_url, lambda url: find_domain_logo(url, logo_cache))
+    if from_cache:
+        print(f"  -> [Lazy Scrape] Domain already looked up ({method}): {found_logo_url or 'no logo'}")
+
+    logo_cache.scraped[station_id] = found_logo_url
     if found_logo_url:
         update_logo_in_db(station_id, found_logo_url)
-        root.after(0, lambda: load_logo(found_logo_url, logo_label, root)) # Reload logo in UI
+    root.after(0, show_scraped_logo, station_id, found_logo_url, logo_label, root, logo_cache, logo_lookup, work_queue, select_state)
+
+def show_scraped_logo(station_id, found_logo_url, logo_label, root, logo_cache, logo_lookup, work_queue, select_state):
+    if select_state["station_id"] != station_id:
+        return
+    if found_logo_url:
+        load_logo(found_logo_url, logo_label, root, logo_cache, logo_lookup, work_queue, select_state) # Reload logo in UI
     else:
-        root.after(0, lambda: update_logo_in_ui_text("No Logo Found", logo_label))
+        update_logo_in_ui_text("No Logo Found", logo_label)
+
+# --- Startup ---
+def load_catalog(root, facet_filters):
+    """Background thread: reads the filter lists and the facet index over its own connection."""
+    conn = db_connect()
+    try:
+        countries = get_countries(conn)
+        genres = get_genres(conn)
+        facet_index = FacetIndex.load(conn)
+    finally:
+        conn.close()
+    try:
+        root.after(0, facet_filters.set_catalog, facet_index, countries, genres)
+    except RuntimeError:
+        pass # the window was closed before the catalog arrived
+
+def warm_up(playback):
+    """
+    Background thread: loads the deferred modules and VLC while the user
+    looks at the list. Loading libvlc and its plugins is the slowest part of
+    starting the player; the first Play does it if this has not yet.
+    """
+    try:
+        for module in WARM_UP_MODULES:
+            importlib.import_module(module)
+        playback.start()
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+
+def on_started(root, facet_filters, playback, on_first_paint):
+    """Runs once the window with the first page of stations has been drawn."""
+    if on_first_paint is not None:
+        on_first_paint(root)
+    threading.Thread(target=load_catalog, args=(root, facet_filters), name="load-catalog", daemon=True).start()
+    threading.Thread(target=warm_up, args=(playback,), name="warm-up", daemon=True).start()
 
 # --- Main Application Setup ---
-def main():
+def main(on_first_paint=None):
+    """
+    Shows the window with the first page of stations before anything else
+    is loaded: the country and genre lists, the facet index, VLC and the
+    network modules follow in the background. on_first_paint(root) is
+    called once the window has been drawn (used by benchmarks/player_startup.py).
+    """
     conn = db_connect()
-    countries = get_countries(conn)
-    genres = get_genres(conn)
+    add_missing_columns(conn.cursor(), "stations", ADDED_STATION_COLUMNS)
+    add_station_genre_names(conn.cursor())
+    conn.commit()
+    status_cache = StatusCache()
+    stream_resolver = StreamResolver()
+    logo_cache = LogoCache()
+    logo_lookup = LogoLookup()
+    work_queue = WorkQueue()
+    # Written by prerender_logos.py; without it the list has no icons.
+    icon_pack = IconPack.open()
 
     root = tk.Tk()
     root.title("Radio Player")
@@ -365,9 +712,13 @@ def main():
     style.configure("Treeview.Heading", font=("Helvetica", 10, "bold"))
     style.configure("Treeview", font=("Helvetica", 9))
 
-    # VLC player setup
-    instance = vlc.Instance()
-    player = instance.media_player_new()
+    # VLC player setup; libvlc itself is loaded by warm_up()
+    playback = Playback(
+        on_meta=lambda: root.after(0, show_song_meta, playback, song_label, root),
+        on_audio=lambda station_id, mode, ttfa_ms: metrics.observe("player.time_to_audio", ttfa_ms, mode=mode),
+        on_error=lambda station_id, url, active: root.after(0, play_failed, station_id, url, active, playback, switching_var, stream_resolver),
+    )
+    switching_var = tk.BooleanVar(value=True)
 
     # --- UI --- #
     paned_window = ttk.PanedWindow(root, orient=tk.HORIZONTAL)
@@ -388,21 +739,44 @@ def main():
 
     country_frame = ttk.LabelFrame(filter_frame, text="Countries")
     country_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-    country_listbox = tk.Listbox(country_frame, exportselection=False)
+    country_listbox = tk.Listbox(country_frame, exportselection=False, selectmode=tk.MULTIPLE)
     country_listbox.pack(fill=tk.BOTH, expand=True)
-    populate_countries(country_listbox, countries)
 
     genre_frame = ttk.LabelFrame(filter_frame, text="Genres")
     genre_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-    genre_listbox = tk.Listbox(genre_frame, exportselection=False)
+    genre_mode = tk.StringVar(value="any")
+    genre_mode_frame = ttk.Frame(genre_frame)
+    genre_mode_frame.pack(fill=tk.X)
+    any_genre_button = ttk.Radiobutton(genre_mode_frame, text="Any selected", variable=genre_mode, value="any")
+    any_genre_button.pack(side=tk.LEFT)
+    all_genres_button = ttk.Radiobutton(genre_mode_frame, text="All selected", variable=genre_mode, value="all")
+    all_genres_button.pack(side=tk.LEFT)
+    genre_listbox = tk.Listbox(genre_frame, exportselection=False, selectmode=tk.MULTIPLE)
     genre_listbox.pack(fill=tk.BOTH, expand=True)
-    populate_genres(genre_listbox, genres)
+
+    # Empty until load_catalog() delivers the lists.
+    facet_filters = FacetFilters(country_listbox, genre_listbox, genre_mode, FacetIndex({}, {}, 0), [], [])
+    any_genre_button.config(command=facet_filters.refresh_country_counts)
+    all_genres_button.config(command=facet_filters.refresh_country_counts)
 
     # Main frame for stations
     main_frame = ttk.Frame(paned_window)
     paned_window.add(main_frame, weight=3)
 
-    station_tree = ttk.Treeview(main_frame, columns=("Nome", "URL", "Status", "LogoURL"), show="headings")
+    search_frame = ttk.Frame(main_frame)
+    search_frame.pack(side=tk.TOP, fill=tk.X, pady=5)
+    ttk.Label(search_frame, text="Search:").pack(side=tk.LEFT, padx=5)
+    search_var = tk.StringVar()
+    search_entry = ttk.Entry(search_frame, textvariable=search_var)
+    search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+    search_state = {"last_text": ""}
+    select_state = {"after_id": None, "station_id": None, "logo_url": None}
+
+    station_tree = ttk.Treeview(main_frame, columns=("Nome", "URL", "Status", "LogoURL"), show="tree headings" if icon_pack else "headings")
+    if icon_pack:
+        # The tree column holds the station icons.
+        station_tree.column("#0", width=40, stretch=False)
+        style.configure("Treeview", rowheight=28)
     station_tree.heading("Nome", text="Radio Name")
     station_tree.heading("URL", text="URL")
     station_tree.heading("Status", text="Status")
@@ -414,7 +788,7 @@ def main():
     station_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
     scrollbar = ttk.Scrollbar(main_frame, orient=tk.VERTICAL, command=station_tree.yview)
-    station_tree.configure(yscrollcommand=scrollbar.set)
+    station_list = StationList(station_tree, scrollbar, conn, icon_pack)
     scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
     # Detail frame for player controls
@@ -424,7 +798,7 @@ def main():
     logo_label = ttk.Label(detail_frame)
     logo_label.pack(side=tk.LEFT, padx=10, anchor=tk.N)
     # Set initial placeholder
-    placeholder = ImageTk.PhotoImage(Image.new("RGB", (100, 100), "grey"))
+    placeholder = placeholder_image()
     logo_label.config(image=placeholder)
     logo_label.image = placeholder
 
@@ -438,26 +812,37 @@ def main():
     song_label = ttk.Label(text_info_frame, text="", wraplength=400, justify=tk.LEFT, font=("Helvetica", 9))
     song_label.pack(anchor=tk.W)
 
+    format_label = ttk.Label(text_info_frame, text="", font=("Helvetica", 9))
+    format_label.pack(anchor=tk.W)
+
     play_button = ttk.Button(detail_frame, text="Play", state=tk.DISABLED)
     play_button.pack(side=tk.LEFT, padx=5)
 
     stop_button = ttk.Button(detail_frame, text="Stop", state=tk.DISABLED)
     stop_button.pack(side=tk.LEFT, padx=5)
 
+    # While a station plays, the selected one is buffered muted so Play switches at once.
+    switching_check = ttk.Checkbutton(detail_frame, text="Instant switching", variable=switching_var, command=lambda: toggle_switching(playback, switching_var))
+    switching_check.pack(side=tk.LEFT, padx=5)
+
     # --- Bindings --- # 
-    apply_button.config(command=lambda: apply_filters(country_listbox, genre_listbox, station_tree, conn))
-    clear_button.config(command=lambda: clear_filters(country_listbox, genre_listbox, station_tree, conn))
+    apply_button.config(command=lambda: apply_filters(facet_filters, station_list, conn, search_var))
+    clear_button.config(command=lambda: clear_filters(facet_filters, station_list, search_var, search_state))
+    search_entry.bind("<KeyRelease>", lambda event: schedule_search(search_state, root, facet_filters, station_list, conn, search_var))
 
-    station_tree.bind("<<TreeviewSelect>>", lambda event: on_station_select(event, station_tree, play_button, stop_button, info_label, song_label, logo_label, root))
+    station_tree.bind("<<TreeviewSelect>>", lambda event: on_station_select(event, station_tree, play_button, stop_button, info_label, song_label, format_label, logo_label, root, status_cache, stream_resolver, playback, switching_var, logo_cache, logo_lookup, work_queue, select_state, conn))
 
-    play_button.config(command=lambda: play_radio(station_tree, player, info_label, song_label, stop_button, root))
-    stop_button.config(command=lambda: stop_radio(player, info_label, song_label, stop_button))
+    play_button.config(command=lambda: play_radio(station_tree, playback, switching_var, info_label, song_label, stop_button, status_cache, stream_resolver))
+    stop_button.config(command=lambda: stop_radio(playback, info_label, song_label, stop_button))
 
     # --- Initial State --- #
-    update_station_list(station_tree, conn)
+    update_station_list(station_list)
+    root.after_idle(on_started, root, facet_filters, playback, on_first_paint)
 
     root.mainloop()
 
+    playback.stop()
+    logo_cache.close()
     conn.close()
 
 if __name__ == "__main__":
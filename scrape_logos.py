@@ -1,175 +1,284 @@
-
-
 import sqlite3
 import requests
-from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
 from urllib.parse import urlparse, urljoin
+import argparse
+import threading
 import time
-import signal
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from datetime import datetime
-import warnings
+from functools import partial
+
+import metrics
+from build_db import DB_PATH
+from healthcheck import thread_session
+from logo_extract import find_logo_on_website
+from logo_lookup import RETRY_TTL, LogoLookup
+
+# Seconds allowed for one station, API lookup and scraping together.
+TASK_DEADLINE = 30
+# Connect/read timeout of a single request, further capped by the deadline.
+REQUEST_TIMEOUT = 10
+
+# Results and checkpoint rows are committed together in batches.
+BATCH_SIZE = 50
 
-# Suppress the XMLParsedAsHTMLWarning as we expect to handle HTML-like XML
-warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+# The Clearbit API serves every station; it gets more room than a website.
+DOMAIN_LIMIT_OVERRIDES = {'logo.clearbit.com': (8, 0.0)}
 
-# --- Timeout Handler ---
+CREATE_PROGRESS_SQL = """
+    CREATE TABLE IF NOT EXISTS scrape_progress (
+        station_id INTEGER PRIMARY KEY,
+        outcome TEXT NOT NULL,
+        checked_at REAL NOT NULL
+    )
+"""
+
+# Checkpoint rows that keep a station out of the next run. A timeout or an
+# error may be transient: like a failed domain in LogoLookup, it is retried
+# once RETRY_TTL has passed.
+SETTLED_PROGRESS_SQL = """
+    SELECT station_id FROM scrape_progress
+    WHERE outcome NOT IN ('timeout', 'error') OR checked_at > :retry_before
+"""
+
+STATIONS_TO_SCRAPE_SQL = f"""
+    SELECT id, url, name FROM stations
+    WHERE (logo_url IS NULL OR logo_url = '')
+      AND id NOT IN ({SETTLED_PROGRESS_SQL})
+    ORDER BY name
+"""
+
+# --- Deadlines ---
 class TimeoutException(Exception):
     pass
 
-def timeout_handler(signum, frame):
-    raise TimeoutException()
+def remaining(deadline):
+    """Seconds left before deadline; raises TimeoutException when it has passed."""
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutException()
+    return left
+
+class DomainLimiter:
+    """
+    Per-domain politeness: at most `concurrency` requests in flight to a
+    domain, and at least `delay` seconds between the starts of two of them.
+    Requests to different domains do not wait for each other.
+    """
+
+    def __init__(self, concurrency=1, delay=0.5, overrides=None):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.overrides = overrides or {}
+        self.lock = threading.Lock()
+        self.domains = {} # domain -> [semaphore, delay, next start time]
+
+    @contextmanager
+    def slot(self, url, deadline):
+        domain = urlparse(url).hostname or ''
+        with self.lock:
+            if domain not in self.domains:
+                concurrency, delay = self.overrides.get(domain, (self.concurrency, self.delay))
+                self.domains[domain] = [threading.BoundedSemaphore(concurrency), delay, 0.0]
+            state = self.domains[domain]
+        semaphore = state[0]
+        if not semaphore.acquire(timeout=remaining(deadline)):
+            raise TimeoutException()
+        try:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, state[2])
+                state[2] = start + state[1]
+            if start - now >= remaining(deadline):
+                raise TimeoutException()
+            time.sleep(start - now)
+            yield
+        finally:
+            semaphore.release()
+
+def fetch(url, deadline, limiter):
+    """
+    GET url within the politeness limits and the deadline. Returns the
+    response and its body; the body is read in chunks so a slow server
+    cannot hold the worker past the deadline.
+    """
+    with limiter.slot(url, deadline):
+        timeout = min(REQUEST_TIMEOUT, remaining(deadline))
+        # Only the request itself, not the politeness wait before it.
+        with metrics.timer("scrape_logos.fetch", host=urlparse(url).hostname) as t:
+            with thread_session().get(url, stream=True, timeout=timeout) as response:
+                chunks = []
+                for chunk in response.iter_content(16384):
+                    chunks.append(chunk)
+                    remaining(deadline)
+            t.set(status=response.status_code)
+    return response, b''.join(chunks)
+# --- End Deadlines ---
 
-signal.signal(signal.SIGALRM, timeout_handler)
-# --- End Timeout Handler ---
+def scrape_website_logo(website_url, deadline, limiter):
+    """Runs the shared logo extractor on a website within the politeness limits and the deadline."""
+    with limiter.slot(website_url, deadline):
+        timeout = min(REQUEST_TIMEOUT, remaining(deadline))
+        with metrics.timer("scrape_logos.scrape", host=urlparse(website_url).hostname):
+            return find_logo_on_website(website_url, timeout, thread_session(), on_chunk=lambda: remaining(deadline))
 
-def find_logo_on_website(website_url):
+def find_domain_logo(station_url, limiter, task_deadline=TASK_DEADLINE):
     """
-    Tries to find a logo URL on a given website by scraping its content.
+    Looks up a logo for the domain of a station with a waterfall method:
+    API first, then scraping. Returns (logo_url, outcome) where outcome is
+    'api', 'scrape', 'not_found', 'timeout' or 'error'.
     """
+    deadline = time.monotonic() + task_deadline
+    parsed_url = urlparse(station_url)
     try:
-        # Add a small delay to be polite
-        time.sleep(0.5)
-        response = requests.get(website_url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'lxml')
-        
-        # Try to find logo in meta tags (e.g., Open Graph)
-        og_image = soup.find("meta", property="og:image")
-        if og_image and og_image.get("content"):
-            return og_image["content"]
-            
-        # Try to find logo in link tags (e.g., favicon, apple-touch-icon)
-        icon_link = soup.find("link", rel=["icon", "apple-touch-icon", "shortcut icon"])
-        if icon_link and icon_link.get("href"):
-            return urljoin(website_url, icon_link["href"])
-            
-        # Try to find logo in img tags with common alt/src attributes
-        for img in soup.find_all("img"):
-            img_src = img.get("src", "").lower()
-            img_alt = img.get("alt", "").lower()
-            if "logo" in img_src or "logo" in img_alt:
-                return urljoin(website_url, img.get("src"))
-                
-    except requests.exceptions.RequestException as e:
-        print(f"    -> Scraping Error: {e}")
+        # --- METHOD 1: Clearbit API ---
+        if parsed_url.netloc:
+            try:
+                response, _ = fetch(f"https://logo.clearbit.com/{parsed_url.netloc}", deadline, limiter)
+                if response.status_code == 200 and 'image' in response.headers.get('Content-Type', ''):
+                    return response.url, 'api'
+            except requests.exceptions.RequestException:
+                pass
+
+        # --- METHOD 2: Web Scraping (Fallback) ---
+        base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
+        new_logo_url = scrape_website_logo(base_url, deadline, limiter)
+        if new_logo_url:
+            return urljoin(base_url, new_logo_url), 'scrape'
+        return None, 'not_found'
+    except TimeoutException:
+        return None, 'timeout'
     except Exception as e:
-        print(f"    -> Parsing Error: {e}")
-    return None
+        print(f"  -> ERROR: {station_url}: {e}")
+        return None, 'error'
 
-def scrape_missing_logos():
+def find_station_logo(station_url, limiter, lookup):
     """
-    Scans the database for stations without a logo and tries to find one
-    using a waterfall method: API first, then scraping.
+    Returns (logo_url, outcome, from_cache) for one station, looking up its
+    domain only if the shared logo lookup has no fresh result for it.
+    """
+    with metrics.timer("scrape_logos.station") as t:
+        logo_url, outcome, from_cache = lookup.resolve(station_url, partial(find_domain_logo, limiter=limiter))
+        t.set(outcome=outcome, cached=from_cache)
+    return logo_url, outcome, from_cache
+
+def scrape_missing_logos(db_path=DB_PATH, workers=8, per_domain=1, delay=0.5, restart=False):
+    """
+    Scans the database for stations without a logo and looks them up
+    concurrently. Every processed station is recorded in scrape_progress in
+    the same transaction as its logo, so an interrupted run resumes with the
+    stations it had not finished, and stations that timed out or failed are
+    tried again after RETRY_TTL; restart=True forgets that checkpoint.
     """
     start_time = datetime.now()
     print(f"--- Script started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')} ---")
 
-    conn = sqlite3.connect('radio.db')
+    conn = sqlite3.connect(db_path)
     c = conn.cursor()
+    c.execute(CREATE_PROGRESS_SQL)
+    if restart:
+        c.execute("DELETE FROM scrape_progress")
+    conn.commit()
 
-    c.execute("SELECT id, url, name, logo_url FROM stations ORDER BY name")
-    all_stations = c.fetchall()
-    
-    total_stations = len(all_stations)
-    print(f"Checking {total_stations} total stations...")
-    
-    newly_found_count = 0
-    existing_logo_count = 0
-    failed_count = 0
-    api_success_count = 0
-    scrape_success_count = 0
-
-    for i, (station_id, station_url, station_name, logo_url) in enumerate(all_stations):
-        
-        progress_prefix = f"[{i+1}/{total_stations}] {station_name}:"
-
-        if logo_url:
-            existing_logo_count += 1
-            continue
-
-        print(f"{progress_prefix} Logo MISSING. Starting search...")
-        
-        if not station_url or not station_url.startswith('http'):
-            print("  -> Invalid or missing station URL. Skipping.")
-            failed_count += 1
-            continue
-
-        logo_found = False
-        
-        # --- METHOD 1: Clearbit API ---
-        try:
-            domain = urlparse(station_url).netloc
-            if domain:
-                clearbit_url = f"https://logo.clearbit.com/{domain}"
-                print(f"  -> Phase 1 (API): Checking {clearbit_url}")
-                response = requests.get(clearbit_url, timeout=5)
-                
-                if response.status_code == 200 and 'image' in response.headers.get('Content-Type', ''):
-                    print(f"  -> SUCCESS (API): Found logo at {response.url}")
-                    c.execute("UPDATE stations SET logo_url = ? WHERE id = ?", (response.url, station_id))
-                    conn.commit()
-                    newly_found_count += 1
-                    api_success_count += 1
-                    logo_found = True
-                else:
-                    print("  -> FAILED (API): No logo found via Clearbit.")
-            else:
-                print("  -> FAILED (API): Could not extract domain from station URL.")
-
-        except Exception as e:
-            print(f"  -> ERROR (API): An error occurred: {e}")
-
-        if logo_found:
-            continue
+    existing_logo_count = c.execute("SELECT COUNT(*) FROM stations WHERE logo_url IS NOT NULL AND logo_url != ''").fetchone()[0]
+    retry_before = {"retry_before": time.time() - RETRY_TTL}
+    resumed_count = c.execute(f"SELECT COUNT(*) FROM ({SETTLED_PROGRESS_SQL})", retry_before).fetchone()[0]
+    stations = c.execute(STATIONS_TO_SCRAPE_SQL, retry_before).fetchall()
+    total_stations = len(stations)
+    print(f"Logos already existing: {existing_logo_count}; already attempted: {resumed_count} (timeouts and errors are retried after {RETRY_TTL // 60} minutes)")
+    print(f"Searching logos for {total_stations} stations with {workers} workers...")
 
-        # --- METHOD 2: Web Scraping (Fallback) ---
-        print("  -> Phase 2 (Scraping): Starting website scraping...")
-        signal.alarm(20) # More generous timeout for full scraping
+    counts = {'api': 0, 'scrape': 0, 'not_found': 0, 'invalid_url': 0, 'timeout': 0, 'error': 0}
+    cached_count = 0
+    batch = []
+    limiter = DomainLimiter(per_domain, delay, DOMAIN_LIMIT_OVERRIDES)
+    lookup = LogoLookup(db_path)
+    run_start = time.perf_counter()
+
+    def flush():
+        checked_at = time.time()
+        with metrics.timer("scrape_logos.commit", rows=len(batch)):
+            c.executemany(
+                "UPDATE stations SET logo_url = ? WHERE id = ?",
+                [(logo_url, station_id) for station_id, logo_url, outcome in batch if logo_url],
+            )
+            c.executemany(
+                "INSERT OR REPLACE INTO scrape_progress (station_id, outcome, checked_at) VALUES (?, ?, ?)",
+                [(station_id, outcome, checked_at) for station_id, logo_url, outcome in batch],
+            )
+            conn.commit()
+        batch.clear()
+        done = sum(counts.values())
+        elapsed = time.perf_counter() - run_start
+        found = counts['api'] + counts['scrape']
+        print(f"[{done}/{total_stations}] {found} found, {done - found} failed, {done / elapsed:.2f} stations/s")
+
+    def handle(done_futures):
+        nonlocal cached_count
+        for future in done_futures:
+            station_id, station_name = pending.pop(future)
+            logo_url, outcome, from_cache = future.result()
+            counts[outcome] += 1
+            cached_count += from_cache
+            batch.append((station_id, logo_url, outcome))
+            if logo_url:
+                print(f"  -> SUCCESS ({outcome}): {station_name}: {logo_url}")
+        if len(batch) >= BATCH_SIZE:
+            flush()
+
+    # A sliding window of submitted stations keeps memory flat for large runs.
+    pending = {} # future -> (station_id, station_name)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
         try:
-            parsed_url = urlparse(station_url)
-            base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-            
-            scrape_target_url = base_url
-            
-            new_logo_url = find_logo_on_website(scrape_target_url)
-            
-            if new_logo_url:
-                final_logo_url = urljoin(scrape_target_url, new_logo_url)
-                print(f"  -> SUCCESS (Scraping): Found logo at {final_logo_url}")
-                c.execute("UPDATE stations SET logo_url = ? WHERE id = ?", (final_logo_url, station_id))
-                conn.commit()
-                newly_found_count += 1
-                scrape_success_count += 1
-            else:
-                print("  -> FAILED (Scraping): No logo found on website.")
-                failed_count += 1
-
-        except TimeoutException:
-            print("  -> TIMEOUT (Scraping): Website took too long to respond. Skipping.")
-            failed_count += 1
-        except Exception as e:
-            print(f"  -> ERROR (Scraping): An unexpected error occurred: {e}")
-            failed_count += 1
-        finally:
-            signal.alarm(0) # Disable the alarm
-            
+            for station_id, station_url, station_name in stations:
+                pending[pool.submit(find_station_logo, station_url, limiter, lookup)] = (station_id, station_name)
+                if len(pending) >= 4 * workers:
+                    handle(wait(pending, return_when=FIRST_COMPLETED).done)
+            handle(wait(pending).done)
+        except KeyboardInterrupt:
+            # Handled inside the with block: leaving it first would wait for every queued lookup.
+            pool.shutdown(wait=False, cancel_futures=True)
+            handle([future for future in pending if future.done() and not future.cancelled()])
+            if batch:
+                flush()
+            running = sum(not future.done() for future in pending)
+            print(f"\nInterrupted; finished stations saved. Waiting for {running} running lookups; run again to resume.")
+    if batch:
+        flush()
     conn.close()
 
     end_time = datetime.now()
     duration = end_time - start_time
-    
+    found_count = counts['api'] + counts['scrape']
+    elapsed = time.perf_counter() - run_start
+
     print("\n--- SCRAPING COMPLETE ---")
     print(f"Started at:   {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Finished at:  {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Total duration: {str(duration).split('.')[0]}")
     print("-" * 30)
-    print(f"Total stations scanned:   {total_stations}")
+    print(f"Stations searched:        {sum(counts.values())}")
     print(f"Logos already existing:   {existing_logo_count}")
-    print(f"New logos found (TOTAL):  {newly_found_count}")
-    print(f"  - Found via API:        {api_success_count}")
-    print(f"  - Found via Scraping:   {scrape_success_count}")
-    print(f"Failed attempts:          {failed_count}")
+    print(f"New logos found (TOTAL):  {found_count}")
+    print(f"  - Found via API:        {counts['api']}")
+    print(f"  - Found via Scraping:   {counts['scrape']}")
+    print(f"Failed attempts:          {sum(counts.values()) - found_count}")
+    print(f"  - Timed out:            {counts['timeout']}")
+    print(f"Answered by domain cache: {cached_count}")
+    if elapsed > 0:
+        print(f"Throughput:               {sum(counts.values()) / elapsed:.2f} stations/s")
     print("------------------------------")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find logos for stations that have none.")
+    parser.add_argument("--db", default=DB_PATH, help="database to update (default: radio.db)")
+    parser.add_argument("--workers", type=int, default=8, help="stations searched concurrently (default: 8)")
+    parser.add_argument("--per-domain", type=int, default=1, help="concurrent requests per website (default: 1)")
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds between requests to the same website (default: 0.5)")
+    parser.add_argument("--restart", action="store_true", help="forget the checkpoint and retry every station without a logo")
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    scrape_missing_logos()
+    args = parse_args()
+    scrape_missing_logos(args.db, args.workers, args.per_domain, args.delay, args.restart)
@@ -0,0 +1,391 @@
+"""
+Serves the station catalog in radio.db as JSON over HTTP, for clients other
+than the Tk player.
+
+    GET /countries[?genre=jazz&genre=rock&mode=any]  countries with station counts
+    GET /genres[?country=Italy]                      genres with station counts
+    GET /stations[?country=&genre=&limit=&after=]    one page of stations by name
+    GET /stations/<id>                               one station in detail
+    GET /search?q=radio+ber[&country=&genre=&limit=] stations matching a search
+
+Pages come from the same keyset queries as the player's station list; the
+"next" value of a page is passed back as `after` to get the one after it.
+Facet counts come from the in-memory facet index, and the unfiltered lists
+are serialized once per catalog version.
+
+Every response carries the catalog version as its ETag. The version changes
+when build_db.py rebuilds the catalog or anything else writes to radio.db,
+so a client that sends If-None-Match with the version it has gets an empty
+304, once the request itself has been checked. Full responses are kept in
+a small LRU per version, so popular pages, and 304s for them, are served
+without touching SQLite. While radio.db is missing or half-built, requests
+get 503 with Retry-After.
+
+    python station_server.py --port 8080
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from build_db import DB_PATH
+from facets import FacetIndex
+from queries import (
+    get_countries, get_genres, get_station_page, search_stations,
+    STATION_PAGE_SIZE, SEARCH_PAGE_SIZE,
+)
+
+POOL_SIZE = 8
+MAX_PAGE_SIZE = 500
+# Responses kept per catalog version.
+RESPONSE_CACHE_ITEMS = 1024
+# The database file is looked at no more often than this, in seconds.
+VERSION_CHECK_INTERVAL = 1.0
+
+STATION_DETAIL_SQL = """
+    SELECT s.id, s.name, s.url, s.status, s.logo_url, c.name,
+        s.bitrate, s.content_type, s.icy_name, s.icy_genre, s.last_checked
+    FROM stations s
+    LEFT JOIN countries c ON c.id = s.country_id
+    WHERE s.id = ?
+"""
+
+STATION_GENRES_SQL = """
+    SELECT g.name
+    FROM station_genres sg
+    JOIN genres g ON g.id = sg.genre_id
+    WHERE sg.station_id = ?
+    ORDER BY g.name
+"""
+
+# The other stream URLs the station is listed with (see build_db.merge_staged_stations).
+STATION_MIRRORS_SQL = "SELECT url FROM station_mirrors WHERE station_id = ? AND url <> ? ORDER BY url"
+
+class BadRequest(Exception):
+    pass
+
+class NotFound(Exception):
+    pass
+
+class Unavailable(Exception):
+    """radio.db is missing or unreadable, for example while build_db.py rebuilds it."""
+
+def connect_readonly(db_path):
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False, cached_statements=256)
+
+class ConnectionPool:
+    """
+    A fixed number of read-only connections shared by the request threads,
+    each opened when it is first needed, so the server starts while radio.db
+    is missing. reopen() retires all of them: after a rebuild has replaced
+    radio.db, a connection opened before would keep reading the old, deleted
+    file.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.generation = 0
+        self.idle = queue.LifoQueue()
+        for _ in range(size):
+            self.idle.put((self.generation, None))
+
+    def reopen(self):
+        self.generation += 1
+
+    @contextmanager
+    def connection(self):
+        generation, conn = self.idle.get()
+        try:
+            if conn is None or generation != self.generation:
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                generation = self.generation
+                try:
+                    conn = connect_readonly(self.db_path)
+                except sqlite3.Error as e:
+                    raise Unavailable(f"{self.db_path} cannot be opened: {e}")
+            yield conn
+        finally:
+            self.idle.put((generation, conn))
+
+    def close(self):
+        while not self.idle.empty():
+            conn = self.idle.get()[1]
+            if conn is not None:
+                conn.close()
+
+def station_json(row):
+    station_id, name, url, status, logo_url = row
+    return {"id": station_id, "name": name, "url": url, "status": status, "logo_url": logo_url}
+
+def encode_cursor(row):
+    """Opaque `after` value for the (name, id) key of a station row."""
+    return base64.urlsafe_b64encode(json.dumps([row[1], row[0]]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        name, station_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, binascii.Error):
+        raise BadRequest("invalid 'after' cursor")
+    if not isinstance(name, str) or not isinstance(station_id, int):
+        raise BadRequest("invalid 'after' cursor")
+    return name, station_id
+
+def page_limit(params, default):
+    try:
+        limit = int(params.get("limit", [default])[0])
+    except ValueError:
+        raise BadRequest("'limit' must be an integer")
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def to_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class StationDirectory:
+    """
+    The JSON endpoints, independent of HTTP: get(target) returns the
+    catalog version and the response body for a request target such as
+    "/stations?country=Italy", or raises BadRequest or NotFound.
+    """
+
+    def __init__(self, db_path=DB_PATH, pool_size=POOL_SIZE, cache_items=RESPONSE_CACHE_ITEMS):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.cache_items = cache_items
+        self.lock = threading.Lock()
+        self.file_state = None
+        self.checked_at = 0.0
+        self.version = None
+        self.responses = OrderedDict() # target -> body, for the current version
+        self.routes = {
+            "/countries": self.countries,
+            "/genres": self.genres,
+            "/stations": self.stations,
+            "/search": self.search,
+        }
+        try:
+            self.current_version()
+        except Unavailable as e:
+            print(f"Starting without a catalog: {e}")
+
+    def current_version(self):
+        """
+        The catalog version, reloading the facets when radio.db has changed
+        since it was last looked at. Stats the file at most once per
+        VERSION_CHECK_INTERVAL.
+        """
+        now = time.monotonic()
+        if now - self.checked_at < VERSION_CHECK_INTERVAL:
+            return self.version
+        with self.lock:
+            if now - self.checked_at < VERSION_CHECK_INTERVAL:
+                return self.version
+            try:
+                stat = os.stat(self.db_path)
+            except FileNotFoundError:
+                raise Unavailable(f"{self.db_path} is being rebuilt")
+            file_state = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if file_state != self.file_state:
+                if self.file_state is not None and file_state[0] != self.file_state[0]:
+                    self.pool.reopen()
+                try:
+                    self.load(file_state)
+                except sqlite3.Error as e:
+                    # A build that has only just started: tables or facets are missing.
+                    raise Unavailable(f"{self.db_path} is not readable yet: {e}")
+            self.checked_at = now
+            return self.version
+
+    def load(self, file_state):
+        with self.pool.connection() as conn:
+            try:
+                build = conn.execute("SELECT version FROM build_info WHERE id = 1").fetchone()
+            except sqlite3.OperationalError:
+                build = None # built before build_info existed
+            facet_index = FacetIndex.load(conn)
+            countries = get_countries(conn)
+            genres = get_genres(conn)
+        self.facet_index = facet_index
+        self.country_names = countries
+        self.genre_names = genres
+        # Precomputed facet lists for the common unfiltered requests.
+        self.responses = OrderedDict()
+        self.responses["/countries"] = to_json(self.facet_list(countries, facet_index.country_counts([])))
+        self.responses["/genres"] = to_json(self.facet_list(genres, facet_index.genre_counts([])))
+        build_version = build[0][:12] if build and build[0] else "0"
+        self.version = f"{build_version}.{file_state[2]:x}"
+        self.file_state = file_state
+
+    def facet_list(self, names, counts):
+        return {"items": [{"name": name, "stations": counts.get(name, 0)} for name in names]}
+
+    def get(self, target):
+        version = self.current_version()
+        # A reload replaces self.responses and self.version together, under the lock.
+        with self.lock:
+            body = self.responses.get(target)
+            if body is not None:
+                self.responses.move_to_end(target)
+                return self.version, body
+
+        parts = urlsplit(target)
+        params = parse_qs(parts.query)
+        path = parts.path.rstrip("/") or "/"
+        if path.startswith("/stations/"):
+            body = to_json(self.station(path[len("/stations/"):]))
+        elif path in self.routes:
+            body = to_json(self.routes[path](params))
+        else:
+            raise NotFound(f"no such endpoint: {path}")
+        self.remember(target, body, version)
+        return version, body
+
+    def remember(self, target, body, version):
+        """Caches body unless the catalog has changed since it was computed for version."""
+        with self.lock:
+            if self.version != version:
+                return
+            self.responses[target] = body
+            self.responses.move_to_end(target)
+            while len(self.responses) > self.cache_items:
+                self.responses.popitem(last=False)
+
+    def countries(self, params):
+        genres = params.get("genre", [])
+        mode = params.get("mode", ["any"])[0]
+        return self.facet_list(self.country_names, self.facet_index.country_counts(genres, mode))
+
+    def genres(self, params):
+        countries = params.get("country", [])
+        return self.facet_list(self.genre_names, self.facet_index.genre_counts(countries))
+
+    def stations(self, params):
+        limit = page_limit(params, STATION_PAGE_SIZE)
+        after = decode_cursor(params["after"][0]) if "after" in params else None
+        country = params.get("country", [None])[0]
+        genre = params.get("genre", [None])[0]
+        with self.pool.connection() as conn:
+            # One row more than asked tells whether there is a next page.
+            rows = get_station_page(conn, country, genre, after=after, limit=limit + 1)
+        page = rows[:limit]
+        return {
+            "stations": [station_json(row) for row in page],
+            "next": encode_cursor(page[-1]) if len(rows) > limit else None,
+        }
+
+    def search(self, params):
+        text = params.get("q", [""])[0]
+        if not text.strip():
+            raise BadRequest("missing search text 'q'")
+        limit = page_limit(params, SEARCH_PAGE_SIZE)
+        country = params.get("country", [None])[0]
+        genre = params.get("genre", [None])[0]
+        with self.pool.connection() as conn:
+            rows = search_stations(conn, text, country, genre, limit)
+        return {"stations": [station_json(row) for row in rows]}
+
+    def station(self, station_id):
+        if not station_id.isdigit():
+            raise NotFound(f"no such station: {station_id}")
+        with self.pool.connection() as conn:
+            row = conn.execute(STATION_DETAIL_SQL, (int(station_id),)).fetchone()
+            if row is None:
+                raise NotFound(f"no such station: {station_id}")
+            genres = [genre for genre, in conn.execute(STATION_GENRES_SQL, (row[0],))]
+            try:
+                mirrors = [url for url, in conn.execute(STATION_MIRRORS_SQL, (row[0], row[2]))]
+            except sqlite3.OperationalError:
+                mirrors = [] # built before stations were grouped
+        station = station_json(row[:5])
+        station.update(zip(
+            ("country", "bitrate", "content_type", "icy_name", "icy_genre", "last_checked"), row[5:]
+        ))
+        station["genres"] = genres
+        station["mirrors"] = mirrors
+        return station
+
+    def close(self):
+        self.pool.close()
+
+class StationRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a client can send many requests over one connection.
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle's algorithm the body
+    # would wait for the client's delayed ACK, about 40 ms per response.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        directory = self.server.directory
+        try:
+            # The route and its parameters are checked before a conditional
+            # request is answered; a response served before comes from the cache.
+            version, body = directory.get(self.path)
+            etag = f'"{version}"'
+            if etag in self.headers.get("If-None-Match", "").replace(" ", "").split(","):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_body(200, body, etag)
+        except BadRequest as e:
+            self.send_body(400, to_json({"error": str(e)}))
+        except NotFound as e:
+            self.send_body(404, to_json({"error": str(e)}))
+        except Unavailable as e:
+            self.send_body(503, to_json({"error": str(e)}), retry_after=VERSION_CHECK_INTERVAL)
+        except sqlite3.Error as e:
+            self.log_error("database error: %s", e)
+            self.send_body(500, to_json({"error": "database error"}))
+
+    def send_body(self, code, body, etag=None, retry_after=None):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if retry_after:
+            self.send_header("Retry-After", str(max(1, round(retry_after))))
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def make_server(db_path=DB_PATH, host="127.0.0.1", port=8080, pool_size=POOL_SIZE, quiet=False):
+    server = ThreadingHTTPServer((host, port), StationRequestHandler)
+    server.daemon_threads = True
+    server.directory = StationDirectory(db_path, pool_size)
+    server.quiet = quiet
+    return server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the station catalog as JSON over HTTP.")
+    parser.add_argument("--db", default=DB_PATH, help="catalog to serve (default: radio.db)")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("--pool", type=int, default=POOL_SIZE, help=f"read-only database connections (default: {POOL_SIZE})")
+    parser.add_argument("--quiet", action="store_true", help="do not log every request")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    httpd = make_server(args.db, args.host, args.port, args.pool, args.quiet)
+    print(f"Serving {args.db} on http://{args.host}:{args.port}/")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+    httpd.directory.close()
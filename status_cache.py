@@ -0,0 +1,91 @@
+"""
+Station status cache for the player.
+
+Statuses are kept in memory keyed by station id and written through to the
+status/last_checked columns of the stations table, which healthcheck.py
+fills in bulk. A status younger than the TTL is used as is; an older one is
+still shown while a background probe refreshes it.
+"""
+import sqlite3
+import threading
+import time
+
+from build_db import DB_PATH
+from queries import connect
+
+# Seconds a probe result is trusted before it is refreshed.
+STATUS_TTL = 600
+
+# The player probes with a shorter timeout than the bulk checker.
+PROBE_TIMEOUT = 2
+
+LAST_STATUS_SQL = """
+    SELECT status, last_checked, bitrate, content_type FROM stations
+    WHERE id = ? AND last_checked IS NOT NULL
+"""
+
+class StatusCache:
+    """
+    Last known (status, checked_at, bitrate, content_type) per station id.
+    lookup() is called from the UI thread; probe() runs on the player's
+    worker threads (see work_queue.py), which keep their pooled sessions.
+    """
+
+    def __init__(self, db_path=DB_PATH, ttl=STATUS_TTL, timeout=PROBE_TIMEOUT):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = {} # station_id -> (status, checked_at, bitrate, content_type)
+
+    def lookup(self, conn, station_id):
+        """Returns (status, checked_at, bitrate, content_type) from memory or the database, or None if never checked."""
+        with self.lock:
+            entry = self.entries.get(station_id)
+        if entry is None:
+            entry = conn.execute(LAST_STATUS_SQL, (station_id,)).fetchone()
+            if entry is not None:
+                with self.lock:
+                    entry = self.entries.setdefault(station_id, entry)
+        return entry
+
+    def status(self, station_id):
+        """Last known status held in memory, or None."""
+        with self.lock:
+            entry = self.entries.get(station_id)
+        return entry[0] if entry else None
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry[1] < self.ttl
+
+    def store(self, station_id, status, http_code=None, ttfb_ms=None, stream_info=None, checked_at=None):
+        """Saves a probe result; returns the new entry."""
+        # healthcheck pulls in requests; it is only needed once probing starts.
+        from healthcheck import NO_STREAM_INFO, UPDATE_STATUS_SQL
+        stream_info = stream_info or NO_STREAM_INFO
+        checked_at = checked_at or time.time()
+        bitrate, content_type = stream_info[:2]
+        with self.lock:
+            # Like the database, keep the stream details of the last successful probe.
+            previous = self.entries.get(station_id)
+            if previous is not None:
+                bitrate = bitrate or previous[2]
+                content_type = content_type or previous[3]
+            entry = self.entries[station_id] = (status, checked_at, bitrate, content_type)
+        try:
+            conn = connect(self.db_path)
+            try:
+                conn.execute(UPDATE_STATUS_SQL, (status, http_code, ttfb_ms, checked_at, *stream_info, station_id))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # The in-memory entry still serves this session.
+            print(f"Could not save status of station {station_id}: {e}")
+        return entry
+
+    def probe(self, station_id, url):
+        """Probes url now, stores the result and returns the new entry. Runs on a player worker thread."""
+        from healthcheck import probe_url
+        status, http_code, ttfb_ms, stream_info = probe_url(url, self.timeout)
+        return self.store(station_id, status, http_code, ttfb_ms, stream_info)
@@ -0,0 +1,361 @@
+"""
+Resolves station URLs to the stream they finally point at.
+
+Many catalog URLs are .pls/.m3u playlists or chains of HTTP redirects, and
+playing one from the catalog URL pays for every hop before audio starts.
+resolve_stream() follows redirects and playlists hop by hop, up to the
+response that carries the audio, and measures how long the hops before
+that response took: the time a Play from the resolved URL saves.
+
+Results are kept in the stream_urls table for RESOLVED_TTL (failures for
+FAILED_TTL), keyed by station and valid only while the station's catalog
+URL is unchanged. This script fills the table in bulk; the player resolves
+a selected station in the same pass as its status probe and plays the
+resolved URL. Redirect targets often carry expiring tokens or name one
+edge server of many, so when a resolved URL fails to play the player
+discards it and plays the station once more from its catalog URL.
+
+    python stream_resolver.py --workers 32 --older-than 86400
+"""
+import argparse
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from urllib.parse import urljoin, urlsplit
+
+from build_db import DB_PATH
+from queries import connect
+
+RESOLVED_TTL = 24 * 3600
+# A station that could not be resolved is played from its catalog URL and
+# tried again after this long.
+FAILED_TTL = 3600
+# The player resolves with a shorter timeout than the bulk job.
+RESOLVE_TIMEOUT = 3
+
+# Redirects and playlists followed before giving up.
+MAX_HOPS = 8
+MAX_PLAYLIST_BYTES = 64 * 1024
+# Results are written back in batches, each in its own transaction.
+BATCH_SIZE = 200
+
+PLAYLIST_TYPES = {
+    "audio/x-scpls", "audio/scpls", "application/pls+xml",
+    "audio/x-mpegurl", "audio/mpegurl", "application/x-mpegurl",
+    "application/vnd.apple.mpegurl", "application/vnd.apple.mpegurl.audio",
+}
+PLAYLIST_SUFFIXES = (".pls", ".m3u", ".m3u8")
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+
+CREATE_STREAM_URLS = """
+    CREATE TABLE IF NOT EXISTS stream_urls (
+        station_id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL,
+        resolved_url TEXT,
+        hops INTEGER,
+        saved_ms REAL,
+        resolved_at REAL NOT NULL,
+        error TEXT
+    )
+"""
+
+SAVE_RESOLUTION_SQL = """
+    INSERT OR REPLACE INTO stream_urls (station_id, url, resolved_url, hops, saved_ms, resolved_at, error)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+STREAM_URL_SQL = "SELECT url, resolved_url, hops, saved_ms, resolved_at, error FROM stream_urls WHERE station_id = ?"
+
+STATIONS_TO_RESOLVE_SQL = """
+    SELECT s.id, s.url FROM stations s
+    LEFT JOIN stream_urls r ON r.station_id = s.id
+    WHERE s.url LIKE 'http%'
+      AND (r.station_id IS NULL OR r.url <> s.url
+           OR r.resolved_at < CASE WHEN r.resolved_url IS NULL THEN ? ELSE ? END)
+    ORDER BY r.resolved_at IS NOT NULL, r.resolved_at, s.id
+"""
+
+def is_playlist(response):
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type in PLAYLIST_TYPES:
+        return True
+    # Servers often send playlists as text/plain or octet-stream.
+    path = urlsplit(response.url).path.lower()
+    return path.endswith(PLAYLIST_SUFFIXES) and not content_type.startswith(("audio/", "video/"))
+
+def read_playlist(response):
+    """Up to MAX_PLAYLIST_BYTES of a playlist body as text."""
+    body = bytearray()
+    for chunk in response.iter_content(8192):
+        body += chunk
+        if len(body) >= MAX_PLAYLIST_BYTES:
+            break
+    return body[:MAX_PLAYLIST_BYTES].decode("utf-8", errors="replace")
+
+def playlist_entry(text):
+    """
+    First stream URL of a PLS or M3U playlist, or "" for an HLS playlist,
+    which VLC plays itself. None when the playlist has no entry.
+    """
+    if "#EXT-X-" in text:
+        return ""
+    for line in text.splitlines():
+        line = line.strip()
+        if line.lower().startswith("file") and "=" in line:
+            return line.split("=", 1)[1].strip()
+        if line and not line.startswith(("#", "[")) and "=" not in line.split("/", 1)[0]:
+            return line
+    return None
+
+def resolve_stream(url, timeout=5, session=None):
+    """
+    Follows redirects and playlists from url to the stream itself. Returns
+    (resolved_url, hops, saved_ms, error, probe) where probe is the
+    (status, http_code, ttfb_ms, stream_info) of the final response, as
+    returned by healthcheck.probe_url. saved_ms is the time spent before
+    the final request. resolved_url is None when the stream could not be
+    reached.
+    """
+    # requests and healthcheck are only loaded once resolving starts, so
+    # the player can import this module at startup.
+    import requests
+    from healthcheck import NO_STREAM_INFO, parse_stream_headers, thread_session
+    session = session or thread_session()
+    start = time.perf_counter()
+    current = url
+    hops = 0
+    try:
+        while hops <= MAX_HOPS:
+            hop_start = time.perf_counter()
+            with session.get(current, stream=True, timeout=timeout, allow_redirects=False) as response:
+                if response.status_code in REDIRECT_CODES and response.headers.get("Location"):
+                    current = urljoin(current, response.headers["Location"])
+                    hops += 1
+                    continue
+                entry = None
+                if response.status_code == 200 and is_playlist(response):
+                    entry = playlist_entry(read_playlist(response))
+                    if entry is None:
+                        return None, hops, None, "empty playlist", ("Offline", response.status_code, None, NO_STREAM_INFO)
+                if entry:
+                    current = urljoin(current, entry)
+                    hops += 1
+                    continue
+                ttfb_ms = (time.perf_counter() - hop_start) * 1000
+                saved_ms = (hop_start - start) * 1000
+                status = "Online" if response.status_code == 200 else "Offline"
+                probe = (status, response.status_code, ttfb_ms, parse_stream_headers(response.headers))
+                if status != "Online":
+                    return None, hops, None, f"HTTP {response.status_code}", probe
+                return current, hops, saved_ms, None, probe
+        return None, hops, None, "too many hops", ("Offline", None, None, NO_STREAM_INFO)
+    except requests.exceptions.RequestException as e:
+        return None, hops, None, type(e).__name__, ("Offline", None, None, NO_STREAM_INFO)
+
+class StreamResolver:
+    """
+    Resolved stream URLs per station for the player. lookup() is called on
+    the UI thread and reads through to the database; resolve() runs on the
+    player's worker threads and writes through with its own connection.
+    """
+
+    def __init__(self, db_path=DB_PATH, ttl=RESOLVED_TTL, failed_ttl=FAILED_TTL, timeout=RESOLVE_TIMEOUT):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.failed_ttl = failed_ttl
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = {} # station_id -> (url, resolved_url, hops, saved_ms, resolved_at, error)
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(CREATE_STREAM_URLS)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def lookup(self, conn, station_id, url):
+        """The entry of a station if it was resolved from its current URL, or None."""
+        with self.lock:
+            entry = self.entries.get(station_id)
+        if entry is None:
+            entry = conn.execute(STREAM_URL_SQL, (station_id,)).fetchone()
+            if entry is not None:
+                with self.lock:
+                    entry = self.entries.setdefault(station_id, entry)
+        if entry is None or entry[0] != url:
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        if entry is None:
+            return False
+        ttl = self.ttl if entry[1] else self.failed_ttl
+        return time.time() - entry[4] < ttl
+
+    def resolved(self, station_id, url):
+        """The fresh entry of a station held in memory, or None. Never touches the database."""
+        with self.lock:
+            entry = self.entries.get(station_id)
+        if entry is None or entry[0] != url or not self.is_fresh(entry):
+            return None
+        return entry
+
+    def playback_url(self, station_id, url):
+        """The URL to hand to VLC: the resolved stream when one is known."""
+        entry = self.resolved(station_id, url)
+        return entry[1] if entry and entry[1] else url
+
+    def discard(self, station_id, resolved_url):
+        """
+        Forgets a resolved URL that failed to play, so the station is played
+        from its catalog URL and resolved again on its next selection.
+        Returns that catalog URL, or None if resolved_url was not the
+        station's resolved stream.
+        """
+        with self.lock:
+            entry = self.entries.get(station_id)
+            if entry is None or not entry[1] or entry[1] != resolved_url or entry[1] == entry[0]:
+                return None
+            del self.entries[station_id]
+        # Not on the thread reporting the failure.
+        threading.Thread(target=self.delete, args=(station_id, resolved_url), daemon=True).start()
+        return entry[0]
+
+    def delete(self, station_id, resolved_url):
+        try:
+            conn = connect(self.db_path)
+            try:
+                conn.execute("DELETE FROM stream_urls WHERE station_id = ? AND resolved_url = ?", (station_id, resolved_url))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not discard stream URL of station {station_id}: {e}")
+
+    def resolve(self, station_id, url):
+        """
+        Resolves url now and stores the result. Returns the probe of the
+        final response, (status, http_code, ttfb_ms, stream_info), so the
+        caller gets the station's status from the same requests.
+        """
+        resolved_url, hops, saved_ms, error, probe = resolve_stream(url, self.timeout)
+        entry = (url, resolved_url, hops, saved_ms, time.time(), error)
+        with self.lock:
+            self.entries[station_id] = entry
+        try:
+            conn = connect(self.db_path)
+            try:
+                conn.execute(SAVE_RESOLUTION_SQL, (station_id, *entry))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not save stream URL of station {station_id}: {e}")
+        return probe
+
+def resolve_station(station_id, url, limiter, timeout):
+    with limiter.semaphore(url):
+        resolved_url, hops, saved_ms, error, _ = resolve_stream(url, timeout)
+    return station_id, url, resolved_url, hops, saved_ms, time.time(), error
+
+def resolve_stations(conn, stations, workers=32, per_host=2, timeout=5):
+    """
+    Resolves (station_id, url) pairs concurrently and writes them to
+    stream_urls in batches. Returns a dict of counters and the total
+    milliseconds saved.
+    """
+    from healthcheck import HostLimiter, interleave_by_host
+    limiter = HostLimiter(per_host)
+    counts = {"direct": 0, "indirect": 0, "failed": 0}
+    saved_total = 0.0
+    batch = []
+    total = len(stations)
+    start = time.perf_counter()
+    done = 0
+
+    def flush():
+        conn.executemany(SAVE_RESOLUTION_SQL, batch)
+        conn.commit()
+        batch.clear()
+        elapsed = time.perf_counter() - start
+        print(f"[{done}/{total}] {counts['indirect']} indirect, {counts['direct']} direct, "
+              f"{counts['failed']} failed, {done / elapsed:.1f} stations/s")
+
+    # A sliding window of submitted stations keeps memory flat for large runs.
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        stations = iter(interleave_by_host(stations))
+        while True:
+            for station_id, url in stations:
+                pending.add(pool.submit(resolve_station, station_id, url, limiter, timeout))
+                if len(pending) >= 4 * workers:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                resolved_url, hops, saved_ms = result[2:5]
+                if resolved_url is None:
+                    counts["failed"] += 1
+                elif hops:
+                    counts["indirect"] += 1
+                    saved_total += saved_ms
+                else:
+                    counts["direct"] += 1
+                batch.append(result)
+                done += 1
+                if len(batch) >= BATCH_SIZE:
+                    flush()
+    if batch:
+        flush()
+    return counts, saved_total
+
+def stations_to_resolve(conn, older_than=None, limit=None):
+    """Stations never resolved, resolved from a different URL, or whose entry has expired."""
+    now = time.time()
+    if older_than is None:
+        params = [now - FAILED_TTL, now - RESOLVED_TTL]
+    else:
+        params = [now - older_than, now - older_than]
+    query = STATIONS_TO_RESOLVE_SQL
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resolve station URLs to their final streams and store them.")
+    parser.add_argument("--db", default=DB_PATH, help="database to update (default: radio.db)")
+    parser.add_argument("--workers", type=int, default=32, help="concurrent resolutions (default: 32)")
+    parser.add_argument("--per-host", type=int, default=2, help="concurrent requests per host (default: 2)")
+    parser.add_argument("--timeout", type=float, default=5, help="connect/read timeout per hop in seconds (default: 5)")
+    parser.add_argument("--older-than", type=float, help="re-resolve entries older than this many seconds (default: their TTL)")
+    parser.add_argument("--limit", type=int, help="resolve at most this many stations")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start_time = datetime.now()
+    print(f"--- Stream resolution started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')} ---")
+
+    conn = sqlite3.connect(args.db)
+    conn.execute(CREATE_STREAM_URLS)
+    stations = stations_to_resolve(conn, args.older_than, args.limit)
+    print(f"Resolving {len(stations)} stations with {args.workers} workers ({args.per_host} per host)...")
+    counts, saved_total = resolve_stations(conn, stations, args.workers, args.per_host, args.timeout)
+    conn.close()
+
+    duration = datetime.now() - start_time
+    print("\n--- STREAM RESOLUTION COMPLETE ---")
+    print(f"Total duration: {str(duration).split('.')[0]}")
+    print(f"Playlists or redirects: {counts['indirect']}")
+    print(f"Direct streams:         {counts['direct']}")
+    print(f"Failed:                 {counts['failed']}")
+    if counts["indirect"]:
+        print(f"Time saved per Play of an indirect station: {saved_total / counts['indirect']:.0f} ms on average")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+healthcheck.probe_url and check_stations against a local stand-in for
+stream servers: online, offline, slow and redirecting stations, and the
+batched write-back to radio.db.
+"""
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+
+import build_db
+import healthcheck
+
+SLOW_SECONDS = 2
+TIMEOUT = 0.5
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path.startswith("/online"):
+            # Recorded before replying: the probe may return as soon as the headers arrive.
+            self.server.icy_requests.append(self.headers.get("Icy-MetaData"))
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("icy-br", "128")
+            self.send_header("icy-name", "Stand-in FM")
+            self.send_header("icy-genre", "Jazz")
+            self.send_header("icy-metaint", "16000")
+            self.end_headers()
+            # An endless stream: the probe must not read it.
+            try:
+                while not self.server.stopping.is_set():
+                    self.wfile.write(bytes(4096))
+                    time.sleep(0.01)
+            except OSError:
+                pass
+        elif path.startswith("/redirect"):
+            self.send_response(302)
+            self.send_header("Location", "/online")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif path.startswith("/slow"):
+            time.sleep(SLOW_SECONDS)
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.daemon_threads = True
+    server.stopping = threading.Event()
+    server.icy_requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.stopping.set()
+    server.shutdown()
+    server.server_close()
+
+def closed_port_url():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{probe.getsockname()[1]}/stream"
+
+def test_probe_online(server):
+    start = time.perf_counter()
+    status, http_code, ttfb_ms, stream_info = healthcheck.probe_url(server.base + "/online", TIMEOUT)
+    assert time.perf_counter() - start < SLOW_SECONDS
+    assert (status, http_code) == ("Online", 200)
+    assert 0 < ttfb_ms < TIMEOUT * 1000
+    assert stream_info == (128, "audio/mpeg", "Stand-in FM", "Jazz", 16000)
+    assert server.icy_requests[-1] == "1"
+
+def test_probe_offline(server):
+    assert healthcheck.probe_url(server.base + "/missing", TIMEOUT)[:2] == ("Offline", 404)
+
+def test_probe_slow(server):
+    start = time.perf_counter()
+    assert healthcheck.probe_url(server.base + "/slow", TIMEOUT) == ("Offline", None, None, healthcheck.NO_STREAM_INFO)
+    assert time.perf_counter() - start < SLOW_SECONDS
+
+def test_probe_redirect(server):
+    status, http_code, ttfb_ms, stream_info = healthcheck.probe_url(server.base + "/redirect", TIMEOUT)
+    assert (status, http_code) == ("Online", 200)
+    assert stream_info[0] == 128
+
+def test_probe_refused():
+    assert healthcheck.probe_url(closed_port_url(), TIMEOUT) == ("Offline", None, None, healthcheck.NO_STREAM_INFO)
+
+class CountingConnection:
+    """Passes everything to a connection and counts its commits."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+        self.conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+def test_check_stations_writes_results_in_batches(server, tmp_path):
+    with mock.patch("builtins.print"):
+        conn = build_db.create_database(str(tmp_path / "radio.db"))
+    paths = ["/online", "/redirect", "/missing", "/slow"]
+    urls = [f"{server.base}{paths[index % 4]}?n={index}" for index in range(10)] + [closed_port_url()]
+    conn.executemany("INSERT INTO stations (id, name, url) VALUES (?, ?, ?)", [(index + 1, f"s{index}", url) for index, url in enumerate(urls)])
+    # A station whose stream details must survive a failed probe.
+    conn.execute("UPDATE stations SET bitrate = 64, content_type = 'audio/aac' WHERE id = 3")
+    conn.commit()
+
+    stations = healthcheck.stations_to_check(conn)
+    counting = CountingConnection(conn)
+    with mock.patch.object(healthcheck, "BATCH_SIZE", 4), mock.patch("builtins.print"):
+        counts = healthcheck.check_stations(counting, stations, workers=8, per_host=8, timeout=TIMEOUT)
+
+    assert counts == {"Online": 6, "Offline": 5}
+    # 11 results in batches of 4: two full batches and the rest.
+    assert counting.commits == 3
+    rows = {row[0]: row[1:] for row in conn.execute(
+        "SELECT id, status, http_code, ttfb_ms IS NOT NULL, last_checked IS NOT NULL, bitrate, content_type, icy_name FROM stations"
+    )}
+    assert rows[1] == ("Online", 200, 1, 1, 128, "audio/mpeg", "Stand-in FM")
+    assert rows[2] == ("Online", 200, 1, 1, 128, "audio/mpeg", "Stand-in FM")
+    assert rows[3] == ("Offline", 404, 1, 1, 64, "audio/aac", None)
+    assert rows[4] == ("Offline", None, 0, 1, None, None, None)
+    assert rows[11] == ("Offline", None, 0, 1, None, None, None)
+    assert healthcheck.stations_to_check(conn, older_than=3600) == []
+    conn.close()
@@ -0,0 +1,196 @@
+"""
+Playback against a local WAV stream under VLC's dummy audio output: a cold
+start, the switch to a station buffered on the standby player, playing
+without a standby, the play_times rows and the error callback. Skipped where python-vlc or libvlc
+is missing.
+"""
+import socket
+import sqlite3
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+try:
+    import vlc
+    vlc.libvlc_get_version()
+except (ImportError, OSError, NameError, AttributeError): # python-vlc without libvlc fails in several ways
+    pytest.skip("python-vlc or libvlc is not installed", allow_module_level=True)
+
+from playback import Playback
+
+VLC_ARGS = ("--aout=dummy", "--no-video", "--quiet")
+TIMEOUT = 15
+SAMPLE_RATE = 8000
+
+class WavStream(BaseHTTPRequestHandler):
+    """An endless 8 kHz mono WAV of silence, sent in real time like a radio stream."""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.end_headers()
+        data_size = 0x7FFFFFF0
+        header = b"RIFF" + struct.pack("<I", data_size + 36) + b"WAVE"
+        header += b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16)
+        header += b"data" + struct.pack("<I", data_size)
+        chunk = bytes(SAMPLE_RATE // 5) # 0.1 s
+        try:
+            self.wfile.write(header)
+            while not self.server.stopping.is_set():
+                self.wfile.write(chunk)
+                time.sleep(0.1)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def stream_urls():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WavStream)
+    server.daemon_threads = True
+    server.stopping = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield [f"{base}/station{index}.wav" for index in range(3)]
+    server.stopping.set()
+    server.shutdown()
+    server.server_close()
+
+class Recorder:
+    """Collects on_audio and on_error calls so a test can wait for them."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.audio = []
+        self.errors = []
+
+    def on_audio(self, station_id, mode, ttfa_ms):
+        with self.condition:
+            self.audio.append((station_id, mode, ttfa_ms))
+            self.condition.notify_all()
+
+    def on_error(self, station_id, url, active):
+        with self.condition:
+            self.errors.append((station_id, url, active))
+            self.condition.notify_all()
+
+    def wait_for(self, predicate):
+        with self.condition:
+            assert self.condition.wait_for(predicate, TIMEOUT), (self.audio, self.errors)
+
+@pytest.fixture
+def playback(tmp_path):
+    recorder = Recorder()
+    playback = Playback(str(tmp_path / "radio.db"), VLC_ARGS, on_audio=recorder.on_audio, on_error=recorder.on_error)
+    playback.start()
+    if playback.instance is None:
+        pytest.skip("libvlc could not create an instance")
+    playback.recorder = recorder
+    yield playback
+    playback.stop()
+    playback.active.release()
+    playback.standby.release()
+    playback.instance.release()
+
+def wait_until_playing(playback, station_id):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        with playback.measure_lock:
+            if any(slot.station_id == station_id and slot.playing for slot in playback.slots.values()):
+                return
+        time.sleep(0.05)
+    pytest.fail(f"station {station_id} never started playing")
+
+def play_times(db_path, count):
+    """The play_times rows once count of them have been saved by their threads."""
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        conn = sqlite3.connect(db_path)
+        try:
+            rows = conn.execute("SELECT station_id, url, mode, ttfa_ms FROM play_times ORDER BY played_at").fetchall()
+        finally:
+            conn.close()
+        if len(rows) >= count or time.monotonic() > deadline:
+            return rows
+        time.sleep(0.05)
+
+def test_cold_start(playback, stream_urls):
+    recorder = playback.recorder
+    playback.play(1, stream_urls[0])
+    recorder.wait_for(lambda: recorder.audio)
+    station_id, mode, ttfa_ms = recorder.audio[0]
+    assert (station_id, mode) == (1, "cold")
+    assert 0 < ttfa_ms < TIMEOUT * 1000
+    assert playback.is_playing()
+    assert not playback.active.audio_get_mute()
+
+def test_standby_swap(playback, stream_urls):
+    recorder = playback.recorder
+    playback.play(1, stream_urls[0])
+    recorder.wait_for(lambda: len(recorder.audio) == 1)
+    first = playback.active
+
+    playback.prepare(2, stream_urls[1])
+    assert playback.slots[playback.standby].station_id == 2
+    wait_until_playing(playback, 2)
+    # Buffering in the background is not a play.
+    assert len(recorder.audio) == 1
+
+    playback.play(2, stream_urls[1])
+    recorder.wait_for(lambda: len(recorder.audio) == 2)
+    assert recorder.audio[1][:2] == (2, "standby")
+    assert recorder.audio[1][2] < recorder.audio[0][2]
+    # The players swapped; the previous station keeps playing, muted.
+    assert playback.standby is first
+    assert playback.slots[playback.standby].station_id == 1
+    assert playback.standby.audio_get_mute()
+    assert not playback.active.audio_get_mute()
+
+    # Switching back uses the old station on the standby player.
+    playback.play(1, stream_urls[0])
+    recorder.wait_for(lambda: len(recorder.audio) == 3)
+    assert recorder.audio[2][:2] == (1, "standby")
+
+def test_no_standby_without_switching(playback, stream_urls):
+    recorder = playback.recorder
+    playback.play(1, stream_urls[0], keep_previous=False)
+    recorder.wait_for(lambda: len(recorder.audio) == 1)
+    playback.play(2, stream_urls[1], keep_previous=False)
+    recorder.wait_for(lambda: len(recorder.audio) == 2)
+    assert recorder.audio[1][:2] == (2, "cold")
+    # The previous station was stopped, not kept streaming muted.
+    assert playback.slots[playback.standby].station_id is None
+    assert not playback.standby.is_playing()
+    assert playback.slots[playback.active].station_id == 2
+
+def test_play_times_rows(playback, stream_urls, tmp_path):
+    recorder = playback.recorder
+    playback.play(1, stream_urls[0])
+    recorder.wait_for(lambda: len(recorder.audio) == 1)
+    playback.prepare(2, stream_urls[1])
+    wait_until_playing(playback, 2)
+    playback.play(2, stream_urls[1])
+    recorder.wait_for(lambda: len(recorder.audio) == 2)
+
+    rows = play_times(str(tmp_path / "radio.db"), 2)
+    assert [(station_id, url, mode) for station_id, url, mode, ttfa_ms in rows] == [
+        (1, stream_urls[0], "cold"),
+        (2, stream_urls[1], "standby"),
+    ]
+    assert all(ttfa_ms > 0 for *_, ttfa_ms in rows)
+
+def test_error_is_reported(playback):
+    recorder = playback.recorder
+    # A port nothing listens on.
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    url = f"http://127.0.0.1:{port}/gone.wav"
+    playback.play(3, url)
+    recorder.wait_for(lambda: recorder.errors)
+    assert recorder.errors[0] == (3, url, True)
+    assert not recorder.audio
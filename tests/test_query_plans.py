@@ -0,0 +1,83 @@
+"""
+EXPLAIN QUERY PLAN checks of the player's queries against a small catalog
+built from a synthetic corpus. Run from the repository root:
+
+    python -m pytest tests
+"""
+from unittest import mock
+
+import pytest
+
+import build_db
+import queries
+from benchmarks.corpus import generate_corpus
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("catalog")
+    generate_corpus(str(tmp / "playlists"), 2000, 100)
+    with mock.patch("builtins.print"):
+        build = build_db.create_database(str(tmp / "radio.db"))
+        build_db.populate_database(build, str(tmp / "playlists"))
+        build.close()
+    return str(tmp / "radio.db")
+
+@pytest.fixture(scope="module")
+def conn(db_path):
+    conn = queries.connect(db_path)
+    yield conn
+    conn.close()
+
+@pytest.mark.parametrize("name", sorted(queries.FILTERED_QUERIES))
+def test_filtered_query_searches_an_index(conn, name):
+    sql, params = queries.FILTERED_QUERIES[name]
+    steps = queries.explain(conn, sql, params)
+    assert queries.plan_problems(steps) == [], steps
+
+@pytest.mark.parametrize("name", sorted(queries.PAGED_QUERIES))
+def test_station_page_is_read_in_index_order(conn, name):
+    sql, params = queries.PAGED_QUERIES[name]
+    steps = queries.explain(conn, sql, params)
+    assert not any(step.startswith("USE TEMP B-TREE") for step in steps), steps
+    assert queries.plan_problems(steps, paged=True) == [], steps
+
+@pytest.mark.parametrize("direction", ["first", "after", "before"])
+def test_selection_page_is_read_in_index_order(conn, direction):
+    queries.set_station_filter(conn, [1, 2, 3])
+    params = () if direction == "first" else ("", 0)
+    steps = queries.explain(conn, queries.STATION_PAGE_SQL["selection", direction], (*params, queries.STATION_PAGE_SIZE))
+    assert queries.plan_problems(steps, paged=True) == [], steps
+
+def test_check_query_plans_passes(conn):
+    assert queries.check_query_plans(conn) == []
+
+def test_check_query_plans_flags_a_sorted_genre_page(db_path):
+    # A connection of its own: cached EXPLAIN statements keep their old plan.
+    conn = queries.connect(db_path)
+    try:
+        conn.execute("BEGIN")
+        conn.execute("DROP INDEX idx_station_genres_genre_name")
+        problems = queries.check_query_plans(conn)
+    finally:
+        conn.rollback()
+        conn.close()
+    names = {name for name, step in problems}
+    assert "station_page_genre_after" in names
+    assert any("TEMP B-TREE" in step for name, step in problems)
+
+def test_genre_pages_list_the_whole_genre_in_order(conn):
+    genre = queries.get_genres(conn)[0]
+    expected = queries.get_stations(conn, genre=genre)
+    assert expected == sorted(expected, key=lambda row: (row[1], row[0]))
+    rows = []
+    after = None
+    while True:
+        page = queries.get_station_page(conn, genre=genre, after=after, limit=37)
+        if not page:
+            break
+        rows += page
+        after = (page[-1][1], page[-1][0])
+    assert rows == expected
+    middle = rows[len(rows) // 2]
+    before = queries.get_station_page(conn, genre=genre, before=(middle[1], middle[0]), limit=5)
+    assert before == rows[len(rows) // 2 - 5:len(rows) // 2]
@@ -1,64 +1,65 @@
-
 import sqlite3
 import os
 import glob
-import re
 
-def update_logo_urls():
+import metrics
+from build_db import DB_PATH, PLAYLIST_ROOT, built_with_grouping, iter_m3u, station_keys
+
+def update_logo_urls(db_path=DB_PATH, m3u_directory=PLAYLIST_ROOT):
     """
     Parses all .m3u files to find tvg-logo attributes and updates the
     logo_url field for the corresponding station in the radio.db database.
+
+    build_db.py now stores tvg-logo while it ingests the playlists, so this
+    pass is only needed to backfill databases built by older versions.
     """
-    db_path = 'radio.db'
-    m3u_directory = 'm3u-radio-music-playlists'
-    
     if not os.path.exists(db_path):
         print(f"Error: Database '{db_path}' not found. Please run build_db.py first.")
         return
 
     conn = sqlite3.connect(db_path)
     c = conn.cursor()
-    
+
     print("Starting to update logo URLs...")
-    
-    # Regex to find tvg-logo
-    logo_regex = re.compile(r'tvg-logo="([^"]+)"')
-    
+
+    # Entries are matched to stations through any of their URLs, keyed the way
+    # the build that wrote station_mirrors keyed them (grouped or
+    # --keep-duplicates); databases built before that have one station per URL.
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'station_mirrors'")
+    if c.fetchone():
+        group_duplicates = built_with_grouping(conn)
+        update_sql = "UPDATE stations SET logo_url = ? WHERE id = (SELECT station_id FROM station_mirrors WHERE url_key = ?)"
+        entry_key = lambda station: station_keys(station["name"], station["url"], group_duplicates)[0]
+    else:
+        update_sql = "UPDATE stations SET logo_url = ? WHERE url = ?"
+        entry_key = lambda station: station["url"]
+
     # Use glob to find all .m3u files recursively
     m3u_files = glob.glob(os.path.join(m3u_directory, '**', '*.m3u'), recursive=True)
-    
-    updated_count = 0
-    
+
+    updates = []
     for m3u_file in m3u_files:
         try:
-            with open(m3u_file, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-                i = 0
-                while i < len(lines):
-                    if lines[i].startswith("#EXTINF"):
-                        # The stream URL is expected on the next line
-                        if i + 1 < len(lines):
-                            stream_url = lines[i+1].strip()
-                            
-                            # Search for the logo in the #EXTINF line
-                            match = logo_regex.search(lines[i])
-                            if match:
-                                logo_url = match.group(1)
-                                
-                                # Update the database
-                                c.execute("UPDATE stations SET logo_url = ? WHERE url = ?", (logo_url, stream_url))
-                                if c.rowcount > 0:
-                                    updated_count += 1
-                        i += 2 # Move to the line after the URL
-                    else:
-                        i += 1
+            with metrics.timer("update_logos.parse_playlist", file=os.path.basename(m3u_file)):
+                for station in iter_m3u(m3u_file):
+                    logo_url = station["attributes"].get("tvg-logo")
+                    if logo_url:
+                        updates.append((logo_url, entry_key(station)))
         except Exception as e:
+            metrics.count("update_logos.playlist_errors")
             print(f"Error processing file {m3u_file}: {e}")
 
-    conn.commit()
+    # One transaction; each update is an index lookup.
+    with metrics.timer("update_logos.update", rows=len(updates)):
+        c.executemany(update_sql, updates)
+        updated_count = c.rowcount
+        conn.commit()
+    metrics.count("update_logos.logos_updated", updated_count)
     conn.close()
-    
+
     print(f"Finished. Updated {updated_count} station logos.")
 
 if __name__ == "__main__":
     update_logo_urls()
+
+
@@ -0,0 +1,92 @@
+"""
+Background work for the player: a fixed set of worker threads taking tasks
+from a priority queue.
+
+Every selection in the station list starts a new generation. Queued tasks
+from older generations are dropped instead of run; the player's widget
+callbacks compare their station or logo with the current selection, so
+results for stations the user has already moved past never overwrite the
+current one. Tasks are keyed, so the
+same work (a station's status probe, a logo download) is queued at most
+once; asking for it again at a higher priority moves it up.
+"""
+import heapq
+import itertools
+import threading
+
+# Lower runs first.
+PRIORITY_STATUS = 0
+PRIORITY_LOGO = 1
+PRIORITY_SCRAPE = 2
+PRIORITY_PREFETCH = 3
+
+WORKERS = 4
+
+class Task:
+    __slots__ = ("key", "function", "args", "priority", "generation", "dropped", "running")
+
+    def __init__(self, key, function, args, priority, generation):
+        self.key = key
+        self.function = function
+        self.args = args
+        self.priority = priority
+        self.generation = generation
+        self.dropped = False
+        self.running = False
+
+class WorkQueue:
+    def __init__(self, workers=WORKERS):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count() # keeps FIFO order within a priority
+        self.tasks = {} # key -> queued or running Task
+        self.generation = 0
+        for index in range(workers):
+            threading.Thread(target=self.worker, name=f"player-worker-{index}", daemon=True).start()
+
+    def next_generation(self):
+        """Starts a new generation; queued work of the previous ones will be dropped."""
+        with self.condition:
+            self.generation += 1
+            return self.generation
+
+    def submit(self, key, function, *args, priority=PRIORITY_PREFETCH):
+        """
+        Queues function(*args) for the current generation unless a task with
+        the same key is already running or queued at the same or a higher
+        priority; such a task is adopted by the current generation instead.
+        """
+        with self.condition:
+            task = self.tasks.get(key)
+            if task is not None and (task.running or task.priority <= priority):
+                task.generation = self.generation
+                return
+            if task is not None:
+                task.dropped = True
+            task = self.tasks[key] = Task(key, function, args, priority, self.generation)
+            heapq.heappush(self.heap, (priority, next(self.counter), task))
+            self.condition.notify()
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while True:
+                    while not self.heap:
+                        self.condition.wait()
+                    task = heapq.heappop(self.heap)[2]
+                    if task.dropped:
+                        continue
+                    if task.generation != self.generation:
+                        # Superseded by a newer selection.
+                        del self.tasks[task.key]
+                        continue
+                    task.running = True
+                    break
+            try:
+                task.function(*task.args)
+            except Exception as e:
+                print(f"Background task {task.key} failed: {e}")
+            finally:
+                with self.condition:
+                    if self.tasks.get(task.key) is task:
+                        del self.tasks[task.key]